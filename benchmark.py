@@ -0,0 +1,385 @@
+"""
+流水线基准测试：用合成媒体和替身 ASR 模型测量各阶段耗时，不需要 GPU、网络或真实模型。
+用于发现模型以外开销 (解码、加载、分块导出、SRT 生成与写入) 的性能回退，并比较不同的流水线方案。
+
+示例:
+    python benchmark.py --duration 600 --kind video --variants default,temp_files,streaming
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+import main
+
+# 每个方案对应传给转录函数的参数；streaming 走 transcribe_media_streaming
+BENCHMARK_VARIANTS = {
+    "default": {},
+    "temp_files": {"in_memory": False},
+    "streaming": {"streaming": True},
+    "vad": {"vad_enabled": True},
+    "overlap": {"chunk_overlap_ms": 2000},
+    # 分片方案中替身模型被传给 4 个工作进程并在其中推理，inference 阶段不计入本进程，只比较 total；
+    # 工作进程池跨多次运行复用，启动耗时只计入第一次运行 (取中位数时被排除)
+    "sharded": {"shard_workers": 4},
+}
+
+
+# --- 合成媒体 ---
+def write_synthetic_wav(output_path: str, duration_s: float, sample_rate: int = 44100):
+    """不依赖 ffmpeg 生成合成音频 (正弦波 + 噪声，每 10 秒末尾 2 秒静音)。"""
+    sample_rng = np.random.default_rng(0)
+    sample_times = np.arange(int(duration_s * sample_rate)) / sample_rate
+    waveform = 0.3 * np.sin(2 * np.pi * 440 * sample_times)
+    waveform += 0.02 * sample_rng.standard_normal(len(sample_times))
+    waveform[(sample_times % 10) >= 8] = 0.0
+    with wave.open(output_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((waveform * 32767).astype(np.int16).tobytes())
+    return output_path
+
+
+def generate_synthetic_media(output_dir: str, duration_s: float, kind: str = "audio") -> str:
+    """
+    用 ffmpeg lavfi 生成指定时长的合成媒体：440Hz 正弦波叠加低电平噪声，每 10 秒末尾 2 秒静音。
+    ARGS:
+        kind: "audio" 生成 44.1kHz 立体声 WAV (需要重采样)；"video" 生成带测试画面的 MP4；
+              "pcm16k" 生成已是模型格式的 16kHz 单声道 WAV (走免转换的直通路径)。
+    RETURNS:
+        生成的文件路径。ffmpeg 不可用或不支持 lavfi 时，audio 退回 numpy 生成，video 抛出 RuntimeError。
+    """
+    audio_filter = (
+        f"sine=frequency=440:sample_rate=44100:duration={duration_s},volume=0.3[tone];"
+        f"anoisesrc=sample_rate=44100:amplitude=0.02:duration={duration_s}[noise];"
+        "[tone][noise]amix=inputs=2,volume='if(lt(mod(t,10),8),1,0)':eval=frame,"
+        "aformat=channel_layouts=stereo[aout]"
+    )
+    if kind == "pcm16k":
+        output_path = os.path.join(output_dir, f"synthetic_{int(duration_s)}s_16k.wav")
+        return write_synthetic_wav(output_path, duration_s, main.TARGET_SAMPLE_RATE)
+    if kind == "video":
+        output_path = os.path.join(output_dir, f"synthetic_{int(duration_s)}s.mp4")
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc=size=320x240:rate=10:duration={duration_s}",
+            "-filter_complex", audio_filter,
+            "-map", "0:v", "-map", "[aout]",
+            "-c:v", "mpeg4", "-c:a", "aac",
+            output_path,
+        ]
+    else:
+        output_path = os.path.join(output_dir, f"synthetic_{int(duration_s)}s.wav")
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-filter_complex", audio_filter,
+            "-map", "[aout]",
+            output_path,
+        ]
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+        return output_path
+    except (OSError, subprocess.CalledProcessError) as e:
+        if kind == "video":
+            raise RuntimeError(f"无法用 ffmpeg 生成合成视频: {e}")
+        print(f"ffmpeg lavfi 不可用 ({e})，改用 numpy 生成合成音频。")
+        return write_synthetic_wav(output_path, duration_s)
+
+
+# --- 替身模型 ---
+class StubHypothesis:
+    def __init__(self, text: str, segments: list):
+        self.text = text
+        self.timestamp = {"segment": segments, "word": [], "char": []}
+
+
+class StubASRModel:
+    """
+    模仿 NeMo ASRModel.transcribe(..., timestamps=True) 输出的替身模型。
+    每次调用耗时 = fixed_latency_s + latency_per_audio_s * 本批音频总时长 (秒)，每 segment_s 秒产生一个分段。
+    """
+
+    def __init__(
+        self,
+        latency_per_audio_s: float = 0.001,
+        fixed_latency_s: float = 0.0,
+        segment_s: float = 4.0,
+    ):
+        self.latency_per_audio_s = latency_per_audio_s
+        self.fixed_latency_s = fixed_latency_s
+        self.segment_s = segment_s
+
+    def transcribe(self, audio, batch_size: int = 1, timestamps: bool = True, **kwargs):
+        durations = []
+        for audio_item in audio:
+            if isinstance(audio_item, str):
+                with wave.open(audio_item, "rb") as wav_file:
+                    durations.append(wav_file.getnframes() / wav_file.getframerate())
+            else:
+                durations.append(len(audio_item) / main.TARGET_SAMPLE_RATE)
+        time.sleep(self.fixed_latency_s + self.latency_per_audio_s * sum(durations))
+
+        hypotheses = []
+        for duration_s in durations:
+            segments = []
+            segment_start = 0.0
+            while segment_start < duration_s - 0.5:
+                segment_end = min(segment_start + self.segment_s, duration_s)
+                segments.append(
+                    {
+                        "start": segment_start,
+                        "end": segment_end,
+                        "segment": f"synthetic words at {segment_start:.0f} seconds",
+                    }
+                )
+                segment_start += self.segment_s
+            hypotheses.append(
+                StubHypothesis(" ".join(s["segment"] for s in segments), segments)
+            )
+        return hypotheses
+
+
+# --- 阶段计时 ---
+class StageTimer:
+    """替换 main 模块中的阶段函数，累计每个阶段的耗时与调用次数；restore() 恢复原函数。"""
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.originals = {}
+
+    def record(self, stage: str, elapsed_s: float):
+        self.seconds[stage] += elapsed_s
+        self.calls[stage] += 1
+
+    def wrap_function(self, stage: str, function_name: str):
+        original_function = getattr(main, function_name)
+        self.originals[function_name] = original_function
+
+        def timed_function(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return original_function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start_time)
+
+        setattr(main, function_name, timed_function)
+
+    def wrap_iterator_function(self, stage: str, function_name: str):
+        """用于返回生成器的函数：计入消费方等待下一个元素的时间。"""
+        original_function = getattr(main, function_name)
+        self.originals[function_name] = original_function
+        timer = self
+
+        def timed_iterator_function(*args, **kwargs):
+            iterator = iter(original_function(*args, **kwargs))
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    timer.record(stage, time.perf_counter() - start_time)
+                    return
+                timer.record(stage, time.perf_counter() - start_time)
+                yield item
+
+        setattr(main, function_name, timed_iterator_function)
+
+    def wrap_method(self, stage: str, owner_class, method_name: str):
+        original_method = getattr(owner_class, method_name)
+        self.originals[(owner_class, method_name)] = original_method
+
+        def timed_method(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return original_method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start_time)
+
+        setattr(owner_class, method_name, timed_method)
+
+    def wrap_model(self, stage: str, model):
+        timer = self
+
+        class TimedModel:
+            def transcribe(self, *args, **kwargs):
+                start_time = time.perf_counter()
+                try:
+                    return model.transcribe(*args, **kwargs)
+                finally:
+                    timer.record(stage, time.perf_counter() - start_time)
+
+        return TimedModel()
+
+    def restore(self):
+        for wrapped_name, original_function in self.originals.items():
+            if isinstance(wrapped_name, tuple):
+                setattr(*wrapped_name, original_function)
+            else:
+                setattr(main, wrapped_name, original_function)
+        self.originals.clear()
+
+
+def run_pipeline_once(
+    media_path: str,
+    output_dir: str,
+    model,
+    variant_options: dict,
+    chunk_length_s: int,
+    batch_size: int,
+) -> dict:
+    """按 Gradio 处理函数的顺序跑一遍完整流水线，返回各阶段耗时 (秒)。"""
+    timer = StageTimer()
+    timer.wrap_function("extract_audio", "extract_audio_from_video")
+    timer.wrap_iterator_function("stream_decode_wait", "stream_pcm_chunks_from_ffmpeg")
+    timer.wrap_function("load_audio", "load_audio_samples")
+    timer.wrap_function("chunk_export", "samples_to_model_input")
+    timer.wrap_function("chunk_export", "write_chunk_wav")
+    timer.wrap_method("srt_write", main.IncrementalSrtWriter, "add_segments")
+    timed_model = timer.wrap_model("inference", model)
+    transcribe_options = {
+        key: value
+        for key, value in variant_options.items()
+        if key not in ("streaming", "shard_workers")
+    }
+    original_shard_workers = main.shard_workers
+    main.shard_workers = variant_options.get("shard_workers", 0)
+
+    extracted_audio_path = None
+    # 与界面一致：分段确定后立即由 IncrementalSrtWriter 写出
+    srt_writer = main.IncrementalSrtWriter(os.path.join(output_dir, "benchmark.srt"))
+    transcribe_options["on_segments_ready"] = srt_writer.add_segments
+    total_start_time = time.perf_counter()
+    try:
+        if variant_options.get("streaming"):
+            segment_timestamps = main.transcribe_media_streaming(
+                timed_model,
+                media_path,
+                chunk_length_s * 1000,
+                batch_size,
+                **transcribe_options,
+            )
+        else:
+            extracted_audio_path = main.extract_audio_from_video(media_path)
+            if not extracted_audio_path:
+                raise RuntimeError(f"音频提取失败: {media_path}")
+            segment_timestamps = main.transcribe_audio_in_chunks(
+                # 计时包装类无法 pickle 给工作进程，分片方案直接传入替身模型
+                model if main.shard_workers > 1 else timed_model,
+                extracted_audio_path,
+                chunk_length_s * 1000,
+                batch_size,
+                **transcribe_options,
+            )
+
+        start_time = time.perf_counter()
+        srt_writer.close(success=True)
+        timer.record("srt_write", time.perf_counter() - start_time)
+
+        # 一次性生成完整 SRT 字符串的耗时，用于对比
+        start_time = time.perf_counter()
+        main.generate_srt_content(segment_timestamps)
+        timer.record("generate_srt_content", time.perf_counter() - start_time)
+    finally:
+        srt_writer.close(success=False)
+        timer.restore()
+        main.shard_workers = original_shard_workers
+        main.remove_extracted_audio(extracted_audio_path, media_path)
+
+    stage_seconds = dict(timer.seconds)
+    stage_seconds["total"] = time.perf_counter() - total_start_time
+    stage_seconds["non_model_overhead"] = stage_seconds["total"] - stage_seconds.get(
+        "inference", 0.0
+    )
+    stage_seconds["segments"] = len(segment_timestamps)
+    return stage_seconds
+
+
+def run_benchmark(args) -> dict:
+    # 基准测试不应命中缓存或写入断点日志
+    main.transcription_cache_max_bytes = 0
+    main.checkpoint_enabled = False
+    model = StubASRModel(args.latency, args.fixed_latency)
+    work_dir = tempfile.mkdtemp(prefix="srt_benchmark_")
+    results = {"duration_s": args.duration, "kind": args.kind, "variants": {}}
+    try:
+        media_path = generate_synthetic_media(work_dir, args.duration, args.kind)
+        for variant_name in args.variants.split(","):
+            variant_name = variant_name.strip()
+            if variant_name not in BENCHMARK_VARIANTS:
+                print(f"跳过未知方案: {variant_name}")
+                continue
+            runs = [
+                run_pipeline_once(
+                    media_path,
+                    work_dir,
+                    model,
+                    BENCHMARK_VARIANTS[variant_name],
+                    args.chunk_length,
+                    args.batch_size,
+                )
+                for _ in range(args.repeat)
+            ]
+            # 多次运行取每个阶段的中位数，减少偶发抖动的影响
+            stage_names = sorted({stage for run in runs for stage in run})
+            results["variants"][variant_name] = {
+                stage: round(float(np.median([run.get(stage, 0.0) for run in runs])), 4)
+                for stage in stage_names
+            }
+    finally:
+        main.shutdown_shard_worker_pool()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_benchmark_table(results: dict):
+    media_kind = {"video": "视频", "pcm16k": "16kHz PCM 音频"}.get(results["kind"], "音频")
+    print(
+        f"\n合成{media_kind}时长: {results['duration_s']} 秒"
+        " (各阶段耗时为多次运行的中位数，单位: 秒)"
+    )
+    for variant_name, stage_seconds in results["variants"].items():
+        print(f"\n[{variant_name}]")
+        for stage, value in stage_seconds.items():
+            print(f"  {stage:<22} {value}")
+
+
+def parse_benchmark_args(argv=None):
+    parser = argparse.ArgumentParser(description="用合成媒体和替身模型测量 SRT 流水线各阶段耗时。")
+    parser.add_argument("--duration", type=float, default=300, help="合成媒体时长 (秒，默认 300)")
+    parser.add_argument("--kind", choices=("audio", "video", "pcm16k"), default="audio", help="合成媒体类型")
+    parser.add_argument("--latency", type=float, default=0.001, help="替身模型每秒音频的推理耗时 (秒)")
+    parser.add_argument("--fixed-latency", type=float, default=0.0, help="替身模型每次调用的固定耗时 (秒)")
+    parser.add_argument("--chunk-length", type=int, default=60, help="音频分块长度 (秒)")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次推理合并处理的音频块数量")
+    parser.add_argument("--repeat", type=int, default=3, help="每个方案的运行次数")
+    parser.add_argument(
+        "--variants",
+        default="default",
+        help=f"逗号分隔的方案列表，可选: {','.join(BENCHMARK_VARIANTS)}",
+    )
+    parser.add_argument("--json", help="把结果写入指定 JSON 文件")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    benchmark_args = parse_benchmark_args()
+    if not main.check_ffmpeg():
+        print("警告: FFMPEG 未找到，音频提取阶段将无法运行。")
+    benchmark_results = run_benchmark(benchmark_args)
+    print_benchmark_table(benchmark_results)
+    if benchmark_args.json:
+        with open(benchmark_args.json, "w", encoding="utf-8") as json_file:
+            json.dump(benchmark_results, json_file, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {benchmark_args.json}")
+    sys.exit(0)
@@ -1,19 +1,61 @@
-import nemo.collections.asr as nemo_asr
-import torch
 import os
 import subprocess
 import time
 from pydub import AudioSegment
-import gradio as gr
 import tempfile
 import json
+import sys
+import glob
+import argparse
+import collections
+import contextlib
+import heapq
+import concurrent.futures
+import multiprocessing
+import itertools
+import functools
+import difflib
+import hashlib
+import struct
+import wave
+import queue
+import sqlite3
+import threading
+import gc
+import shutil
+import tarfile
+import numpy as np
 
 CONFIG_FILENAME = "config.json"
+TARGET_SAMPLE_RATE = 16000  # 模型要求的采样率 (单声道 16kHz)
+VAD_FRAME_MS = 30  # 静音检测的帧长 (毫秒)
+TRANSCRIPTION_CACHE_VERSION = 1  # 缓存格式或分段逻辑变化时递增，使旧缓存失效
+NGC_MODEL_NAME = "nvidia/parakeet-tdt-0.6b-v2"  # 从云端加载时使用的模型名称
 asr_model = None  # 初始化模型变量
+model_ready_event = threading.Event()  # 没有进行中的模型加载时处于已就绪状态
+model_ready_event.set()
+model_load_status = "模型未加载。请选择本地模型或从云端加载。"
+asr_model_identity = None  # 当前模型的标识 (NGC 名称或本地文件路径+大小+修改时间)，用于缓存键
 device = None  # 初始化设备变量
 base_dir = os.path.dirname(os.path.abspath(__file__))
 subtitles_folder_name = "subtitles"
 subtitles_folder_path = os.path.join(base_dir, subtitles_folder_name)
+transcription_cache_folder_path = os.path.join(base_dir, "transcription_cache")
+transcription_cache_max_bytes = 500 * 1024 * 1024  # 由 config.json 的 cache_max_mb 覆盖，0 表示禁用
+checkpoint_folder_path = os.path.join(base_dir, "checkpoints")
+checkpoint_enabled = True  # 由 config.json 的 checkpoint_enabled 覆盖
+model_cache_folder_path = os.path.join(base_dir, "model_cache")  # 解压后的 .nemo 模型目录
+watch_ledger_path = os.path.join(base_dir, "watch_ledger.jsonl")  # 监视文件夹模式的处理记录
+transcript_store_path = os.path.join(base_dir, "transcripts.sqlite3")  # 字幕检索库 (SQLite + FTS5)
+transcript_store_enabled = True  # 由 config.json 的 transcript_store_enabled 覆盖
+shard_workers = 0  # 由 config.json 的 shard_workers 覆盖，大于 1 时在 CPU 上把单个文件分片给多个进程转录
+shard_worker_model = None  # 分片工作进程中使用的模型，由 init_shard_worker 从主进程传入 (权重在共享内存中)
+CPU_PROFILES = ("default", "tuned", "int8", "bf16")  # 可选的 CPU 推理配置
+cpu_profile = "default"  # 由 config.json 的 cpu_profile 覆盖，仅在 CPU 上运行时生效
+metrics_log_path = os.path.join(base_dir, "logs", "metrics.jsonl")
+metrics_log_enabled = True  # 由 config.json 的 metrics_log_enabled 覆盖
+ffmpeg_capabilities = None  # 由 get_ffmpeg_capabilities 在首次调用时检测并缓存
+ffmpeg_capabilities_lock = threading.Lock()
 
 # --- 配置管理 ---
 
@@ -28,13 +70,29 @@ def get_config_file_path():
     return os.path.join(script_dir, CONFIG_FILENAME)
 
 
-def save_config(local_model_path: str, chunk_length: int):
-    """将当前配置保存到 config.json。"""
-    config = {
-        "local_model_path": local_model_path,  # NGC 为空字符串，本地为路径，如果从未选择则为 None
-        "chunk_length_s": chunk_length,
-    }
+def save_config(
+    local_model_path: str, chunk_length: int, batch_size: int = 1, cpu_profile: str = None
+):
+    """将当前配置保存到 config.json。
+    仅覆盖这里传入的键，配置文件中已有的其它设置 (例如手动修改的 streaming_mode) 会被保留。
+    """
     config_file_path = get_config_file_path()
+    config = {}
+    if os.path.exists(config_file_path):
+        try:
+            with open(config_file_path, "r", encoding="utf-8") as config_file:
+                config = json.load(config_file)
+        except (OSError, json.JSONDecodeError):
+            config = {}
+    config.update(
+        {
+            "local_model_path": local_model_path,  # NGC 为空字符串，本地为路径，如果从未选择则为 None
+            "chunk_length_s": chunk_length,
+            "batch_size": batch_size,
+        }
+    )
+    if cpu_profile is not None:
+        config["cpu_profile"] = cpu_profile
     try:
         with open(config_file_path, "w", encoding="utf-8") as config_file:
             json.dump(config, config_file, indent=4)
@@ -45,21 +103,44 @@ def save_config(local_model_path: str, chunk_length: int):
 
 def load_config() -> dict:
     """从 config.json 加载配置。
-    返回一个包含 'local_model_path' (可以为 None) 和 'chunk_length_s' 的字典。
+    返回一个包含 'local_model_path' (可以为 None)、'chunk_length_s'、'batch_size'、
+    'streaming_mode'、'vad_enabled'、'vad_threshold_db'、'chunk_overlap_s'、'cache_max_mb'
+    'checkpoint_enabled'、'prefetch_depth'、'max_concurrent_jobs'、'cpu_profile'、
+    'metrics_log_enabled'、'metrics_port'、'model_memory_budget_mb'、'shard_workers'、
+    'watch_folders'、'watch_poll_interval_s'、'watch_stable_s'、'watch_queue_size'、'watch_job_priority'
+    和 'transcript_store_enabled' 的字典。
     """
     config_file_path = get_config_file_path()
     default_config = {
         "local_model_path": None,
         "chunk_length_s": 60,
+        "batch_size": 1,
+        "streaming_mode": False,
+        "vad_enabled": False,
+        "vad_threshold_db": -40.0,
+        "chunk_overlap_s": 0,
+        "cache_max_mb": 500,
+        "checkpoint_enabled": True,
+        "prefetch_depth": 1,
+        "max_concurrent_jobs": 1,
+        "cpu_profile": "default",
+        "metrics_log_enabled": True,
+        "metrics_port": 0,
+        "model_memory_budget_mb": 0,
+        "shard_workers": 0,
+        "watch_folders": [],
+        "watch_poll_interval_s": 5,
+        "watch_stable_s": 10,
+        "watch_queue_size": 8,
+        "watch_job_priority": -1,
+        "transcript_store_enabled": True,
     }  # None 表示尚未做出选择
 
     if os.path.exists(config_file_path):
         try:
             with open(config_file_path, "r", encoding="utf-8") as config_file:
-                loaded_config = json.load(config_file)
-                # 确保基本键存在，如果不存在则提供默认值
-                loaded_config.setdefault("local_model_path", None)
-                loaded_config.setdefault("chunk_length_s", 60)
+                # 缺少的键取默认值，默认值只在 default_config 中声明一次
+                loaded_config = {**default_config, **json.load(config_file)}
                 print(f"配置已从 {config_file_path} 加载: {loaded_config}")
                 return loaded_config
         except json.JSONDecodeError:
@@ -87,36 +168,105 @@ def load_asr_model_globally(
     load_from_ngc_explicitly: bool = False,
     save_choice_on_success: bool = False,
     current_chunk_value: int = 60,
+    current_batch_size: int = 1,
+    current_cpu_profile: str = None,
 ) -> str:
-    global asr_model, device
+    """
+    加载模型 (已常驻内存时直接切换) 作为界面当前使用的模型。加载前先等待正在运行的任务结束；
+    加载期间 model_ready_event 处于未就绪状态，此时提交的任务会等待加载结束，而不是直接报告 "模型未加载"。
+    在 CPU 上运行时按 cpu_profile (或传入的 current_cpu_profile) 应用 CPU 推理配置。
+    """
+    global model_load_status, cpu_profile
+    if current_cpu_profile is not None:
+        cpu_profile = current_cpu_profile
+    # 等待正在使用当前模型的任务全部结束，加载期间不启动新任务
+    with job_scheduler.exclusive_model_access():
+        model_ready_event.clear()
+        try:
+            status_msg = load_asr_model_from_source(
+                local_model_path_to_try,
+                load_from_ngc_explicitly,
+                save_choice_on_success,
+                current_chunk_value,
+                current_batch_size,
+            )
+            if asr_model is not None and device is not None and device.type == "cpu":
+                status_msg = f"{status_msg} (CPU 推理配置: {cpu_profile})"
+            model_load_status = status_msg
+            return status_msg
+        finally:
+            model_ready_event.set()
 
-    print("正在尝试加载 ASR 模型...")
 
-    if torch.cuda.is_available():
-        current_device = torch.device("cuda")
-        print("检测到 CUDA GPU，将在 GPU 上运行。")
-    else:
-        current_device = torch.device("cpu")
-        print("警告：未检测到 CUDA GPU，将在 CPU 上运行，速度可能较慢。")
-    device = current_device
+def warm_up_asr_model(model):
+    """用 1 秒合成音频 (低电平噪声叠加正弦波) 预热模型，让首个真实任务不再承担一次性的初始化开销。"""
+    print("正在预热模型...")
+    warm_up_start = time.time()
+    sample_times = np.arange(TARGET_SAMPLE_RATE) / TARGET_SAMPLE_RATE
+    waveform = 0.1 * np.sin(2 * np.pi * 440 * sample_times) + 0.01 * np.random.default_rng(
+        0
+    ).standard_normal(TARGET_SAMPLE_RATE)
+    warm_up_samples = (waveform * 32767).astype(np.int16)
+    try:
+        for _ in iter_chunk_transcriptions(model, [(0, 1000, warm_up_samples)]):
+            pass
+        print(f"模型预热完成，耗时 {time.time() - warm_up_start:.2f} 秒。")
+    except Exception as e:
+        print(f"模型预热失败 (不影响后续使用): {e}")
+
+
+def start_background_model_load(config: dict):
+    """在后台线程中按配置自动加载模型，界面无需等待即可启动。"""
+
+    def load_in_background():
+        global model_load_status
+        try:
+            model_load_status = load_saved_model_from_config(config)
+        except Exception as e:
+            model_load_status = f"后台加载模型时发生错误: {e}"
+            print(model_load_status)
+        finally:
+            model_ready_event.set()
+
+    model_ready_event.clear()
+    threading.Thread(target=load_in_background, name="asr-model-loader", daemon=True).start()
+
+
+def load_asr_model_from_source(
+    local_model_path_to_try: str = None,
+    load_from_ngc_explicitly: bool = False,
+    save_choice_on_success: bool = False,
+    current_chunk_value: int = 60,
+    current_batch_size: int = 1,
+) -> str:
+    global asr_model, asr_model_identity
+    print("正在尝试加载 ASR 模型...")
+    get_inference_device()
     asr_model = None  # 在尝试加载前重置模型状态
+    asr_model_identity = None
 
     # 场景1：明确从NGC加载
     if load_from_ngc_explicitly:
-        print("尝试从云端NVIDIA NGC加载模型 'nvidia/parakeet-tdt-0.6b-v2'...")
+        print(f"尝试从云端NVIDIA NGC加载模型 '{NGC_MODEL_NAME}'...")
         try:
-            asr_model = nemo_asr.models.ASRModel.from_pretrained(
-                model_name="nvidia/parakeet-tdt-0.6b-v2", map_location=device
+            asr_model, asr_model_identity, was_resident = get_or_load_model(
+                f"ngc:{NGC_MODEL_NAME}"
+            )
+            status_msg = f"云端模型 '{NGC_MODEL_NAME}' " + (
+                "已在内存中，直接切换。" if was_resident else "加载成功。"
             )
-            status_msg = "云端模型 'nvidia/parakeet-tdt-0.6b-v2' 加载成功。"
             print(status_msg)
             if save_choice_on_success:
                 save_config(
-                    local_model_path="", chunk_length=current_chunk_value
+                    local_model_path="",
+                    chunk_length=current_chunk_value,
+                    batch_size=current_batch_size,
+                    cpu_profile=cpu_profile,
                 )  # NGC使用空路径
             return status_msg
         except Exception as e:
             asr_model = None
+            asr_model_identity = None
             status_msg = f"从NGC加载云端模型失败: {e}"
             print(status_msg)
             return status_msg
@@ -135,19 +285,23 @@ def load_asr_model_globally(
 
         print(f"尝试从本地路径加载模型: {actual_path}...")
         try:
-            asr_model = nemo_asr.models.ASRModel.restore_from(
-                restore_path=actual_path, map_location=device
-            )
+            asr_model, asr_model_identity, was_resident = get_or_load_model(actual_path)
             model_name = os.path.basename(actual_path)
-            status_msg = f"本地模型 '{model_name}' 加载成功。"
+            status_msg = f"本地模型 '{model_name}' " + (
+                "已在内存中，直接切换。" if was_resident else "加载成功。"
+            )
             print(status_msg)
             if save_choice_on_success:
                 save_config(
-                    local_model_path=actual_path, chunk_length=current_chunk_value
+                    local_model_path=actual_path,
+                    chunk_length=current_chunk_value,
+                    batch_size=current_batch_size,
+                    cpu_profile=cpu_profile,
                 )
             return status_msg
         except Exception as e:
             asr_model = None
+            asr_model_identity = None
             status_msg = f"从本地路径 '{actual_path}' 加载模型失败: {e}"
             print(status_msg)
             return status_msg
@@ -164,354 +318,4693 @@ def load_asr_model_globally(
     return status_msg
 
 
-# --- 辅助函数 (ffmpeg, 音频处理, SRT 生成) ---
-def check_ffmpeg():
-    try:
-        subprocess.run(["ffmpeg", "-version"], check=True, capture_output=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print(
-            "错误：ffmpeg 未检测到或未正确安装。请安装 ffmpeg 并确保其在系统 PATH 中。"
+def load_saved_model_from_config(config: dict) -> str:
+    """按 config.json 中记录的上次选择自动加载模型 (不重新保存配置)，返回状态信息。"""
+    # saved_model_path 可以是：文件路径 (str)，"" (表示NGC)，或 None (之前未选择)
+    saved_model_path = config.get("local_model_path")
+    chunk_length = config.get("chunk_length_s", 60)
+    if saved_model_path is None:
+        # 这是真正的首次运行（配置文件不存在或 local_model_path 明确为 None）
+        print("首次运行或之前未配置模型。模型不会自动加载，请手动选择。")
+        return "模型未加载。请选择本地模型或从云端加载。"  # 真正首次运行时的默认值
+    if saved_model_path == "":  # 上次选择的是 NGC
+        print("配置中记录上次选择为云端NGC模型，尝试自动重新加载...")
+        return load_asr_model_globally(
+            load_from_ngc_explicitly=True,
+            save_choice_on_success=False,  # 自动加载时不重新保存配置
+            current_chunk_value=chunk_length,
         )
-        return False
+    if os.path.exists(saved_model_path):  # 保存了本地路径且该路径存在
+        print(f"配置中记录本地模型路径: {saved_model_path}，尝试自动重新加载...")
+        return load_asr_model_globally(
+            local_model_path_to_try=saved_model_path,
+            save_choice_on_success=False,  # 自动加载时不重新保存配置
+            current_chunk_value=chunk_length,
+        )
+    # 保存了本地路径，但该路径已不存在
+    error_msg = f"错误：配置文件中的本地模型路径 '{saved_model_path}' 未找到或无效。模型未加载。"
+    print(error_msg)
+    return error_msg
 
 
-def extract_audio_from_video(input_media_path: str) -> str:
+# --- 模型常驻内存 ---
+class ModelRegistry:
     """
-    使用 ffmpeg 从视频文件中提取音频并转换为 WAV 格式。
-    返回提取的音频文件路径，或在失败时返回 None。
+    按模型标识缓存已加载的模型，总占用超过内存预算时按最近最少使用 (LRU) 逐出。
+    预算为 0 时只保留最近使用的一个模型；界面当前使用的模型 (asr_model) 不会被逐出。
+    被逐出的模型若仍被运行中的任务引用，会在任务结束后才真正释放。
     """
-    if not check_ffmpeg():
-        return None
-    temp_audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    output_audio_path = temp_audio_file.name
-    temp_audio_file.close()
 
-    ffmpeg_command = [
-        "ffmpeg",
-        "-i",
-        input_media_path,
-        "-vn",
-        "-acodec",
-        "pcm_s16le",
-        "-ar",
-        "16000",
-        "-ac",
-        "1",
-        "-y",
-        output_audio_path,
-    ]
-    try:
-        process = subprocess.run(
-            ffmpeg_command, check=True, capture_output=True, text=True, errors="ignore"
-        )
-        print(f"音频提取成功到: {output_audio_path}")
-        if os.path.exists(output_audio_path) and os.path.getsize(output_audio_path) > 0:
-            return output_audio_path
-        else:
-            print(f"错误：ffmpeg 命令成功执行，但未生成音频文件：{output_audio_path}")
-            if os.path.exists(output_audio_path):
-                os.remove(output_audio_path)  # 清理空文件
-            return None
-    except subprocess.CalledProcessError as e:
-        print(
-            f"提取音频时发生 FFmpeg 错误：{e}\n标准输出: {e.stdout}\n标准错误: {e.stderr}"
-        )
-        if os.path.exists(output_audio_path):
-            os.remove(output_audio_path)
-        return None
-    except FileNotFoundError:
-        print("错误：未找到 FFmpeg 可执行文件。")
-        return None
+    def __init__(self, memory_budget_mb: float = 0):
+        self.memory_budget_mb = memory_budget_mb
+        self.entries = collections.OrderedDict()  # 注册键 -> {"model", "identity", "memory_mb"}
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()  # 同一时间只加载一个模型，避免重复加载同一模型
 
+    def set_memory_budget_mb(self, memory_budget_mb: float):
+        with self.lock:
+            self.memory_budget_mb = max(0, memory_budget_mb or 0)
+            evicted_keys = self.evict_to_fit_locked(keep_key=None)
+        release_model_memory(evicted_keys)
 
-def preprocess_direct_audio(input_audio_path: str) -> str:
-    if not check_ffmpeg():
-        return None
-    if not input_audio_path or not os.path.exists(input_audio_path):
-        print(f"错误：提供的音频文件路径无效或文件不存在: {input_audio_path}")
-        return None
+    def get(self, registry_key: str):
+        """返回 (model, identity)，未常驻时返回 None。命中的模型移到最近使用的位置。"""
+        with self.lock:
+            entry = self.entries.get(registry_key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(registry_key)
+            return entry["model"], entry["identity"]
 
-    temp_processed_audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    output_wav_path = temp_processed_audio_file.name
-    temp_processed_audio_file.close()
+    def add(self, registry_key: str, model, identity: str, memory_mb: float):
+        with self.lock:
+            self.entries[registry_key] = {
+                "model": model,
+                "identity": identity,
+                "memory_mb": memory_mb,
+            }
+            self.entries.move_to_end(registry_key)
+            evicted_keys = self.evict_to_fit_locked(keep_key=registry_key)
+        release_model_memory(evicted_keys)
 
-    ffmpeg_command = [
-        "ffmpeg",
-        "-i",
-        input_audio_path,
-        "-acodec",
-        "pcm_s16le",
-        "-ar",
-        "16000",
-        "-ac",
-        "1",
-        "-y",
-        output_wav_path,
-    ]
+    def evict(self, registry_key: str) -> bool:
+        with self.lock:
+            removed = self.entries.pop(registry_key, None) is not None
+        if removed:
+            release_model_memory([registry_key])
+        return removed
+
+    def evict_to_fit_locked(self, keep_key: str) -> list:
+        """在持有 self.lock 时调用：从最久未使用的模型开始逐出，直到总占用不超过预算。"""
+        evicted_keys = []
+        for registry_key in list(self.entries):
+            total_memory_mb = sum(entry["memory_mb"] for entry in self.entries.values())
+            if self.memory_budget_mb > 0:
+                if total_memory_mb <= self.memory_budget_mb:
+                    break
+            elif len(self.entries) <= 1:
+                break
+            entry = self.entries[registry_key]
+            if registry_key == keep_key or entry["model"] is asr_model:
+                continue
+            del self.entries[registry_key]
+            evicted_keys.append(registry_key)
+        return evicted_keys
+
+    def list_models(self) -> list:
+        """按从最久未使用到最近使用的顺序返回常驻模型的摘要，供界面和日志显示。"""
+        with self.lock:
+            return [
+                {
+                    "model": registry_key,
+                    "memory_mb": round(entry["memory_mb"], 1),
+                    "current": entry["model"] is asr_model,
+                }
+                for registry_key, entry in self.entries.items()
+            ]
+
+
+model_registry = ModelRegistry()
+
+
+def release_model_memory(evicted_keys: list):
+    """逐出模型后回收内存；GPU 上同时释放 PyTorch 缓存的显存。"""
+    if not evicted_keys:
+        return
+    for registry_key in evicted_keys:
+        print(f"模型 '{registry_key}' 超出内存预算，已从内存中逐出。")
+    shutdown_shard_worker_pool_if_evicted()
+    gc.collect()
+    torch_module = sys.modules.get("torch")
+    if torch_module is not None and torch_module.cuda.is_available():
+        torch_module.cuda.empty_cache()
+
+
+def estimate_model_memory_mb(model, fallback_path: str = None) -> float:
+    """按参数和缓冲区的字节数估算模型占用的内存；无法统计时退回模型文件大小。"""
+    total_bytes = 0
     try:
-        process = subprocess.run(
-            ffmpeg_command, check=True, capture_output=True, text=True, errors="ignore"
-        )
-        print(f"直接音频预处理成功: {input_audio_path} -> {output_wav_path}")
-        if os.path.exists(output_wav_path) and os.path.getsize(output_wav_path) > 0:
-            return output_wav_path
-        else:
-            print(f"错误：ffmpeg 命令执行，但未生成有效音频文件：{output_wav_path}")
-            if os.path.exists(output_wav_path):
-                os.remove(output_wav_path)  # 清理
-            return None
-    except subprocess.CalledProcessError as e:
-        print(
-            f"预处理直接音频 '{input_audio_path}' 时发生 FFmpeg 错误：{e}\n标准输出: {e.stdout}\n标准错误: {e.stderr}"
-        )
-        if os.path.exists(output_wav_path):
-            os.remove(output_wav_path)
-        return None
-    return None
+        for tensor in itertools.chain(model.parameters(), model.buffers()):
+            total_bytes += tensor.numel() * tensor.element_size()
+    except Exception:
+        total_bytes = 0
+    if total_bytes == 0 and fallback_path and os.path.isfile(fallback_path):
+        total_bytes = os.path.getsize(fallback_path)
+    return total_bytes / (1024 * 1024)
 
 
-def format_srt_time(seconds):
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    milliseconds = int((seconds * 1000) % 1000)
-    return f"{hours:02}:{minutes:02}:{secs:02},{milliseconds:03}"
+def get_inference_device():
+    """检测推理设备 (CUDA GPU 优先) 并记录到全局变量 device。"""
+    global device
+    if device is None:
+        import torch
+
+        if torch.cuda.is_available():
+            device = torch.device("cuda")
+            print("检测到 CUDA GPU，将在 GPU 上运行。")
+        else:
+            device = torch.device("cpu")
+            print("警告：未检测到 CUDA GPU，将在 CPU 上运行，速度可能较慢。")
+    return device
 
 
-def transcribe_audio_in_chunks(model, audio_path: str, chunk_length_ms: int) -> list:
+def parse_model_source(model_source: str):
     """
-    将音频文件分块转录并返回带有全局时间戳的段列表。
-    ARGS:
-        model: 已加载的 NeMo ASR 模型。
-        audio_path: 音频文件路径 (假设为 WAV)。
-        chunk_length_ms: 每块的长度（毫秒）。
+    解析模型来源。
     RETURNS:
-        包含 {'start': float, 'end': float, 'segment': str} 的列表。
-
+        ("ngc", 模型名称) 或 ("local", 绝对路径)。"ngc:<名称>" 表示从云端加载，其余视为本地 .nemo 路径。
     """
-    if model is None:
-        print("模型未加载，无法进行转录。")
-        return []
-    if not audio_path or not os.path.exists(audio_path):
-        print(f"错误: 音频文件路径 '{audio_path}' 无效或文件不存在。")
-        return []
+    model_source = model_source.strip()
+    if model_source.startswith("ngc:"):
+        return "ngc", model_source[len("ngc:"):].strip() or NGC_MODEL_NAME
+    return "local", os.path.abspath(model_source)
 
-    print(f"正在加载音频文件 '{audio_path}' 进行分块处理...")
-    try:
-        audio = AudioSegment.from_wav(audio_path)  # 假设已预处理为 WAV
-        audio = audio.set_frame_rate(16000).set_channels(1)  # 确保格式
-    except Exception as e:
-        print(f"加载或处理音频文件 '{audio_path}' 时发生错误 (pydub): {e}")
-        return []
 
-    audio_duration_ms = len(audio)
-    print(f"音频总时长: {audio_duration_ms / 1000:.2f} 秒")
-    all_segment_timestamps = []
+def get_model_registry_key(source_type: str, source_value: str) -> str:
+    """
+    返回模型在常驻登记中的键。本地模型包含文件大小和修改时间，同一路径下替换了模型文件时会重新加载；
+    在 CPU 上以非 default 配置运行时附加配置名，不同配置的模型分别常驻。
+    """
+    if source_type == "ngc":
+        registry_key = f"ngc:{source_value}"
+    else:
+        model_file_stat = os.stat(source_value)
+        registry_key = f"local:{source_value}:{model_file_stat.st_size}:{model_file_stat.st_mtime_ns}"
+    if device is not None and device.type == "cpu" and cpu_profile != "default":
+        registry_key = f"{registry_key}|cpu:{cpu_profile}"
+    return registry_key
 
-    for i in range(0, audio_duration_ms, chunk_length_ms):
-        start_time_ms = i
-        end_time_ms = min(i + chunk_length_ms, audio_duration_ms)
-        chunk = audio[start_time_ms:end_time_ms]
 
-        temp_chunk_file_path = ""  # 在 try 块外部定义
-        try:
-            with tempfile.NamedTemporaryFile(
-                suffix=".wav", delete=False
-            ) as temp_chunk_file:
-                temp_chunk_file_path = temp_chunk_file.name
-            chunk.export(temp_chunk_file_path, format="wav")
-            print(
-                f"处理音频块: {start_time_ms / 1000:.2f}s - {end_time_ms / 1000:.2f}s"
-            )
+@contextlib.contextmanager
+def exclusive_file_lock(lock_path: str):
+    """跨进程的独占文件锁 (POSIX 用 fcntl.flock，Windows 用 msvcrt.locking)，阻塞直到取得锁。"""
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, "a+b") as lock_file:
+        if os.name == "nt":
+            import msvcrt
 
-            chunk_output_list = model.transcribe(
-                [temp_chunk_file_path], batch_size=1, timestamps=True
-            )
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK 重试约 10 秒仍未取得时抛出 OSError，继续等待
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
 
-            if (
-                chunk_output_list
-                and hasattr(chunk_output_list[0], "timestamp")
-                and chunk_output_list[0].timestamp
-                and "segment" in chunk_output_list[0].timestamp
-            ):
-                current_chunk_segments = chunk_output_list[0].timestamp["segment"]
-                chunk_global_start_offset_sec = start_time_ms / 1000.0
-                for segment_data in current_chunk_segments:
-                    local_start_sec = segment_data["start"]
-                    local_end_sec = segment_data["end"]
-                    text_content = segment_data.get(
-                        "segment", segment_data.get("text", "")
-                    )
-                    global_start_sec = local_start_sec + chunk_global_start_offset_sec
-                    global_end_sec = local_end_sec + chunk_global_start_offset_sec
-                    if global_end_sec < global_start_sec:  # 安全检查
-                        global_end_sec = global_start_sec + 0.05
-                    all_segment_timestamps.append(
-                        {
-                            "start": global_start_sec,
-                            "end": global_end_sec,
-                            "segment": text_content,
-                        }
-                    )
-            else:
-                full_text = chunk_output_list[0].text if chunk_output_list else "N/A"
-                print(f"警告: 音频块未能生成分段时间戳。完整转录: '{full_text}'.")
-        except Exception as e:
-            print(f"转录音频块 '{temp_chunk_file_path}' 时发生错误: {e}")
-            import traceback
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
-            traceback.print_exc()
-        finally:
-            if temp_chunk_file_path and os.path.exists(temp_chunk_file_path):
-                try:
-                    os.remove(temp_chunk_file_path)
-                except OSError as e_os:
-                    print(
-                        f"删除临时音频文件 '{temp_chunk_file_path}' 时发生OS错误: {e_os}"
-                    )
 
-    all_segment_timestamps.sort(key=lambda x: x["start"])
-    return all_segment_timestamps
+def extract_nemo_archive(nemo_file_path: str) -> str:
+    """
+    把 .nemo 文件 (tar 归档) 解压到 model_cache 目录并返回解压目录，已解压过时直接返回。
+    目录名由路径哈希、文件大小和修改时间组成，模型文件被替换后旧的解压目录会被清理。
+    解压过程持有按路径哈希命名的文件锁，多个进程或线程同时加载同一模型时只有一个在解压，其余等待后直接使用结果。
+    """
+    model_file_stat = os.stat(nemo_file_path)
+    path_hash = hashlib.sha1(os.path.abspath(nemo_file_path).encode("utf-8")).hexdigest()[:16]
+    extracted_dir_name = f"{path_hash}-{model_file_stat.st_size}-{model_file_stat.st_mtime_ns}"
+    extracted_dir = os.path.join(model_cache_folder_path, extracted_dir_name)
+    if os.path.isdir(extracted_dir):
+        print(f"使用已解压的模型缓存: {extracted_dir}")
+        return extracted_dir
 
+    os.makedirs(model_cache_folder_path, exist_ok=True)
+    with exclusive_file_lock(os.path.join(model_cache_folder_path, f"{path_hash}.lock")):
+        # 等待锁期间其它进程可能已解压完成
+        if os.path.isdir(extracted_dir):
+            print(f"使用已解压的模型缓存: {extracted_dir}")
+            return extracted_dir
+        # 只清理同一路径下旧版本模型文件的解压目录；.partial 是其它进程正在写入的临时目录，不能删除
+        for stale_dir in glob.glob(os.path.join(model_cache_folder_path, f"{path_hash}-*")):
+            stale_dir_name = os.path.basename(stale_dir)
+            if stale_dir_name != extracted_dir_name and not stale_dir_name.endswith(".partial"):
+                shutil.rmtree(stale_dir, ignore_errors=True)
+        print(f"首次加载，正在解压模型到 {extracted_dir} ...")
+        # 先解压到临时目录再改名，中途失败不会留下不完整的缓存
+        temp_dir = tempfile.mkdtemp(
+            prefix=f"{path_hash}-", suffix=".partial", dir=model_cache_folder_path
+        )
+        try:
+            with tarfile.open(nemo_file_path, "r:*") as nemo_archive:
+                if hasattr(tarfile, "data_filter"):
+                    nemo_archive.extractall(temp_dir, filter="data")
+                else:
+                    nemo_archive.extractall(temp_dir)
+            try:
+                os.replace(temp_dir, extracted_dir)
+            except OSError:
+                # 目标目录已存在且非空时改名失败：说明另一个进程已完成同一解压，直接使用它的结果
+                if not os.path.isdir(extracted_dir):
+                    raise
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+    return extracted_dir
 
-def generate_srt_content(segment_timestamps: list) -> str:
+
+def load_model_instance(source_type: str, source_value: str):
     """
-    根据时间戳列表生成 SRT 格式的字幕内容。
-    ARGS:
-        segment_timestamps: 包含 {'start': float, 'end': float, 'segment': str} 的列表。
+    从云端或本地 .nemo 文件加载一个新的模型实例，在 CPU 上应用 cpu_profile 并预热。
+    本地模型优先从 model_cache 中已解压的目录恢复，避免每次加载都解压整个归档。
     RETURNS:
-        SRT 格式的字符串。
+        (model, 模型标识)，模型标识用于转录缓存键。
     """
-    srt_content = ""
-    for i, stamp in enumerate(segment_timestamps):
-        subtitle_number = i + 1
-        start_time_srt = format_srt_time(stamp["start"])
-        end_time_srt = format_srt_time(stamp["end"])
-        segment_text = stamp["segment"]
-        srt_block = f"{subtitle_number}\n{start_time_srt} --> {end_time_srt}\n{segment_text}\n\n"
-        srt_content += srt_block
-    return srt_content
+    import nemo.collections.asr as nemo_asr
 
+    if source_type == "ngc":
+        model = nemo_asr.models.ASRModel.from_pretrained(
+            model_name=source_value, map_location=device
+        )
+        model_identity = f"ngc:{source_value}"
+    else:
+        restore_kwargs = {}
+        try:
+            from nemo.core.connectors.save_restore_connector import SaveRestoreConnector
 
-# --- Gradio 处理函数 ---
-def process_media_for_srt(media_file_objs: list, chunk_length_s: int):
-    if asr_model is None:
-        yield "错误：ASR 模型未加载。请先加载模型。", None, ""
-        return
-    if media_file_objs is None:
-        yield "请上传至少一个视频文件。", None, ""
-        return
+            save_restore_connector = SaveRestoreConnector()
+            save_restore_connector.model_extracted_dir = extract_nemo_archive(source_value)
+            restore_kwargs["save_restore_connector"] = save_restore_connector
+        except Exception as e:
+            print(f"警告：无法使用已解压的模型缓存，改为直接加载 .nemo 文件: {e}")
+        model = nemo_asr.models.ASRModel.restore_from(
+            restore_path=source_value, map_location=device, **restore_kwargs
+        )
+        model_file_stat = os.stat(source_value)
+        # 同一路径下替换了模型文件时标识随之变化，旧的转录缓存不会被误用
+        model_identity = (
+            f"local:{source_value}:{model_file_stat.st_size}:{model_file_stat.st_mtime_ns}"
+        )
+    if device.type == "cpu":
+        model, applied_profile = apply_cpu_profile(model, cpu_profile)
+        if applied_profile != "default":
+            # 量化/低精度会改变转录结果，转录缓存需按配置区分
+            model_identity = f"{model_identity}|cpu:{applied_profile}"
+    warm_up_asr_model(model)
+    return model, model_identity
 
-    output_srt_paths_for_downloads = []
-    total_files = len(media_file_objs)
-    start_time_total = time.time()
 
-    for i, media_file_obj in enumerate(media_file_objs):
-        input_media_path = media_file_obj  # Gradio Video 对象具有 .name 属性表示路径
-        file_name = os.path.basename(input_media_path)
+def get_or_load_model(model_source: str):
+    """
+    返回 model_source ("ngc:<名称>" 或本地 .nemo 路径) 对应的模型，已常驻内存时直接返回，否则加载并登记。
+    RETURNS:
+        (model, 模型标识, 是否已常驻内存)
+    """
+    get_inference_device()
+    source_type, source_value = parse_model_source(model_source)
+    if source_type == "local" and not os.path.isfile(source_value):
+        raise FileNotFoundError(f"本地模型文件不存在: {source_value}")
+    registry_key = get_model_registry_key(source_type, source_value)
+    resident_model = model_registry.get(registry_key)
+    if resident_model is not None:
+        print(f"模型 '{registry_key}' 已在内存中，无需重新加载。")
+        return resident_model[0], resident_model[1], True
+    with model_registry.load_lock:
+        # 等待锁期间其它线程可能已加载了同一模型
+        resident_model = model_registry.get(registry_key)
+        if resident_model is not None:
+            return resident_model[0], resident_model[1], True
+        model, model_identity = load_model_instance(source_type, source_value)
+        model_registry.add(
+            registry_key,
+            model,
+            model_identity,
+            estimate_model_memory_mb(model, source_value if source_type == "local" else None),
+        )
+    return model, model_identity, False
 
-        print(f"开始处理视频/音频文件， 当前: {i+1}/{total_files}, 文件名: {file_name}")
-        yield f"状态：正在处理文件, 当前：{i+1}/{total_files}, 文件名：{file_name} ...", None, ""
 
-        extracted_audio_path = None
-        output_srt_path_for_download = None  # 用于 Gradio File 组件
+# --- CPU 推理配置 ---
+def get_physical_cpu_count() -> int:
+    """返回物理核心数；未安装 psutil 时退回逻辑核心数。"""
+    try:
+        import psutil
 
-        try:
-            yield f"状态：正在提取 {file_name} 的音频...", None, ""
-            extracted_audio_path = extract_audio_from_video(input_media_path)
-            if not extracted_audio_path:
-                yield "错误：音频提取失败。请检查视频文件或ffmpeg安装。", None, ""
-                return
+        physical_count = psutil.cpu_count(logical=False)
+        if physical_count:
+            return physical_count
+    except ImportError:
+        pass
+    return os.cpu_count() or 1
 
-            chunk_length_ms = chunk_length_s * 1000
-            yield f"状态：正在转录音频 (分块大小: {chunk_length_s}秒)...", None, ""
-            segment_timestamps = transcribe_audio_in_chunks(
-                asr_model, extracted_audio_path, chunk_length_ms
-            )
 
-            if not segment_timestamps:
-                yield f"警告：转录文件 {file_name} 未生成有效的时间戳。正在跳过此文件。", None, ""
-                continue
+def cpu_supports_bf16() -> bool:
+    """根据 /proc/cpuinfo 判断 CPU 是否提供原生 bf16 指令 (AVX512-BF16 或 AMX)。"""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as cpuinfo_file:
+            cpu_flags = cpuinfo_file.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in cpu_flags or "amx_bf16" in cpu_flags
 
-            yield "状态：正在生成 SRT 内容...", None, ""
-            srt_content = generate_srt_content(segment_timestamps)
-            srt_file_name = (
-                os.path.basename(input_media_path).rsplit(".", 1)[0] + ".srt"
-            )
-            if not os.path.exists(subtitles_folder_path):
-                os.makedirs(subtitles_folder_path, exist_ok=True)
-            output_srt_path_for_download = os.path.join(
-                subtitles_folder_path, srt_file_name
-            )
 
-            with open(output_srt_path_for_download, "w", encoding="utf-8") as srt_file:
-                srt_file.write(srt_content)
+def get_torch_thread_counts() -> tuple:
+    """返回当前的 (推理线程数, 算子间线程数)。"""
+    import torch
 
-            output_srt_paths_for_downloads.append(output_srt_path_for_download)
+    return torch.get_num_threads(), torch.get_num_interop_threads()
 
-            print(f"SRT 文件位于: {output_srt_path_for_download}")
 
-        except Exception as e:
-            print(f"处理文件 {file_name} 时发生未知错误: {e}")
-            import traceback
-            traceback.print_exc()
-            yield f"错误：处理文件 {file_name} 时发生未知错误: {e}。正在跳过此文件。", None, ""
-            continue
-        finally:
-            if extracted_audio_path and os.path.exists(extracted_audio_path):
-                try:
-                    os.remove(extracted_audio_path)
-                except OSError as e_clean:
-                    print(f"清理临时音频文件 {extracted_audio_path} 时出错: {e_clean}")
+def set_torch_thread_counts(thread_count: int, interop_thread_count: int = None):
+    """
+    设置推理线程数和算子间线程数。算子间线程数只能在首次并行计算之前设置，之后的设置会被忽略。
+    未指定算子间线程数时按核心数推算：算子间并行只在图中有相互独立的分支时才有用，每 4 个核心给 1 个线程，最多 4 个。
+    """
+    import torch
 
-        elapsed_time_total = time.time() - start_time_total
-        status_message = f"处理完成。总耗时 {elapsed_time_total:.2f} 秒。生成{len(output_srt_paths_for_downloads)} 个 SRT 文件。"
-        print(status_message)
-        yield status_message, output_srt_paths_for_downloads, srt_content
-        # Gradio 会处理 output_srt_path_for_download（它提供的临时文件）的删除
+    if interop_thread_count is None:
+        interop_thread_count = max(1, min(4, thread_count // 4))
+    torch.set_num_threads(thread_count)
+    try:
+        torch.set_num_interop_threads(interop_thread_count)
+    except RuntimeError:
+        pass
 
 
-# --- Gradio 界面设置 ---
-if __name__ == "__main__":
-    if not check_ffmpeg():
-        print("重要提示: FFMPEG 未找到。视频和音频处理功能将受限或无法工作。")
+def apply_cpu_profile(model, profile: str):
+    """
+    在 CPU 上按所选配置调整推理设置。
+    ARGS:
+        model: 已加载的 NeMo ASR 模型。
+        profile: "default" 不做任何调整；"tuned" 把线程数设为物理核心数；
+                 "int8" 在 tuned 基础上对 Linear 层做动态 int8 量化；
+                 "bf16" 在 tuned 基础上以 bf16 autocast 推理 (CPU 不支持时退回 tuned)。
+    RETURNS:
+        (model, 实际生效的配置名)。bf16 生效时在模型上记录 inference_autocast_dtype，供 inference_context 使用。
+    """
+    import torch
 
-    # --- 启动时模型加载逻辑 ---
-    config = load_config()
-    # saved_model_path 可以是：文件路径 (str)，"" (表示NGC)，或 None (之前未选择)
-    saved_model_path = config.get("local_model_path")
-    initial_chunk_length = config.get("chunk_length_s", 60)
-    initial_model_status = (
-        "模型未加载。请选择本地模型或从云端加载。"  # 真正首次运行时的默认值
+    if profile not in CPU_PROFILES:
+        print(f"警告：未知的 CPU 推理配置 '{profile}'，使用 default。")
+        profile = "default"
+    if profile == "default":
+        return model, profile
+
+    thread_count = get_physical_cpu_count()
+    set_torch_thread_counts(thread_count)
+    print(
+        f"CPU 推理线程数已设置为 {thread_count} (算子间 {get_torch_thread_counts()[1]})。"
     )
 
-    if saved_model_path is not None:  # 之前已做出选择
-        if saved_model_path == "":  # 上次选择的是 NGC
-            print("配置中记录上次选择为云端NGC模型，尝试自动重新加载...")
-            initial_model_status = load_asr_model_globally(
-                load_from_ngc_explicitly=True,
-                save_choice_on_success=False,  # 自动加载时不重新保存配置
-                current_chunk_value=initial_chunk_length,
-            )
-        elif os.path.exists(saved_model_path):  # 保存了本地路径且该路径存在
-            print(f"配置中记录本地模型路径: {saved_model_path}，尝试自动重新加载...")
-            initial_model_status = load_asr_model_globally(
-                local_model_path_to_try=saved_model_path,
-                save_choice_on_success=False,  # 自动加载时不重新保存配置
-                current_chunk_value=initial_chunk_length,
+    if profile == "int8":
+        try:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
             )
-        else:  # 保存了本地路径，但该路径已不存在
-            error_msg = f"错误：配置文件中的本地模型路径 '{saved_model_path}' 未找到或无效。模型未加载。"
-            print(error_msg)
-            initial_model_status = error_msg
+            print("已对模型的 Linear 层应用动态 int8 量化。")
+        except Exception as e:
+            print(f"警告：动态 int8 量化失败，改用 tuned 配置: {e}")
+            profile = "tuned"
+    elif profile == "bf16":
+        if cpu_supports_bf16():
+            model.inference_autocast_dtype = torch.bfloat16
+            print("将以 bf16 autocast 在 CPU 上推理。")
+        else:
+            print("警告：当前 CPU 不支持原生 bf16，改用 tuned 配置。")
+            profile = "tuned"
+    return model, profile
 
-    else:
-        # 这是真正的首次运行（配置文件不存在或 local_model_path 明确为 None）
-        print("首次运行或之前未配置模型。模型不会自动加载，请手动选择。")
-        # initial_model_status 保持默认的 "模型未加载..."
 
-    # --- Gradio UI 定义 ---
+def inference_context(model):
+    """
+    返回包裹 model.transcribe 调用的上下文：torch.inference_mode()，模型以 bf16 配置加载时再加上 CPU autocast。
+    torch 尚未导入时 (例如使用测试替身模型) 返回空上下文。
+    """
+    torch_module = sys.modules.get("torch")
+    if torch_module is None or not hasattr(torch_module, "inference_mode"):
+        return contextlib.nullcontext()
+    context_stack = contextlib.ExitStack()
+    context_stack.enter_context(torch_module.inference_mode())
+    inference_autocast_dtype = getattr(model, "inference_autocast_dtype", None)
+    if inference_autocast_dtype is not None:
+        context_stack.enter_context(
+            torch_module.autocast("cpu", dtype=inference_autocast_dtype)
+        )
+    return context_stack
+
+
+def word_error_rate(reference_text: str, hypothesis_text: str) -> float:
+    """按词计算 hypothesis 相对 reference 的词错误率 (编辑距离 / 参考词数)。"""
+    reference_words = reference_text.split()
+    hypothesis_words = hypothesis_text.split()
+    if not reference_words:
+        return 0.0 if not hypothesis_words else 1.0
+    previous_row = list(range(len(hypothesis_words) + 1))
+    for i, reference_word in enumerate(reference_words, 1):
+        current_row = [i]
+        for j, hypothesis_word in enumerate(hypothesis_words, 1):
+            current_row.append(
+                min(
+                    previous_row[j] + 1,
+                    current_row[j - 1] + 1,
+                    previous_row[j - 1] + (reference_word != hypothesis_word),
+                )
+            )
+        previous_row = current_row
+    return previous_row[-1] / len(reference_words)
+
+
+def compare_cpu_profiles(sample_media_path: str, config: dict, profiles=CPU_PROFILES) -> list:
+    """
+    用同一段样本依次在各 CPU 推理配置下重新加载模型并转录，报告耗时、实时率与相对 default 的词错误率。
+    比较时不使用转录缓存和断点续传；结束后按原配置重新加载模型。
+    各配置会改变进程的 torch 线程数，因此 default 在进入时的线程设置下测量，其余配置测量前按物理核心数重新设置，
+    结果不受配置的先后顺序影响；返回前恢复进入时的线程设置。
+    RETURNS:
+        每个配置一项的字典列表。
+    """
+    global transcription_cache_max_bytes, checkpoint_enabled
+    original_profile = cpu_profile
+    original_cache_max_bytes = transcription_cache_max_bytes
+    original_checkpoint_enabled = checkpoint_enabled
+    chunk_length_ms = int(config.get("chunk_length_s", 60)) * 1000
+    batch_size = int(config.get("batch_size", 1))
+
+    file_extension = os.path.splitext(sample_media_path)[1].lower()
+    if file_extension in [".mp4", ".mkv", ".avi", ".mov", ".webm"]:
+        processed_audio_path = extract_audio_from_video(sample_media_path)
+    else:
+        processed_audio_path = preprocess_direct_audio(sample_media_path)
+    if not processed_audio_path:
+        raise RuntimeError(f"无法预处理样本文件: {sample_media_path}")
+
+    results = []
+    reference_text = None
+    transcription_cache_max_bytes = 0
+    checkpoint_enabled = False
+    original_thread_counts = get_torch_thread_counts()
+    try:
+        audio_duration_s = len(load_audio_samples(processed_audio_path)) / TARGET_SAMPLE_RATE
+        for profile in profiles:
+            load_status = load_asr_model_globally(
+                local_model_path_to_try=config.get("local_model_path") or None,
+                load_from_ngc_explicitly=config.get("local_model_path") == "",
+                current_cpu_profile=profile,
+            )
+            if asr_model is None:
+                results.append({"profile": profile, "error": load_status})
+                continue
+            # 已常驻的模型直接复用时不会再经过 apply_cpu_profile，这里显式设置本配置的线程数
+            if profile == "default":
+                set_torch_thread_counts(*original_thread_counts)
+            else:
+                set_torch_thread_counts(get_physical_cpu_count())
+            start_time = time.time()
+            segments = transcribe_audio_in_chunks(
+                asr_model, processed_audio_path, chunk_length_ms, batch_size
+            )
+            elapsed_s = time.time() - start_time
+            transcript_text = " ".join(segment["segment"] for segment in segments)
+            if reference_text is None:
+                reference_text = transcript_text
+            results.append(
+                {
+                    "profile": profile,
+                    "seconds": round(elapsed_s, 3),
+                    "rtf": round(elapsed_s / audio_duration_s, 4) if audio_duration_s else None,
+                    "wer_vs_first": round(word_error_rate(reference_text, transcript_text), 4),
+                }
+            )
+            print(f"CPU 推理配置 {profile}: {results[-1]}")
+    finally:
+        transcription_cache_max_bytes = original_cache_max_bytes
+        checkpoint_enabled = original_checkpoint_enabled
+        remove_extracted_audio(processed_audio_path, sample_media_path)
+        load_asr_model_globally(
+            local_model_path_to_try=config.get("local_model_path") or None,
+            load_from_ngc_explicitly=config.get("local_model_path") == "",
+            current_cpu_profile=original_profile,
+        )
+        set_torch_thread_counts(*original_thread_counts)
+    return results
+
+
+# --- 自动调优 ---
+def get_current_rss_mb() -> float:
+    """返回当前进程的常驻内存 (MB)；无法读取时返回 None。"""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_total_memory_mb() -> float:
+    """返回本机物理内存总量 (MB)；无法读取时返回 None。"""
+    try:
+        import psutil
+
+        return psutil.virtual_memory().total / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakMemorySampler:
+    """在 with 块执行期间由后台线程定时采样进程常驻内存，记录峰值 (MB)。"""
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.peak_rss_mb = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        current_rss_mb = get_current_rss_mb()
+        if current_rss_mb is not None and (
+            self.peak_rss_mb is None or current_rss_mb > self.peak_rss_mb
+        ):
+            self.peak_rss_mb = current_rss_mb
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_s):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, name="rss-sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+        return False
+
+
+def write_synthetic_tuning_audio(output_path: str, duration_s: int):
+    """生成用于调优的合成音频：带噪声的变频正弦波，每 10 秒穿插 1 秒静音。"""
+    sample_rng = np.random.default_rng(0)
+    sample_times = np.arange(int(duration_s * TARGET_SAMPLE_RATE)) / TARGET_SAMPLE_RATE
+    waveform = 0.2 * np.sin(2 * np.pi * (200 + 100 * np.sin(sample_times)) * sample_times)
+    waveform += 0.02 * sample_rng.standard_normal(len(sample_times))
+    waveform[(sample_times % 10) >= 9] = 0.0
+    write_chunk_wav((waveform * 32767).astype(np.int16), output_path)
+
+
+def auto_tune_chunk_settings(
+    config: dict,
+    sample_media_path: str = None,
+    chunk_lengths=(30, 60, 120, 180),
+    batch_sizes=(1, 2, 4, 8),
+    memory_budget_mb: float = None,
+    synthetic_duration_s: int = 360,
+    save_result: bool = True,
+) -> dict:
+    """
+    在样本音频 (未提供时使用合成音频) 上对分块长度和批处理块数的组合逐一计时，
+    记录峰值常驻内存与实时率，选出在内存预算内最快的组合，并通过 save_config 保存为默认值。
+    ARGS:
+        config: 当前配置，保存时保留其中的模型选择。
+        sample_media_path: 用户提供的样本媒体文件；None 时生成 synthetic_duration_s 秒的合成音频。
+        chunk_lengths / batch_sizes: 待测试的分块长度 (秒) 与批处理块数。
+                                     块数不足以凑满一批的组合与更小的批等价，会被跳过。
+        memory_budget_mb: 峰值常驻内存上限；None 时取物理内存的 80%。
+        save_result: 是否把选出的组合写入 config.json。
+    RETURNS:
+        {"best": {...} 或 None, "memory_budget_mb": ..., "trials": [...]}
+    """
+    global transcription_cache_max_bytes, checkpoint_enabled
+    if asr_model is None:
+        raise RuntimeError("ASR 模型未加载，无法进行自动调优。")
+    if memory_budget_mb is None:
+        total_memory_mb = get_total_memory_mb()
+        memory_budget_mb = total_memory_mb * 0.8 if total_memory_mb else None
+
+    if sample_media_path:
+        tuning_audio_path = extract_audio_from_video(sample_media_path)
+        if not tuning_audio_path:
+            raise RuntimeError(f"无法预处理样本文件: {sample_media_path}")
+    else:
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tuning_audio_file:
+            tuning_audio_path = tuning_audio_file.name
+        write_synthetic_tuning_audio(tuning_audio_path, synthetic_duration_s)
+
+    original_cache_max_bytes = transcription_cache_max_bytes
+    original_checkpoint_enabled = checkpoint_enabled
+    transcription_cache_max_bytes = 0
+    checkpoint_enabled = False
+    trials = []
+    try:
+        audio_duration_s = get_wav_duration_seconds(tuning_audio_path) or 0
+        for chunk_length_s in chunk_lengths:
+            chunk_count = max(1, -(-int(audio_duration_s) // int(chunk_length_s)))
+            for batch_size in batch_sizes:
+                if batch_size > 1 and batch_size // 2 >= chunk_count:
+                    continue
+                print(f"自动调优: 分块 {chunk_length_s} 秒，批处理 {batch_size} 块...")
+                trial = {"chunk_length_s": chunk_length_s, "batch_size": batch_size}
+                start_time = time.time()
+                try:
+                    with PeakMemorySampler() as memory_sampler:
+                        segments = transcribe_audio_in_chunks(
+                            asr_model, tuning_audio_path, chunk_length_s * 1000, batch_size
+                        )
+                    elapsed_s = time.time() - start_time
+                    trial.update(
+                        {
+                            "seconds": round(elapsed_s, 3),
+                            "rtf": round(elapsed_s / audio_duration_s, 4)
+                            if audio_duration_s
+                            else None,
+                            "peak_rss_mb": round(memory_sampler.peak_rss_mb, 1)
+                            if memory_sampler.peak_rss_mb is not None
+                            else None,
+                            "segments": len(segments),
+                        }
+                    )
+                except Exception as e:  # 例如显存或内存不足
+                    trial["error"] = str(e)
+                    print(f"自动调优: 分块 {chunk_length_s} 秒，批处理 {batch_size} 块失败: {e}")
+                    torch_module = sys.modules.get("torch")
+                    if torch_module is not None and hasattr(torch_module, "cuda"):
+                        if torch_module.cuda.is_available():
+                            torch_module.cuda.empty_cache()
+                trials.append(trial)
+    finally:
+        transcription_cache_max_bytes = original_cache_max_bytes
+        checkpoint_enabled = original_checkpoint_enabled
+        remove_extracted_audio(tuning_audio_path, sample_media_path)
+
+    fitting_trials = [
+        trial
+        for trial in trials
+        if "error" not in trial
+        and (
+            memory_budget_mb is None
+            or trial["peak_rss_mb"] is None
+            or trial["peak_rss_mb"] <= memory_budget_mb
+        )
+    ]
+    best_trial = min(fitting_trials, key=lambda trial: trial["seconds"], default=None)
+    if best_trial is None:
+        print("自动调优: 没有在内存预算内成功完成的组合，配置保持不变。")
+    else:
+        print(
+            f"自动调优结果: 分块 {best_trial['chunk_length_s']} 秒，"
+            f"批处理 {best_trial['batch_size']} 块 (RTF {best_trial['rtf']})"
+        )
+        if save_result:
+            save_config(
+                local_model_path=config.get("local_model_path"),
+                chunk_length=best_trial["chunk_length_s"],
+                batch_size=best_trial["batch_size"],
+            )
+    return {
+        "best": best_trial,
+        "memory_budget_mb": round(memory_budget_mb, 1) if memory_budget_mb else None,
+        "trials": trials,
+    }
+
+
+# --- 辅助函数 (ffmpeg, 音频处理, SRT 生成) ---
+def is_tool_available(tool_name: str) -> bool:
+    try:
+        subprocess.run([tool_name, "-version"], check=True, capture_output=True)
+        return True
+    except (subprocess.CalledProcessError, OSError):
+        return False
+
+
+def get_ffmpeg_capabilities() -> dict:
+    """检测 ffmpeg 与 ffprobe 是否可用。每个进程只启动一次检测子进程，之后直接返回缓存的结果。"""
+    global ffmpeg_capabilities
+    with ffmpeg_capabilities_lock:
+        if ffmpeg_capabilities is None:
+            ffmpeg_capabilities = {
+                "ffmpeg": is_tool_available("ffmpeg"),
+                "ffprobe": is_tool_available("ffprobe"),
+            }
+        return ffmpeg_capabilities
+
+
+def check_ffmpeg():
+    if get_ffmpeg_capabilities()["ffmpeg"]:
+        return True
+    print(
+        "错误：ffmpeg 未检测到或未正确安装。请安装 ffmpeg 并确保其在系统 PATH 中。"
+    )
+    return False
+
+
+class JobCancelledError(Exception):
+    """
+    任务被取消时在检查点 (音频块批次之间、提取与转录之间) 抛出，沿调用链一路向上，途中清理临时文件。
+    转录函数在 checkpoint_key 中记下当前文件的断点日志，由任务层决定是否删除 (页面断开时保留以便续传)。
+    """
+
+    checkpoint_key = None
+
+
+def raise_if_cancelled(cancel_event: threading.Event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelledError("任务已取消")
+
+
+def terminate_process(process: subprocess.Popen, grace_period_s: float = 2.0):
+    """先请求子进程退出，超过 grace_period_s 仍未退出时强制结束。"""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=grace_period_s)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_cancellable_command(
+    command: list, cancel_event: threading.Event = None, poll_interval_s: float = 0.2
+) -> subprocess.CompletedProcess:
+    """
+    与 subprocess.run(command, check=True, capture_output=True, text=True) 相同，
+    但等待期间每 poll_interval_s 秒检查一次 cancel_event，被设置时立即终止子进程并抛出 JobCancelledError。
+    输出先写入临时文件，避免长时间运行的 ffmpeg 写满管道而阻塞。
+    """
+    if cancel_event is None:
+        return subprocess.run(command, check=True, capture_output=True, text=True, errors="ignore")
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdout=stdout_file, stderr=stderr_file)
+        try:
+            while True:
+                try:
+                    return_code = process.wait(timeout=poll_interval_s)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel_event.is_set():
+                        raise JobCancelledError(f"任务已取消，已终止 {command[0]} 进程")
+        finally:
+            terminate_process(process)
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout_text = stdout_file.read().decode("utf-8", errors="ignore")
+        stderr_text = stderr_file.read().decode("utf-8", errors="ignore")
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command, stdout_text, stderr_text)
+    return subprocess.CompletedProcess(command, return_code, stdout_text, stderr_text)
+
+
+def read_wav_format(audio_path: str) -> dict:
+    """
+    解析 WAV 文件头 (不读取音频数据)。
+    RETURNS:
+        {'format_tag', 'channels', 'sample_rate', 'bits_per_sample', 'data_offset', 'data_size'}；
+        不是可识别的 WAV 文件时返回 None。
+    """
+    try:
+        file_size = os.path.getsize(audio_path)
+        with open(audio_path, "rb") as wav_file:
+            riff_header = wav_file.read(12)
+            if len(riff_header) < 12 or riff_header[:4] != b"RIFF" or riff_header[8:12] != b"WAVE":
+                return None
+            wav_format = None
+            while True:
+                chunk_header = wav_file.read(8)
+                if len(chunk_header) < 8:
+                    return None
+                chunk_id = chunk_header[:4]
+                chunk_size = struct.unpack("<I", chunk_header[4:])[0]
+                if chunk_id == b"fmt ":
+                    fmt_data = wav_file.read(chunk_size)
+                    format_tag, channels, sample_rate = struct.unpack("<HHI", fmt_data[:8])
+                    bits_per_sample = struct.unpack("<H", fmt_data[14:16])[0]
+                    if format_tag == 0xFFFE and len(fmt_data) >= 26:  # WAVE_FORMAT_EXTENSIBLE
+                        format_tag = struct.unpack("<H", fmt_data[24:26])[0]
+                    wav_format = {
+                        "format_tag": format_tag,
+                        "channels": channels,
+                        "sample_rate": sample_rate,
+                        "bits_per_sample": bits_per_sample,
+                    }
+                elif chunk_id == b"data":
+                    if wav_format is None:
+                        return None
+                    data_offset = wav_file.tell()
+                    # ffmpeg 写入管道时 data 大小可能未回填，按实际文件大小截断
+                    wav_format["data_offset"] = data_offset
+                    wav_format["data_size"] = min(chunk_size, file_size - data_offset)
+                    return wav_format
+                else:
+                    wav_file.seek(chunk_size, os.SEEK_CUR)
+                if chunk_size % 2:  # RIFF 块按 2 字节对齐
+                    wav_file.seek(1, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def probe_media(media_path: str) -> dict:
+    """
+    获取输入文件的音频参数 {'codec', 'sample_rate', 'channels', 'duration_s'}。
+    WAV 文件直接解析文件头，其它格式调用一次 ffprobe；同一文件 (路径、大小、修改时间均相同) 只探测一次。
+    无法探测时返回 None。
+    """
+    try:
+        file_stat = os.stat(media_path)
+    except OSError:
+        return None
+    return probe_media_cached(os.path.abspath(media_path), file_stat.st_size, file_stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=256)
+def probe_media_cached(media_path: str, file_size: int, file_mtime_ns: int) -> dict:
+    wav_format = read_wav_format(media_path)
+    if wav_format is not None:
+        bytes_per_second = (
+            wav_format["sample_rate"] * wav_format["channels"] * wav_format["bits_per_sample"] // 8
+        )
+        is_pcm_16 = wav_format["format_tag"] == 1 and wav_format["bits_per_sample"] == 16
+        return {
+            "codec": "pcm_s16le" if is_pcm_16 else f"wav_format_{wav_format['format_tag']}",
+            "sample_rate": wav_format["sample_rate"],
+            "channels": wav_format["channels"],
+            "duration_s": wav_format["data_size"] / bytes_per_second if bytes_per_second else None,
+        }
+    if not get_ffmpeg_capabilities()["ffprobe"]:
+        return None
+    ffprobe_command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=codec_name,sample_rate,channels:format=duration",
+        "-of",
+        "json",
+        media_path,
+    ]
+    try:
+        process = subprocess.run(
+            ffprobe_command, check=True, capture_output=True, text=True, errors="ignore"
+        )
+        probe_output = json.loads(process.stdout or "{}")
+    except (subprocess.CalledProcessError, OSError, json.JSONDecodeError) as e:
+        print(f"ffprobe 探测 '{media_path}' 失败: {e}")
+        return None
+    audio_streams = probe_output.get("streams") or [{}]
+    duration_text = (probe_output.get("format") or {}).get("duration")
+    return {
+        "codec": audio_streams[0].get("codec_name"),
+        "sample_rate": int(audio_streams[0].get("sample_rate") or 0) or None,
+        "channels": audio_streams[0].get("channels"),
+        "duration_s": float(duration_text) if duration_text not in (None, "N/A") else None,
+    }
+
+
+def is_model_ready_audio(media_probe: dict) -> bool:
+    """探测结果是否已是模型要求的 16kHz 单声道 16-bit PCM WAV (可跳过转换直接使用)。"""
+    return (
+        media_probe is not None
+        and media_probe["codec"] == "pcm_s16le"
+        and media_probe["sample_rate"] == TARGET_SAMPLE_RATE
+        and media_probe["channels"] == 1
+    )
+
+
+def remove_extracted_audio(extracted_audio_path: str, input_media_path: str):
+    """删除提取出的临时 WAV。输入无需转换时提取结果就是用户的原始文件，此时不删除。"""
+    if not extracted_audio_path or not os.path.exists(extracted_audio_path):
+        return
+    if input_media_path and os.path.abspath(extracted_audio_path) == os.path.abspath(
+        input_media_path
+    ):
+        return
+    try:
+        os.remove(extracted_audio_path)
+    except OSError as e_clean:
+        print(f"清理临时音频文件 {extracted_audio_path} 时出错: {e_clean}")
+
+
+def extract_audio_from_video(input_media_path: str, cancel_event: threading.Event = None) -> str:
+    """
+    使用 ffmpeg 从视频文件中提取音频并转换为 WAV 格式。
+    返回提取的音频文件路径，或在失败时返回 None。
+    输入已是 16kHz 单声道 PCM WAV 时不做转换，直接返回输入路径 (调用方清理时需用 remove_extracted_audio)。
+    cancel_event 被设置时终止 ffmpeg、删除未完成的 WAV 并抛出 JobCancelledError。
+    """
+    if is_model_ready_audio(probe_media(input_media_path)):
+        print(f"'{input_media_path}' 已是 16kHz 单声道 PCM WAV，跳过转换。")
+        return input_media_path
+    if not check_ffmpeg():
+        return None
+    temp_audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+    output_audio_path = temp_audio_file.name
+    temp_audio_file.close()
+
+    ffmpeg_command = [
+        "ffmpeg",
+        "-i",
+        input_media_path,
+        "-vn",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        "16000",
+        "-ac",
+        "1",
+        "-y",
+        output_audio_path,
+    ]
+    try:
+        run_cancellable_command(ffmpeg_command, cancel_event)
+        print(f"音频提取成功到: {output_audio_path}")
+        if os.path.exists(output_audio_path) and os.path.getsize(output_audio_path) > 0:
+            return output_audio_path
+        else:
+            print(f"错误：ffmpeg 命令成功执行，但未生成音频文件：{output_audio_path}")
+            if os.path.exists(output_audio_path):
+                os.remove(output_audio_path)  # 清理空文件
+            return None
+    except subprocess.CalledProcessError as e:
+        print(
+            f"提取音频时发生 FFmpeg 错误：{e}\n标准输出: {e.stdout}\n标准错误: {e.stderr}"
+        )
+        if os.path.exists(output_audio_path):
+            os.remove(output_audio_path)
+        return None
+    except FileNotFoundError:
+        print("错误：未找到 FFmpeg 可执行文件。")
+        return None
+    except JobCancelledError:
+        if os.path.exists(output_audio_path):
+            os.remove(output_audio_path)
+        raise
+
+
+def preprocess_direct_audio(input_audio_path: str, cancel_event: threading.Event = None) -> str:
+    """
+    把音频文件转换为 16kHz 单声道 PCM WAV。返回转换后的路径，失败时返回 None。
+    输入已符合要求时直接返回输入路径；cancel_event 的处理同 extract_audio_from_video。
+    """
+    if not input_audio_path or not os.path.exists(input_audio_path):
+        print(f"错误：提供的音频文件路径无效或文件不存在: {input_audio_path}")
+        return None
+    if is_model_ready_audio(probe_media(input_audio_path)):
+        print(f"'{input_audio_path}' 已是 16kHz 单声道 PCM WAV，跳过转换。")
+        return input_audio_path
+    if not check_ffmpeg():
+        return None
+
+    temp_processed_audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+    output_wav_path = temp_processed_audio_file.name
+    temp_processed_audio_file.close()
+
+    ffmpeg_command = [
+        "ffmpeg",
+        "-i",
+        input_audio_path,
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        "16000",
+        "-ac",
+        "1",
+        "-y",
+        output_wav_path,
+    ]
+    try:
+        run_cancellable_command(ffmpeg_command, cancel_event)
+        print(f"直接音频预处理成功: {input_audio_path} -> {output_wav_path}")
+        if os.path.exists(output_wav_path) and os.path.getsize(output_wav_path) > 0:
+            return output_wav_path
+        else:
+            print(f"错误：ffmpeg 命令执行，但未生成有效音频文件：{output_wav_path}")
+            if os.path.exists(output_wav_path):
+                os.remove(output_wav_path)  # 清理
+            return None
+    except subprocess.CalledProcessError as e:
+        print(
+            f"预处理直接音频 '{input_audio_path}' 时发生 FFmpeg 错误：{e}\n标准输出: {e.stdout}\n标准错误: {e.stderr}"
+        )
+        if os.path.exists(output_wav_path):
+            os.remove(output_wav_path)
+        return None
+    except FileNotFoundError:
+        print("错误：未找到 FFmpeg 可执行文件。")
+        return None
+    except JobCancelledError:
+        if os.path.exists(output_wav_path):
+            os.remove(output_wav_path)
+        raise
+
+
+def iter_pcm_chunks_from_wav(audio_path: str, chunk_length_ms: int):
+    """按块产出 16kHz 单声道 PCM WAV 的 (start_ms, end_ms, int16 样本数组)，样本为内存映射的切片。"""
+    samples = open_pcm_wav_memmap(audio_path)
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    chunk_sample_count = chunk_length_ms * samples_per_ms
+    for chunk_start in range(0, len(samples), chunk_sample_count):
+        chunk_samples = samples[chunk_start : chunk_start + chunk_sample_count]
+        start_time_ms = chunk_start // samples_per_ms
+        yield start_time_ms, start_time_ms + len(chunk_samples) // samples_per_ms, chunk_samples
+
+
+def stream_pcm_chunks_from_ffmpeg(
+    input_media_path: str, chunk_length_ms: int, queue_size: int = 4
+):
+    """
+    让 ffmpeg 将 16kHz 单声道 s16le PCM 输出到 stdout，由后台生产者线程按块切分并
+    放入有界队列。消费者可以在文件其余部分仍在解码时开始转录第一块。
+    ARGS:
+        input_media_path: 输入视频/音频文件路径。
+        chunk_length_ms: 每块的长度（毫秒）。
+        queue_size: 队列中最多缓存的音频块数量 (限制内存占用)。
+    YIELDS:
+        (start_ms, end_ms, int16 样本数组)。ffmpeg 失败时抛出 RuntimeError。
+    输入已是 16kHz 单声道 PCM WAV 时不启动 ffmpeg，直接按块读取内存映射的样本。
+    """
+    if is_model_ready_audio(probe_media(input_media_path)):
+        yield from iter_pcm_chunks_from_wav(input_media_path, chunk_length_ms)
+        return
+    if not check_ffmpeg():
+        raise RuntimeError("ffmpeg 不可用，无法进行流式解码。")
+
+    ffmpeg_command = [
+        "ffmpeg",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-i",
+        input_media_path,
+        "-vn",
+        "-f",
+        "s16le",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(TARGET_SAMPLE_RATE),
+        "-ac",
+        "1",
+        "pipe:1",
+    ]
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    chunk_bytes = chunk_length_ms * samples_per_ms * 2
+    chunk_queue = queue.Queue(maxsize=max(1, queue_size))
+    stop_event = threading.Event()
+    end_of_stream = object()
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        ffmpeg_command, stdout=subprocess.PIPE, stderr=stderr_file
+    )
+
+    def put_until_stopped(item):
+        while not stop_event.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        start_time_ms = 0
+        try:
+            while not stop_event.is_set():
+                buffer = bytearray(chunk_bytes)
+                view = memoryview(buffer)
+                filled = 0
+                while filled < chunk_bytes:
+                    read_count = process.stdout.readinto(view[filled:])
+                    if not read_count:
+                        break
+                    filled += read_count
+                filled -= filled % 2  # 丢弃不完整的样本
+                if filled == 0:
+                    break
+                chunk_samples = np.frombuffer(buffer, dtype=np.int16, count=filled // 2)
+                end_time_ms = start_time_ms + len(chunk_samples) // samples_per_ms
+                if not put_until_stopped((start_time_ms, end_time_ms, chunk_samples)):
+                    return
+                start_time_ms = end_time_ms
+                if filled < chunk_bytes:
+                    break
+            return_code = process.wait()
+            if return_code != 0 and not stop_event.is_set():
+                stderr_file.seek(0)
+                error_text = stderr_file.read().decode("utf-8", errors="ignore")
+                put_until_stopped(
+                    RuntimeError(f"ffmpeg 流式解码失败 (返回码 {return_code}): {error_text}")
+                )
+                return
+        except Exception as e:
+            put_until_stopped(e)
+            return
+        put_until_stopped(end_of_stream)
+
+    producer = threading.Thread(target=produce, name="ffmpeg-pcm-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = chunk_queue.get()
+            if item is end_of_stream:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        producer.join(timeout=5)
+        if process.stdout:
+            process.stdout.close()
+        stderr_file.close()
+
+
+def format_srt_time(seconds):
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = int(seconds % 60)
+    milliseconds = int((seconds * 1000) % 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02},{milliseconds:03}"
+
+
+def extract_chunk_segments(hypothesis, chunk_global_start_offset_sec: float) -> list:
+    """
+    从单个音频块的转录结果中取出分段，并换算为全局时间戳。
+    ARGS:
+        hypothesis: model.transcribe 返回列表中的单个元素。
+        chunk_global_start_offset_sec: 该音频块在整段音频中的起始偏移（秒）。
+    RETURNS:
+        包含 {'start': float, 'end': float, 'segment': str} 的列表；无分段时间戳时返回 None。
+    """
+    if not (
+        hypothesis is not None
+        and hasattr(hypothesis, "timestamp")
+        and hypothesis.timestamp
+        and "segment" in hypothesis.timestamp
+    ):
+        return None
+
+    chunk_segments = []
+    for segment_data in hypothesis.timestamp["segment"]:
+        local_start_sec = segment_data["start"]
+        local_end_sec = segment_data["end"]
+        text_content = segment_data.get("segment", segment_data.get("text", ""))
+        global_start_sec = local_start_sec + chunk_global_start_offset_sec
+        global_end_sec = local_end_sec + chunk_global_start_offset_sec
+        if global_end_sec < global_start_sec:  # 安全检查
+            global_end_sec = global_start_sec + 0.05
+        chunk_segments.append(
+            {
+                "start": global_start_sec,
+                "end": global_end_sec,
+                "segment": text_content,
+            }
+        )
+    return chunk_segments
+
+
+def samples_to_model_input(chunk_samples) -> np.ndarray:
+    """将 int16 PCM 样本转换为模型所需的 float32 波形 (范围 [-1, 1])。"""
+    return np.asarray(chunk_samples, dtype=np.float32) / 32768.0
+
+
+def write_chunk_wav(chunk_samples, output_path: str):
+    """将 int16 PCM 样本写为 16kHz 单声道 WAV 文件 (临时文件回退路径使用)。"""
+    with wave.open(output_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(TARGET_SAMPLE_RATE)
+        wav_file.writeframes(np.ascontiguousarray(chunk_samples, dtype=np.int16).tobytes())
+
+
+def transcribe_chunk_batch_from_temp_files(model, batch_samples: list, metrics=None) -> list:
+    """
+    旧的转录路径：把每个音频块导出为临时 WAV 再交给模型，结束后删除临时文件。
+    在模型不支持直接传入波形数组时作为回退使用。
+    """
+    temp_chunk_file_paths = []
+    try:
+        with measure_stage(metrics, "chunk_prep"):
+            for chunk_samples in batch_samples:
+                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_chunk_file:
+                    temp_chunk_file_paths.append(temp_chunk_file.name)
+                write_chunk_wav(chunk_samples, temp_chunk_file_paths[-1])
+        with measure_stage(metrics, "inference"), inference_context(model):
+            return model.transcribe(
+                temp_chunk_file_paths, batch_size=len(batch_samples), timestamps=True
+            )
+    finally:
+        for temp_chunk_file_path in temp_chunk_file_paths:
+            if os.path.exists(temp_chunk_file_path):
+                try:
+                    os.remove(temp_chunk_file_path)
+                except OSError as e_os:
+                    print(
+                        f"删除临时音频文件 '{temp_chunk_file_path}' 时发生OS错误: {e_os}"
+                    )
+
+
+def iter_chunk_transcriptions(
+    model,
+    chunks,
+    batch_size: int = 1,
+    in_memory: bool = True,
+    completed_chunks: dict = None,
+    on_chunk_transcribed=None,
+    metrics=None,
+    cancel_event: threading.Event = None,
+):
+    """
+    按批转录音频块，逐块产出带全局时间戳的分段。
+    ARGS:
+        model: 已加载的 NeMo ASR 模型。
+        chunks: 可迭代对象，元素为 (start_ms, end_ms, int16 样本数组)。
+        batch_size: 每次 model.transcribe 调用中合并处理的音频块数量。
+        in_memory: 为 True 时直接把波形数组交给模型；失败时自动回退到临时 WAV 文件。
+        completed_chunks: {(start_ms, end_ms): segments}，其中的音频块直接使用已有结果，不再推理。
+        on_chunk_transcribed: 每个新转录成功的音频块完成后调用 (start_ms, end_ms, segments)。
+        metrics: FileMetrics，提供时记录分块准备与推理耗时以及转录进度。
+        cancel_event: 每批推理开始前检查，被设置时抛出 JobCancelledError (正在进行的一批会先完成)。
+    YIELDS:
+        (start_ms, end_ms, segments)，segments 为分段列表；无时间戳时为空列表，转录出错时为 None。
+        输出顺序与输入顺序一致。
+    """
+    batch_size = max(1, int(batch_size))
+    completed_chunks = completed_chunks or {}
+    chunk_iterator = iter(chunks)
+    while True:
+        raise_if_cancelled(cancel_event)
+        round_chunks = []  # 本轮按顺序的所有音频块，包括已完成的
+        batch = []  # 本轮需要推理的音频块
+        for chunk in chunk_iterator:
+            round_chunks.append(chunk)
+            if (chunk[0], chunk[1]) not in completed_chunks:
+                batch.append(chunk)
+                if len(batch) == batch_size:
+                    break
+        if not round_chunks:
+            break
+
+        batch_segments = {}
+        if batch:
+            print(
+                f"处理音频块: {batch[0][0] / 1000:.2f}s - {batch[-1][1] / 1000:.2f}s"
+                f" (本批 {len(batch)} 块)"
+            )
+            batch_samples = [chunk_samples for _, _, chunk_samples in batch]
+            chunk_output_list = None
+            batch_start_time = time.perf_counter()
+            try:
+                if in_memory:
+                    try:
+                        with measure_stage(metrics, "chunk_prep"):
+                            model_inputs = [samples_to_model_input(x) for x in batch_samples]
+                        with measure_stage(metrics, "inference"), inference_context(model):
+                            chunk_output_list = model.transcribe(
+                                model_inputs,
+                                batch_size=len(batch),
+                                timestamps=True,
+                            )
+                    except Exception as e_mem:
+                        print(f"直接传入波形数组转录失败 ({e_mem})，回退到临时 WAV 文件方式。")
+                        in_memory = False
+                if not in_memory:
+                    chunk_output_list = transcribe_chunk_batch_from_temp_files(
+                        model, batch_samples, metrics
+                    )
+            except Exception as e:
+                print(
+                    f"转录音频块 {batch[0][0] / 1000:.2f}s - {batch[-1][1] / 1000:.2f}s 时发生错误: {e}"
+                )
+                import traceback
+
+                traceback.print_exc()
+            batch_seconds = time.perf_counter() - batch_start_time
+
+            for chunk_index, (start_time_ms, end_time_ms, _) in enumerate(batch):
+                if metrics is not None:
+                    metrics.record_chunk(
+                        start_time_ms,
+                        end_time_ms,
+                        batch_seconds / len(batch),
+                        chunk_output_list is not None,
+                    )
+                hypothesis = (
+                    chunk_output_list[chunk_index]
+                    if chunk_output_list and chunk_index < len(chunk_output_list)
+                    else None
+                )
+                chunk_segments = extract_chunk_segments(hypothesis, start_time_ms / 1000.0)
+                if chunk_segments is None and chunk_output_list is not None:
+                    full_text = hypothesis.text if hypothesis is not None else "N/A"
+                    print(
+                        f"警告: 音频块 {start_time_ms / 1000:.2f}s - {end_time_ms / 1000:.2f}s"
+                        f" 未能生成分段时间戳。完整转录: '{full_text}'."
+                    )
+                    chunk_segments = []
+                if chunk_segments is not None and on_chunk_transcribed is not None:
+                    on_chunk_transcribed(start_time_ms, end_time_ms, chunk_segments)
+                batch_segments[(start_time_ms, end_time_ms)] = chunk_segments
+
+        for start_time_ms, end_time_ms, _ in round_chunks:
+            chunk_span = (start_time_ms, end_time_ms)
+            if metrics is not None:
+                metrics.mark_progress(end_time_ms)
+            if chunk_span in batch_segments:
+                yield start_time_ms, end_time_ms, batch_segments[chunk_span]
+            else:
+                yield start_time_ms, end_time_ms, completed_chunks[chunk_span]
+
+
+def open_pcm_wav_memmap(audio_path: str):
+    """
+    以内存映射方式打开 16kHz 单声道 16-bit PCM WAV 文件的 data 块。
+    样本只在被切片访问时才从磁盘按页读入，常驻内存不随音频时长增长。
+    RETURNS:
+        numpy.memmap (int16)；若文件不是该格式则返回 None，由调用方回退到完整解码。
+    """
+    wav_format = read_wav_format(audio_path)
+    if wav_format is None or (
+        wav_format["format_tag"],
+        wav_format["channels"],
+        wav_format["sample_rate"],
+        wav_format["bits_per_sample"],
+    ) != (1, 1, TARGET_SAMPLE_RATE, 16):
+        return None
+    sample_count = wav_format["data_size"] // 2
+    if sample_count <= 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(
+        audio_path,
+        dtype="<i2",
+        mode="r",
+        offset=wav_format["data_offset"],
+        shape=(sample_count,),
+    )
+
+
+def load_audio_samples(audio_path: str) -> np.ndarray:
+    """
+    获取 WAV 文件的 16kHz 单声道 int16 样本数组。
+    优先使用内存映射 (extract_audio_from_video 生成的 WAV 均满足格式要求)；
+    其它格式的 WAV 回退为 pydub 完整解码，数组直接引用 pydub 的原始字节缓冲区。
+    两种情况下后续切片均为零拷贝视图。
+    """
+    samples = open_pcm_wav_memmap(audio_path)
+    if samples is not None:
+        return samples
+    print(f"'{audio_path}' 不是 16kHz 单声道 PCM WAV，改用 pydub 完整解码。")
+    audio = AudioSegment.from_wav(audio_path)
+    audio = audio.set_frame_rate(TARGET_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype=np.int16)
+
+
+def compute_frame_energy_db(samples, frame_ms: int = VAD_FRAME_MS) -> np.ndarray:
+    """
+    计算每个 frame_ms 帧的 RMS 能量 (dBFS)。按块向量化计算，内存映射的长音频也只需常量内存。
+    RETURNS:
+        float32 数组，长度为 ceil(样本数 / 帧长)。
+    """
+    frame_length = TARGET_SAMPLE_RATE * frame_ms // 1000
+    frame_count = -(-len(samples) // frame_length)
+    energy_db = np.empty(frame_count, dtype=np.float32)
+    block_frames = 60_000 // frame_ms  # 每次处理约 60 秒音频
+    for block_start in range(0, frame_count, block_frames):
+        block_end = min(block_start + block_frames, frame_count)
+        block = np.asarray(
+            samples[block_start * frame_length : block_end * frame_length],
+            dtype=np.float32,
+        )
+        padding = (block_end - block_start) * frame_length - len(block)
+        if padding:  # 最后一帧不足一帧长时补零
+            block = np.pad(block, (0, padding))
+        frames = block.reshape(-1, frame_length) / 32768.0
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        energy_db[block_start:block_end] = 20.0 * np.log10(np.maximum(rms, 1e-10))
+    return energy_db
+
+
+def find_quiet_split_ms(
+    energy_db: np.ndarray, start_ms: int, end_ms: int, frame_ms: int = VAD_FRAME_MS
+) -> int:
+    """在 [start_ms, end_ms] 的后三分之一范围内寻找最安静的位置作为切分点。"""
+    search_start = (start_ms + 2 * (end_ms - start_ms) // 3) // frame_ms
+    search_end = max(search_start + 1, end_ms // frame_ms)
+    window = energy_db[search_start:search_end]
+    if len(window) == 0:
+        return end_ms
+    smooth_frames = min(5, len(window))  # 约 150ms 平滑，选择停顿而非单帧的能量低谷
+    smoothed = np.convolve(window, np.ones(smooth_frames) / smooth_frames, mode="same")
+    split_ms = (search_start + int(np.argmin(smoothed))) * frame_ms + frame_ms // 2
+    return min(max(split_ms, start_ms + frame_ms), end_ms)
+
+
+def plan_vad_chunks(
+    energy_db: np.ndarray,
+    max_chunk_ms: int,
+    threshold_db: float = -40.0,
+    min_silence_ms: int = 2000,
+    padding_ms: int = 200,
+    frame_ms: int = VAD_FRAME_MS,
+) -> list:
+    """
+    根据逐帧能量规划音频块：完全静音的区间被跳过，过长的语音区间在附近的停顿处切分。
+    ARGS:
+        energy_db: compute_frame_energy_db 的结果。
+        max_chunk_ms: 单个音频块的最大长度（毫秒）。
+        threshold_db: 低于该能量 (dBFS) 的帧视为静音。
+        min_silence_ms: 连续静音至少这么长才会被跳过，较短的停顿保留在块内。
+        padding_ms: 每个语音区间前后额外保留的长度，避免截断字首字尾。
+    RETURNS:
+        [(start_ms, end_ms), ...]，按时间排序且互不重叠。
+    """
+    total_ms = len(energy_db) * frame_ms
+    is_speech = energy_db >= threshold_db
+    if not is_speech.any():
+        return []
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0]))))
+    region_starts, region_ends = edges[0::2], edges[1::2]
+    # 合并间隔小于 min_silence_ms 的相邻语音区间
+    keep = (region_starts[1:] - region_ends[:-1]) * frame_ms >= min_silence_ms
+    region_starts = np.concatenate((region_starts[:1], region_starts[1:][keep]))
+    region_ends = np.concatenate((region_ends[:-1][keep], region_ends[-1:]))
+
+    chunk_spans = []
+    for region_start, region_end in zip(region_starts, region_ends):
+        chunk_start_ms = max(0, int(region_start) * frame_ms - padding_ms)
+        region_end_ms = min(total_ms, int(region_end) * frame_ms + padding_ms)
+        while region_end_ms - chunk_start_ms > max_chunk_ms:
+            split_ms = find_quiet_split_ms(
+                energy_db, chunk_start_ms, chunk_start_ms + max_chunk_ms, frame_ms
+            )
+            chunk_spans.append((chunk_start_ms, split_ms))
+            chunk_start_ms = split_ms
+        chunk_spans.append((chunk_start_ms, region_end_ms))
+    return chunk_spans
+
+
+def iter_vad_chunks_from_stream(pcm_windows, max_chunk_ms: int, threshold_db: float = -40.0):
+    """
+    对流式 PCM 窗口重新分块：缓存至少两个最大块长的音频后运行 plan_vad_chunks，
+    只输出已确定的块，其余部分留到下一轮与后续音频一起规划。
+    ARGS:
+        pcm_windows: (start_ms, end_ms, int16 样本数组) 的可迭代对象，须首尾相接。
+    YIELDS:
+        (start_ms, end_ms, int16 样本数组)，静音区间不会被输出。
+    """
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    buffer_start_ms = 0
+    buffered = np.zeros(0, dtype=np.int16)
+    stream_ended = False
+    pcm_windows = iter(pcm_windows)
+    while not stream_ended:
+        window = next(pcm_windows, None)
+        if window is None:
+            stream_ended = True
+        else:
+            buffered = np.concatenate((buffered, window[2]))
+        buffered_ms = len(buffered) // samples_per_ms
+        if not stream_ended and buffered_ms < 2 * max_chunk_ms:
+            continue
+
+        chunk_spans = plan_vad_chunks(
+            compute_frame_energy_db(buffered), max_chunk_ms, threshold_db
+        )
+        final_limit_ms = buffered_ms if stream_ended else buffered_ms - max_chunk_ms
+        drop_ms = final_limit_ms
+        for span_start_ms, span_end_ms in chunk_spans:
+            span_end_ms = min(span_end_ms, buffered_ms)
+            if span_end_ms > final_limit_ms:
+                drop_ms = min(span_start_ms, final_limit_ms)
+                break
+            yield (
+                buffer_start_ms + span_start_ms,
+                buffer_start_ms + span_end_ms,
+                buffered[span_start_ms * samples_per_ms : span_end_ms * samples_per_ms],
+            )
+        buffered = buffered[drop_ms * samples_per_ms :]
+        buffer_start_ms += drop_ms
+
+
+def add_chunk_overlap(chunk_spans: list, overlap_ms: int) -> list:
+    """
+    将每个与前一块首尾相接的音频块的起点向前延伸 overlap_ms，使相邻块在边界处重叠。
+    与前一块之间有间隔 (例如被跳过的静音) 的块保持不变。
+    """
+    if overlap_ms <= 0:
+        return list(chunk_spans)
+    overlapped_spans = []
+    for index, (start_ms, end_ms) in enumerate(chunk_spans):
+        if index > 0 and chunk_spans[index - 1][1] >= start_ms:
+            start_ms = max(chunk_spans[index - 1][0], start_ms - overlap_ms)
+        overlapped_spans.append((start_ms, end_ms))
+    return overlapped_spans
+
+
+def iter_overlapping_stream_chunks(chunks, overlap_ms: int):
+    """
+    流式版本的 add_chunk_overlap：在每个与前一块相接的块前拼接前一块末尾 overlap_ms 的样本。
+    """
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    previous_chunk = None
+    for start_ms, end_ms, chunk_samples in chunks:
+        if overlap_ms > 0 and previous_chunk is not None and previous_chunk[1] >= start_ms:
+            previous_start_ms, _, previous_samples = previous_chunk
+            carried_ms = min(overlap_ms, start_ms - previous_start_ms)
+            carried = previous_samples[len(previous_samples) - carried_ms * samples_per_ms :]
+            previous_chunk = (start_ms, end_ms, chunk_samples)
+            yield start_ms - carried_ms, end_ms, np.concatenate((carried, chunk_samples))
+        else:
+            previous_chunk = (start_ms, end_ms, chunk_samples)
+            yield start_ms, end_ms, chunk_samples
+
+
+def text_similarity(text_a: str, text_b: str) -> float:
+    """两段文本的相似度 (0-1)，忽略大小写与首尾空白。"""
+    return difflib.SequenceMatcher(
+        None, text_a.strip().lower(), text_b.strip().lower()
+    ).ratio()
+
+
+class ChunkSegmentMerger:
+    """
+    按时间顺序线性合并各音频块的分段。
+    相邻块存在重叠时，以重叠区域中点为界：前一块保留中点落在界线之前的分段，后一块保留其余分段；
+    重叠区域内两侧分段逐对比较，时间相交且文本相似的视为重复，只保留文本较完整的一个；
+    时间相交但文本不同的分段，截短前一个的结束时间以保证字幕时间单调。
+    后一块在重叠区域内没有任何分段 (该块转录失败或为空) 时，前一块的分段全部保留。
+    由于块按时间顺序到达，结果无需再整体排序。
+    """
+
+    def __init__(self, similarity_threshold: float = 0.6):
+        self.similarity_threshold = similarity_threshold
+        self.pending_segments = []  # 最近一块的分段，需等待下一块到达后才能确定
+        self.pending_chunk_end_sec = None
+
+    def add_chunk(self, chunk_start_sec: float, chunk_end_sec: float, segments: list) -> list:
+        """加入一个音频块的分段 (已是全局时间戳)，返回已经确定、可以输出的分段。"""
+        segments = segments or []
+        overlap_end_sec = self.pending_chunk_end_sec
+        if (
+            overlap_end_sec is not None
+            and chunk_start_sec < overlap_end_sec
+            and any(segment["start"] < overlap_end_sec for segment in segments)
+        ):
+            boundary_sec = (chunk_start_sec + overlap_end_sec) / 2.0
+            finalized = [
+                segment
+                for segment in self.pending_segments
+                if (segment["start"] + segment["end"]) / 2.0 < boundary_sec
+            ]
+            incoming = [
+                segment
+                for segment in segments
+                if (segment["start"] + segment["end"]) / 2.0 >= boundary_sec
+            ]
+            finalized, incoming = self.remove_overlap_duplicates(
+                finalized, incoming, chunk_start_sec, overlap_end_sec
+            )
+            if finalized and incoming:
+                previous_segment, next_segment = finalized[-1], incoming[0]
+                if previous_segment["end"] > next_segment["start"]:
+                    previous_segment["end"] = max(
+                        previous_segment["start"] + 0.05, next_segment["start"]
+                    )
+        else:
+            finalized = self.pending_segments
+            incoming = segments
+
+        self.pending_segments = list(incoming)
+        self.pending_chunk_end_sec = chunk_end_sec
+        return finalized
+
+    def remove_overlap_duplicates(
+        self, finalized: list, incoming: list, overlap_start_sec: float, overlap_end_sec: float
+    ):
+        """
+        在重叠区域 [overlap_start_sec, overlap_end_sec] 内逐对比较前后两块的分段，
+        时间相交且文本相似的一对只保留文本较长的一个 (相同时保留后一块的)。
+        RETURNS:
+            去重后的 (finalized, incoming)。
+        """
+        dropped_previous = set()
+        dropped_incoming = set()
+        for previous_index, previous_segment in enumerate(finalized):
+            if previous_segment["end"] <= overlap_start_sec:
+                continue
+            for next_index, next_segment in enumerate(incoming):
+                if next_segment["start"] >= overlap_end_sec:
+                    break
+                if next_index in dropped_incoming:
+                    continue
+                if (
+                    previous_segment["end"] <= next_segment["start"]
+                    or next_segment["end"] <= previous_segment["start"]
+                ):
+                    continue
+                if (
+                    text_similarity(previous_segment["segment"], next_segment["segment"])
+                    < self.similarity_threshold
+                ):
+                    continue
+                if len(next_segment["segment"]) >= len(previous_segment["segment"]):
+                    dropped_previous.add(previous_index)
+                    break
+                dropped_incoming.add(next_index)
+        return (
+            [segment for index, segment in enumerate(finalized) if index not in dropped_previous],
+            [segment for index, segment in enumerate(incoming) if index not in dropped_incoming],
+        )
+
+    def flush(self) -> list:
+        """返回最后一块中剩余的分段。"""
+        finalized = self.pending_segments
+        self.pending_segments = []
+        self.pending_chunk_end_sec = None
+        return finalized
+
+
+# --- 转录缓存 ---
+def compute_pcm_fingerprint(samples) -> str:
+    """按块计算 int16 PCM 样本的 SHA-256，内存映射的长音频也只需常量内存。"""
+    hasher = hashlib.sha256()
+    block_samples = TARGET_SAMPLE_RATE * 60
+    for block_start in range(0, len(samples), block_samples):
+        hasher.update(
+            np.ascontiguousarray(samples[block_start : block_start + block_samples]).tobytes()
+        )
+    return hasher.hexdigest()
+
+
+def iter_fingerprinted_chunks(chunks, hasher):
+    """流式模式下边转发音频块边更新哈希，结果与 compute_pcm_fingerprint 对同一段 PCM 一致。"""
+    for start_ms, end_ms, chunk_samples in chunks:
+        hasher.update(np.ascontiguousarray(chunk_samples).tobytes())
+        yield start_ms, end_ms, chunk_samples
+
+
+def make_transcription_cache_key(
+    pcm_fingerprint: str, model_identity: str, chunk_settings: dict
+) -> str:
+    """由音频内容哈希、模型标识和分块参数生成缓存键。"""
+    key_material = json.dumps(
+        {
+            "version": TRANSCRIPTION_CACHE_VERSION,
+            "pcm": pcm_fingerprint,
+            "model": model_identity,
+            "chunking": chunk_settings,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+def get_transcription_cache_path(cache_key: str) -> str:
+    return os.path.join(transcription_cache_folder_path, cache_key + ".json")
+
+
+def load_cached_segments(cache_key: str):
+    """
+    读取缓存的分段列表，命中时刷新文件修改时间作为 LRU 记录。
+    RETURNS:
+        分段列表；未命中或缓存损坏时返回 None。
+    """
+    cache_path = get_transcription_cache_path(cache_key)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+        os.utime(cache_path, None)
+        return cached["segments"]
+    except (OSError, json.JSONDecodeError, KeyError) as e:
+        print(f"读取转录缓存 '{cache_path}' 失败，将重新转录: {e}")
+        return None
+
+
+def evict_transcription_cache(max_cache_bytes: int):
+    """按最近使用时间淘汰缓存文件，直到缓存总大小不超过 max_cache_bytes。"""
+    if not os.path.isdir(transcription_cache_folder_path):
+        return
+    entries = []
+    for entry in os.scandir(transcription_cache_folder_path):
+        if entry.is_file() and entry.name.endswith(".json"):
+            entry_stat = entry.stat()
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_cache_bytes:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except OSError as e:
+            print(f"淘汰转录缓存 '{path}' 失败: {e}")
+
+
+def store_cached_segments(cache_key: str, segments: list, source_name: str = ""):
+    """写入缓存 (先写临时文件再原子替换)，随后按容量上限淘汰最久未使用的条目。"""
+    if transcription_cache_max_bytes <= 0:
+        return
+    os.makedirs(transcription_cache_folder_path, exist_ok=True)
+    cache_path = get_transcription_cache_path(cache_key)
+    temp_cache_path = cache_path + ".tmp"
+    try:
+        with open(temp_cache_path, "w", encoding="utf-8") as cache_file:
+            json.dump(
+                {"source": source_name, "created": time.time(), "segments": segments},
+                cache_file,
+                ensure_ascii=False,
+            )
+        os.replace(temp_cache_path, cache_path)
+    except OSError as e:
+        print(f"写入转录缓存 '{cache_path}' 失败: {e}")
+        return
+    evict_transcription_cache(transcription_cache_max_bytes)
+
+
+def get_chunk_settings(
+    chunk_length_ms: int,
+    vad_enabled: bool,
+    vad_threshold_db: float,
+    chunk_overlap_ms: int,
+) -> dict:
+    """影响转录结果的分块参数，作为缓存键的一部分。"""
+    return {
+        "chunk_length_ms": chunk_length_ms,
+        "vad_threshold_db": vad_threshold_db if vad_enabled else None,
+        "chunk_overlap_ms": chunk_overlap_ms,
+    }
+
+
+# --- 断点续传 ---
+def get_chunk_journal_path(journal_key: str) -> str:
+    return os.path.join(checkpoint_folder_path, journal_key + ".jsonl")
+
+
+def load_chunk_journal(journal_key: str) -> dict:
+    """
+    读取之前中断的任务已完成的音频块。
+    RETURNS:
+        {(start_ms, end_ms): segments}；没有日志时为空字典。崩溃时写了一半的最后一行会被忽略。
+    """
+    journal_path = get_chunk_journal_path(journal_key)
+    completed_chunks = {}
+    if not os.path.exists(journal_path):
+        return completed_chunks
+    try:
+        with open(journal_path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                    completed_chunks[(record["start_ms"], record["end_ms"])] = record["segments"]
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    except OSError as e:
+        print(f"读取断点日志 '{journal_path}' 失败，将从头转录: {e}")
+        return {}
+    return completed_chunks
+
+
+def append_chunk_journal(journal_key: str, start_ms: int, end_ms: int, segments: list):
+    """把一个已完成音频块的分段追加到断点日志并立即落盘。"""
+    os.makedirs(checkpoint_folder_path, exist_ok=True)
+    journal_path = get_chunk_journal_path(journal_key)
+    try:
+        with open(journal_path, "a", encoding="utf-8") as journal_file:
+            journal_file.write(
+                json.dumps(
+                    {"start_ms": start_ms, "end_ms": end_ms, "segments": segments},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+    except OSError as e:
+        print(f"写入断点日志 '{journal_path}' 失败: {e}")
+
+
+def remove_chunk_journal(journal_key: str):
+    """任务完整结束后删除断点日志。"""
+    journal_path = get_chunk_journal_path(journal_key)
+    if os.path.exists(journal_path):
+        try:
+            os.remove(journal_path)
+        except OSError as e:
+            print(f"删除断点日志 '{journal_path}' 时出错: {e}")
+
+
+def get_media_file_identity(media_path: str) -> str:
+    """流式模式下无法预先得到音频内容哈希，以源文件路径、大小和修改时间代替。"""
+    media_stat = os.stat(media_path)
+    return f"file:{os.path.abspath(media_path)}:{media_stat.st_size}:{media_stat.st_mtime_ns}"
+
+
+# --- 多进程分片转录 ---
+shard_worker_pool = None  # (模型, 工作进程数, ProcessPoolExecutor)，由 get_shard_worker_pool 创建，跨文件和任务复用
+shard_worker_pool_lock = threading.Lock()
+
+
+def get_shard_start_method():
+    """
+    分片工作进程的启动方式。不使用 fork：主进程中已有界面、预取和调度线程以及初始化过的
+    OpenMP/MKL 线程池，从这样的进程 fork 可能死锁。forkserver 从干净的服务进程派生工作进程，
+    不可用时 (Windows) 使用 spawn。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return "forkserver"
+    return "spawn"
+
+
+def move_model_weights_to_shared_memory(model):
+    """
+    把 torch 模型的参数和缓冲区搬到共享内存：同一 dtype 的张量复制进一整块共享内存，原张量改为其中的视图。
+    之后把模型 pickle 给工作进程时张量只传递共享内存句柄，工作进程映射同一块物理内存，不复制权重；
+    每种 dtype 只有一个句柄 (逐个张量共享时句柄数可能超过进程的文件描述符上限)。
+    搬移期间同一 dtype 的权重短暂占用两份内存。不是 torch 模型 (例如替身模型) 或已在共享内存中的张量不做处理。
+    """
+    torch_module = sys.modules.get("torch")
+    if torch_module is None or not isinstance(model, torch_module.nn.Module):
+        return
+    tensors_by_dtype = collections.defaultdict(list)
+    for tensor in itertools.chain(model.parameters(), model.buffers()):
+        if tensor.device.type == "cpu" and not tensor.is_shared():
+            tensors_by_dtype[tensor.dtype].append(tensor)
+    with torch_module.no_grad():
+        for dtype, tensors in tensors_by_dtype.items():
+            shared_buffer = torch_module.empty(
+                sum(tensor.numel() for tensor in tensors), dtype=dtype
+            ).share_memory_()
+            offset = 0
+            for tensor in tensors:
+                shared_view = shared_buffer[offset : offset + tensor.numel()].view(tensor.shape)
+                shared_view.copy_(tensor)
+                tensor.data = shared_view
+                offset += tensor.numel()
+
+
+def init_shard_worker(thread_count: int, model):
+    """
+    分片工作进程的初始化函数。model 由主进程 pickle 传入：torch 模型的参数与缓冲区已在共享内存中，
+    反序列化时只重建模块结构并映射主进程的那块内存，不重新加载也不复制权重。
+    """
+    global shard_worker_model
+    shard_worker_model = model
+    # tuned/int8/bf16 配置会把线程数设为全部物理核心，多个进程同时推理时需按进程数重新分配
+    if "torch" in sys.modules:
+        set_torch_thread_counts(thread_count)
+
+
+def get_shard_worker_pool(model):
+    """
+    返回为 model 启动的分片工作进程池。池在第一次分片转录时启动，之后跨文件和任务复用；
+    model 或 shard_workers 改变时关闭旧池再启动新池。
+    RETURNS:
+        ProcessPoolExecutor；工作进程无法启动 (例如模型无法 pickle) 时返回 None，调用方按单进程转录。
+    """
+    global shard_worker_pool
+    worker_count = shard_workers
+    with shard_worker_pool_lock:
+        if shard_worker_pool is not None:
+            pool_model, pool_worker_count, shard_executor = shard_worker_pool
+            if pool_model is model and pool_worker_count == worker_count:
+                return shard_executor
+            shard_worker_pool = None
+            shard_executor.shutdown(wait=False, cancel_futures=True)
+
+        thread_count = max(1, get_physical_cpu_count() // worker_count)
+        start_method = get_shard_start_method()
+        print(
+            f"启动分片工作进程池: {worker_count} 个工作进程 ({start_method})，每个进程 {thread_count} 个线程"
+        )
+        shard_executor = None
+        try:
+            if "torch" in sys.modules:
+                # 注册 torch 张量经共享内存传递的 pickle 方式
+                from torch.multiprocessing import reductions
+
+                reductions.init_reductions()
+            move_model_weights_to_shared_memory(model)
+            shard_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=worker_count,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=init_shard_worker,
+                initargs=(thread_count, model),
+            )
+            # 提交一个空任务：立即启动全部工作进程，并确认模型已能在工作进程中使用
+            shard_executor.submit(os.getpid).result()
+        except Exception as e:
+            print(f"无法启动分片工作进程，按单进程转录: {e}")
+            if shard_executor is not None:
+                shard_executor.shutdown(wait=False, cancel_futures=True)
+            return None
+        shard_worker_pool = (model, worker_count, shard_executor)
+        return shard_executor
+
+
+def shutdown_shard_worker_pool(shard_executor=None):
+    """
+    关闭分片工作进程池 (指定 shard_executor 时只在它仍是当前池时清除登记)，工作进程退出后其映射的共享权重随之释放。
+    """
+    global shard_worker_pool
+    with shard_worker_pool_lock:
+        if shard_worker_pool is not None and shard_executor in (None, shard_worker_pool[2]):
+            shard_executor = shard_worker_pool[2]
+            shard_worker_pool = None
+    if shard_executor is not None:
+        shard_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_shard_worker_pool_if_evicted():
+    """模型被逐出常驻登记后，关闭仍为它运行的工作进程池，避免工作进程继续占用该模型的共享内存。"""
+    with shard_worker_pool_lock:
+        pool_model = shard_worker_pool[0] if shard_worker_pool is not None else None
+    if pool_model is None or pool_model is asr_model:
+        return
+    with model_registry.lock:
+        resident = any(entry["model"] is pool_model for entry in model_registry.entries.values())
+    if not resident:
+        shutdown_shard_worker_pool()
+
+
+def transcribe_shard_in_worker(audio_path: str, shard_spans: list, batch_size: int, in_memory: bool):
+    """
+    在工作进程中转录一个分片 (若干相邻音频块)。每个进程各自内存映射同一个 WAV，样本不经进程间传递。
+    RETURNS:
+        (分片结果列表 [(start_ms, end_ms, segments)], 逐块耗时记录, 各阶段耗时)
+    """
+    if shard_worker_model is None:
+        raise RuntimeError("分片工作进程中没有可用的模型")
+    samples = load_audio_samples(audio_path)
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    shard_metrics = FileMetrics(os.path.basename(audio_path))
+    shard_chunks = (
+        (start_ms, end_ms, samples[start_ms * samples_per_ms : end_ms * samples_per_ms])
+        for start_ms, end_ms in shard_spans
+    )
+    shard_results = list(
+        iter_chunk_transcriptions(
+            shard_worker_model,
+            shard_chunks,
+            batch_size=batch_size,
+            in_memory=in_memory,
+            metrics=shard_metrics,
+        )
+    )
+    del shard_chunks, samples
+    return shard_results, shard_metrics.chunk_records, dict(shard_metrics.stage_seconds)
+
+
+def iter_sharded_chunk_transcriptions(
+    shard_executor,
+    audio_path: str,
+    chunk_spans: list,
+    batch_size: int = 1,
+    in_memory: bool = True,
+    completed_chunks: dict = None,
+    on_chunk_transcribed=None,
+    metrics=None,
+    cancel_event: threading.Event = None,
+):
+    """
+    把音频块按 batch_size 个一组切成分片，提交给 get_shard_worker_pool 返回的工作进程池并行转录。
+    输出与 iter_chunk_transcriptions 相同 (按输入顺序产出带全局时间戳的分段)，
+    因此重叠合并、断点日志和边转录边写字幕的处理不变；后面的分片仍在转录时前面的结果即可产出。
+    等待分片结果期间 cancel_event 被设置时抛出 JobCancelledError；提前结束时撤销尚未开始的分片，
+    并等待正在推理的分片完成后才返回 (工作进程仍映射着该 WAV，调用方随后会删除它)。
+    """
+    completed_chunks = completed_chunks or {}
+    batch_size = max(1, int(batch_size))
+    pending_spans = [span for span in chunk_spans if span not in completed_chunks]
+    shards = [
+        pending_spans[shard_start : shard_start + batch_size]
+        for shard_start in range(0, len(pending_spans), batch_size)
+    ]
+    print(f"分片转录: {len(pending_spans)} 个音频块分为 {len(shards)} 个分片")
+
+    def submit_shard(shard):
+        try:
+            return shard_executor.submit(
+                transcribe_shard_in_worker, audio_path, shard, batch_size, in_memory
+            )
+        except (concurrent.futures.process.BrokenProcessPool, RuntimeError) as e:
+            # 工作进程池已损坏或已关闭：该分片按转录失败处理，断点日志保留，重新运行时会启动新的池
+            failed_future = concurrent.futures.Future()
+            failed_future.set_exception(e)
+            return failed_future
+
+    shard_futures = {shard[0]: submit_shard(shard) for shard in shards}
+    try:
+        shard_results = {}
+        for chunk_span in chunk_spans:
+            raise_if_cancelled(cancel_event)
+            if chunk_span in completed_chunks:
+                if metrics is not None:
+                    metrics.mark_progress(chunk_span[1])
+                yield chunk_span[0], chunk_span[1], completed_chunks[chunk_span]
+                continue
+            if chunk_span in shard_futures:
+                shard_future = shard_futures.pop(chunk_span)
+                while not shard_future.done():
+                    concurrent.futures.wait([shard_future], timeout=0.5)
+                    raise_if_cancelled(cancel_event)
+                try:
+                    results, chunk_records, stage_seconds = shard_future.result()
+                except Exception as e:
+                    print(f"分片 {chunk_span[0] / 1000:.2f}s 起的工作进程出错: {e}")
+                    if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                        shutdown_shard_worker_pool(shard_executor)
+                    shard = next(shard for shard in shards if shard[0] == chunk_span)
+                    results, chunk_records, stage_seconds = (
+                        [(start_ms, end_ms, None) for start_ms, end_ms in shard],
+                        [],
+                        {},
+                    )
+                if metrics is not None:
+                    metrics.merge_shard(chunk_records, stage_seconds)
+                for start_ms, end_ms, segments in results:
+                    if segments is not None and on_chunk_transcribed is not None:
+                        on_chunk_transcribed(start_ms, end_ms, segments)
+                    shard_results[(start_ms, end_ms)] = segments
+            if metrics is not None:
+                metrics.mark_progress(chunk_span[1])
+            yield chunk_span[0], chunk_span[1], shard_results.pop(chunk_span)
+    finally:
+        for shard_future in shard_futures.values():
+            shard_future.cancel()
+        concurrent.futures.wait(list(shard_futures.values()))
+
+
+def can_shard_transcription() -> bool:
+    """分片转录只用于 CPU：GPU 上多个进程竞争同一张卡不会更快。"""
+    if shard_workers <= 1:
+        return False
+    if device is not None and device.type != "cpu":
+        print("分片转录仅在 CPU 上启用，当前使用 GPU，按单进程转录。")
+        return False
+    return True
+
+
+def transcribe_audio_in_chunks(
+    model,
+    audio_path: str,
+    chunk_length_ms: int,
+    batch_size: int = 1,
+    in_memory: bool = True,
+    vad_enabled: bool = False,
+    vad_threshold_db: float = -40.0,
+    chunk_overlap_ms: int = 0,
+    model_identity: str = None,
+    metrics=None,
+    on_segments_ready=None,
+    cancel_event: threading.Event = None,
+) -> list:
+    """
+    将音频文件分块转录并返回带有全局时间戳的段列表。
+    ARGS:
+        model: 已加载的 NeMo ASR 模型。
+        audio_path: 音频文件路径 (假设为 WAV)。
+        chunk_length_ms: 每块的长度（毫秒）。
+        batch_size: 每次 model.transcribe 调用中合并处理的音频块数量。
+        in_memory: 是否直接将内存中的波形切片交给模型 (否则每块导出临时 WAV)。
+        vad_enabled: 为 True 时按静音检测结果分块，块边界落在停顿处并跳过完全静音的区间。
+        vad_threshold_db: 静音检测的能量阈值 (dBFS)。
+        chunk_overlap_ms: 相邻音频块的重叠长度（毫秒），重叠区域内的重复分段会被合并。
+        model_identity: 模型标识。提供时按 音频内容+模型+分块参数 查询/写入转录缓存，命中则跳过推理；
+            同时把每个完成的音频块记入断点日志，重新运行同一输入时从第一个未完成的块继续。
+        metrics: FileMetrics，提供时记录音频加载、分块准备、推理与合并各阶段的耗时以及转录进度。
+        on_segments_ready: 每当一批分段确定 (不会再被后续音频块的重叠合并修改) 时按时间顺序调用，
+            参数为该批分段列表，用于边转录边写出字幕。
+        cancel_event: 在音频块批次之间检查，被设置时抛出 JobCancelledError (checkpoint_key 为本文件的断点日志)。
+    RETURNS:
+        包含 {'start': float, 'end': float, 'segment': str} 的列表。
+
+    """
+    if model is None:
+        print("模型未加载，无法进行转录。")
+        return []
+    if not audio_path or not os.path.exists(audio_path):
+        print(f"错误: 音频文件路径 '{audio_path}' 无效或文件不存在。")
+        return []
+
+    print(f"正在加载音频文件 '{audio_path}' 进行分块处理...")
+    try:
+        with measure_stage(metrics, "audio_load"):
+            samples = load_audio_samples(audio_path)
+    except Exception as e:
+        print(f"加载或处理音频文件 '{audio_path}' 时发生错误: {e}")
+        return []
+
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    audio_duration_ms = len(samples) // samples_per_ms
+    print(f"音频总时长: {audio_duration_ms / 1000:.2f} 秒")
+    if metrics is not None:
+        metrics.audio_duration_s = audio_duration_ms / 1000.0
+
+    try:
+        return transcribe_loaded_samples(
+            model,
+            samples,
+            audio_path,
+            chunk_length_ms,
+            batch_size=batch_size,
+            in_memory=in_memory,
+            vad_enabled=vad_enabled,
+            vad_threshold_db=vad_threshold_db,
+            chunk_overlap_ms=chunk_overlap_ms,
+            model_identity=model_identity,
+            metrics=metrics,
+            on_segments_ready=on_segments_ready,
+            cancel_event=cancel_event,
+        )
+    finally:
+        # 无论成功、命中缓存、出错还是取消都释放内存映射，
+        # 调用方随后需要删除该 WAV (Windows 下被映射的文件无法删除)
+        del samples
+
+
+def transcribe_loaded_samples(
+    model,
+    samples: np.ndarray,
+    audio_path: str,
+    chunk_length_ms: int,
+    batch_size: int = 1,
+    in_memory: bool = True,
+    vad_enabled: bool = False,
+    vad_threshold_db: float = -40.0,
+    chunk_overlap_ms: int = 0,
+    model_identity: str = None,
+    metrics=None,
+    on_segments_ready=None,
+    cancel_event: threading.Event = None,
+) -> list:
+    """
+    transcribe_audio_in_chunks 的主体：对已载入的 16 kHz PCM 采样查询缓存、规划音频块、转录并合并。
+    samples 由调用方持有并负责释放，这里只在其上创建切片视图。
+    其余参数与返回值同 transcribe_audio_in_chunks。
+    """
+    samples_per_ms = TARGET_SAMPLE_RATE // 1000
+    audio_duration_ms = len(samples) // samples_per_ms
+
+    cache_key = None
+    if model_identity and (transcription_cache_max_bytes > 0 or checkpoint_enabled):
+        cache_key = make_transcription_cache_key(
+            compute_pcm_fingerprint(samples),
+            model_identity,
+            get_chunk_settings(
+                chunk_length_ms, vad_enabled, vad_threshold_db, chunk_overlap_ms
+            ),
+        )
+        cached_segments = (
+            load_cached_segments(cache_key) if transcription_cache_max_bytes > 0 else None
+        )
+        if cached_segments is not None:
+            print(f"命中转录缓存 ({cache_key[:12]}...)，跳过推理。")
+            if metrics is not None:
+                metrics.mark_progress(audio_duration_ms)
+                metrics.cache_hit = True
+            if on_segments_ready is not None:
+                on_segments_ready(cached_segments)
+            return cached_segments
+
+    completed_chunks = {}
+    append_to_journal = None
+    if cache_key and checkpoint_enabled:
+        completed_chunks = load_chunk_journal(cache_key)
+        if completed_chunks:
+            print(f"发现断点日志，{len(completed_chunks)} 个音频块已完成，将从第一个未完成的块继续。")
+        append_to_journal = functools.partial(append_chunk_journal, cache_key)
+
+    if vad_enabled:
+        chunk_spans = plan_vad_chunks(
+            compute_frame_energy_db(samples), chunk_length_ms, vad_threshold_db
+        )
+        chunk_spans = [(start, min(end, audio_duration_ms)) for start, end in chunk_spans]
+        speech_ms = sum(end - start for start, end in chunk_spans)
+        print(
+            f"静音检测: {len(chunk_spans)} 个音频块，跳过静音 {(audio_duration_ms - speech_ms) / 1000:.2f} 秒"
+        )
+    else:
+        chunk_spans = [
+            (start, min(start + chunk_length_ms, audio_duration_ms))
+            for start in range(0, audio_duration_ms, chunk_length_ms)
+        ]
+    chunk_spans = add_chunk_overlap(chunk_spans, chunk_overlap_ms)
+
+    def iter_planned_chunks():
+        for start_time_ms, end_time_ms in chunk_spans:
+            # 切片是原始缓冲区的视图，不产生拷贝
+            chunk_samples = samples[start_time_ms * samples_per_ms : end_time_ms * samples_per_ms]
+            yield start_time_ms, end_time_ms, chunk_samples
+
+    shard_executor = None
+    if len(chunk_spans) > 1 and can_shard_transcription():
+        shard_executor = get_shard_worker_pool(model)
+    if shard_executor is not None:
+        chunk_transcriptions = iter_sharded_chunk_transcriptions(
+            shard_executor,
+            audio_path,
+            chunk_spans,
+            batch_size=batch_size,
+            in_memory=in_memory,
+            completed_chunks=completed_chunks,
+            on_chunk_transcribed=append_to_journal,
+            metrics=metrics,
+            cancel_event=cancel_event,
+        )
+    else:
+        chunk_transcriptions = iter_chunk_transcriptions(
+            model,
+            iter_planned_chunks(),
+            batch_size=batch_size,
+            in_memory=in_memory,
+            completed_chunks=completed_chunks,
+            on_chunk_transcribed=append_to_journal,
+            metrics=metrics,
+            cancel_event=cancel_event,
+        )
+
+    all_segment_timestamps = []
+    merger = ChunkSegmentMerger()
+    transcription_failed = False
+    try:
+        for start_time_ms, end_time_ms, chunk_segments in chunk_transcriptions:
+            transcription_failed = transcription_failed or chunk_segments is None
+            with measure_stage(metrics, "merge"):
+                settled_segments = merger.add_chunk(
+                    start_time_ms / 1000.0, end_time_ms / 1000.0, chunk_segments
+                )
+            all_segment_timestamps.extend(settled_segments)
+            if on_segments_ready is not None:
+                on_segments_ready(settled_segments)
+    except JobCancelledError as e:
+        if cache_key and checkpoint_enabled:
+            e.checkpoint_key = cache_key
+        raise
+    finally:
+        # 提前结束时关闭仍挂起的分块生成器，使其不再持有采样切片
+        chunk_transcriptions.close()
+    with measure_stage(metrics, "merge"):
+        settled_segments = merger.flush()
+    all_segment_timestamps.extend(settled_segments)
+    if on_segments_ready is not None:
+        on_segments_ready(settled_segments)
+
+    if cache_key and not transcription_failed:  # 部分音频块出错的结果不写入缓存，断点日志也保留
+        store_cached_segments(cache_key, all_segment_timestamps, os.path.basename(audio_path))
+        remove_chunk_journal(cache_key)
+    return all_segment_timestamps
+
+
+def transcribe_media_streaming(
+    model,
+    input_media_path: str,
+    chunk_length_ms: int,
+    batch_size: int = 1,
+    in_memory: bool = True,
+    vad_enabled: bool = False,
+    vad_threshold_db: float = -40.0,
+    chunk_overlap_ms: int = 0,
+    model_identity: str = None,
+    metrics=None,
+    on_segments_ready=None,
+    cancel_event: threading.Event = None,
+) -> list:
+    """
+    流式模式：一边由 ffmpeg 解码输入文件，一边转录已解码的音频块，不生成完整的中间 WAV。
+    ARGS/RETURNS 与 transcribe_audio_in_chunks 相同，但 input_media_path 可以是任意 ffmpeg 支持的媒体文件。
+    音频内容哈希要等解码结束才能得到，因此流式模式只写入转录缓存，不会在推理前查询缓存；
+    断点日志则以源文件路径、大小和修改时间为键，续传时已完成的块只解码不推理。
+    cancel_event 被设置时立即结束 ffmpeg 解码进程并抛出 JobCancelledError (checkpoint_key 为断点日志)。
+    """
+    if model is None:
+        print("模型未加载，无法进行转录。")
+        return []
+    if not input_media_path or not os.path.exists(input_media_path):
+        print(f"错误: 媒体文件路径 '{input_media_path}' 无效或文件不存在。")
+        return []
+
+    print(f"正在以流式模式解码并转录 '{input_media_path}'...")
+    media_probe = probe_media(input_media_path)
+    if metrics is not None and media_probe is not None:
+        # 事先知道总时长时，状态栏可以显示剩余时间估计
+        metrics.audio_duration_s = media_probe["duration_s"]
+    pcm_chunks = stream_pcm_chunks_from_ffmpeg(
+        input_media_path, chunk_length_ms, queue_size=max(2, 2 * batch_size)
+    )
+    chunks = pcm_chunks
+    pcm_hasher = None
+    if model_identity and transcription_cache_max_bytes > 0:
+        pcm_hasher = hashlib.sha256()
+        chunks = iter_fingerprinted_chunks(chunks, pcm_hasher)
+    if vad_enabled:
+        chunks = iter_vad_chunks_from_stream(chunks, chunk_length_ms, vad_threshold_db)
+    chunks = iter_overlapping_stream_chunks(chunks, chunk_overlap_ms)
+
+    journal_key = None
+    completed_chunks = {}
+    append_to_journal = None
+    if model_identity and checkpoint_enabled:
+        journal_key = make_transcription_cache_key(
+            get_media_file_identity(input_media_path),
+            model_identity,
+            get_chunk_settings(
+                chunk_length_ms, vad_enabled, vad_threshold_db, chunk_overlap_ms
+            ),
+        )
+        completed_chunks = load_chunk_journal(journal_key)
+        if completed_chunks:
+            print(f"发现断点日志，{len(completed_chunks)} 个音频块已完成，将跳过这些块的推理。")
+        append_to_journal = functools.partial(append_chunk_journal, journal_key)
+
+    all_segment_timestamps = []
+    merger = ChunkSegmentMerger()
+    last_chunk_end_ms = 0
+    transcription_failed = False
+    try:
+        for start_time_ms, end_time_ms, chunk_segments in iter_chunk_transcriptions(
+            model,
+            chunks,
+            batch_size=batch_size,
+            in_memory=in_memory,
+            completed_chunks=completed_chunks,
+            on_chunk_transcribed=append_to_journal,
+            metrics=metrics,
+            cancel_event=cancel_event,
+        ):
+            last_chunk_end_ms = end_time_ms
+            transcription_failed = transcription_failed or chunk_segments is None
+            with measure_stage(metrics, "merge"):
+                settled_segments = merger.add_chunk(
+                    start_time_ms / 1000.0, end_time_ms / 1000.0, chunk_segments
+                )
+            all_segment_timestamps.extend(settled_segments)
+            if on_segments_ready is not None:
+                on_segments_ready(settled_segments)
+    except RuntimeError as e:
+        print(f"流式转录 '{input_media_path}' 时发生错误: {e}")
+        return []
+    except JobCancelledError as e:
+        pcm_chunks.close()  # 关闭生成器即结束 ffmpeg 进程
+        e.checkpoint_key = journal_key
+        raise
+    with measure_stage(metrics, "merge"):
+        settled_segments = merger.flush()
+    all_segment_timestamps.extend(settled_segments)
+    if on_segments_ready is not None:
+        on_segments_ready(settled_segments)
+    if metrics is not None:
+        # 以实际解码出的时长为准 (探测得到的时长可能缺失或包含视频轨长度)
+        metrics.audio_duration_s = last_chunk_end_ms / 1000.0
+    print(f"流式转录完成，最后一个音频块结束于 {last_chunk_end_ms / 1000:.2f} 秒")
+
+    if journal_key and not transcription_failed:
+        remove_chunk_journal(journal_key)
+    if pcm_hasher is not None and not transcription_failed:
+        cache_key = make_transcription_cache_key(
+            pcm_hasher.hexdigest(),
+            model_identity,
+            get_chunk_settings(
+                chunk_length_ms, vad_enabled, vad_threshold_db, chunk_overlap_ms
+            ),
+        )
+        store_cached_segments(
+            cache_key, all_segment_timestamps, os.path.basename(input_media_path)
+        )
+    return all_segment_timestamps
+
+
+def format_srt_block(subtitle_number: int, stamp: dict) -> str:
+    """把一个 {'start', 'end', 'segment'} 分段格式化为编号为 subtitle_number 的 SRT 字幕块。"""
+    start_time_srt = format_srt_time(stamp["start"])
+    end_time_srt = format_srt_time(stamp["end"])
+    return f"{subtitle_number}\n{start_time_srt} --> {end_time_srt}\n{stamp['segment']}\n\n"
+
+
+def generate_srt_content(segment_timestamps: list) -> str:
+    """
+    根据时间戳列表生成 SRT 格式的字幕内容。
+    ARGS:
+        segment_timestamps: 包含 {'start': float, 'end': float, 'segment': str} 的列表。
+    RETURNS:
+        SRT 格式的字符串。
+    """
+    # 先收集各字幕块再一次性拼接，避免反复 += 造成的二次方复制
+    return "".join(
+        format_srt_block(i + 1, stamp) for i, stamp in enumerate(segment_timestamps)
+    )
+
+
+class IncrementalSrtWriter:
+    """
+    边转录边写 SRT：每批分段到达时立即格式化并追加写入，编号跨音频块连续，不再在结束时拼接完整字符串。
+    写入过程中内容先写到 "<输出路径>.part"，成功结束时才替换为正式文件，失败时删除，
+    因此中途出错不会覆盖已有的完整字幕。
+    另外保留最近 preview_block_limit 个字幕块，供界面显示逐步更新的预览。
+    """
+
+    def __init__(self, output_srt_path: str, preview_block_limit: int = 200, metrics=None):
+        self.output_srt_path = output_srt_path
+        self.partial_srt_path = output_srt_path + ".part"
+        self.metrics = metrics
+        self.subtitle_count = 0
+        self.preview_blocks = collections.deque(maxlen=preview_block_limit)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(output_srt_path)), exist_ok=True)
+        self.srt_file = open(self.partial_srt_path, "w", encoding="utf-8")
+
+    def add_segments(self, segments: list):
+        """追加一批已确定的分段 (由转录线程调用)。"""
+        if not segments:
+            return
+        with measure_stage(self.metrics, "srt_write"), self.lock:
+            srt_blocks = []
+            for stamp in segments:
+                self.subtitle_count += 1
+                srt_blocks.append(format_srt_block(self.subtitle_count, stamp))
+            self.srt_file.write("".join(srt_blocks))
+            self.srt_file.flush()
+            self.preview_blocks.extend(srt_blocks)
+
+    def preview_text(self) -> str:
+        """返回最近写入的若干字幕块，用于界面预览。"""
+        with self.lock:
+            return "".join(self.preview_blocks)
+
+    def close(self, success: bool) -> bool:
+        """结束写入。success 为 True 且至少写入了一条字幕时替换为正式文件并返回 True，否则删除临时文件。"""
+        with self.lock:
+            if not self.srt_file.closed:
+                self.srt_file.close()
+            if success and self.subtitle_count > 0:
+                os.replace(self.partial_srt_path, self.output_srt_path)
+                return True
+        if os.path.exists(self.partial_srt_path):
+            try:
+                os.remove(self.partial_srt_path)
+            except OSError as e_clean:
+                print(f"清理未完成的字幕文件 {self.partial_srt_path} 时出错: {e_clean}")
+        return False
+
+
+# --- 时间范围局部转录 ---
+def parse_time_value(time_text: str) -> int:
+    """把 "SS(.mmm)"、"MM:SS(.mmm)" 或 "HH:MM:SS(,mmm)" 解析为毫秒。"""
+    time_parts = time_text.strip().replace(",", ".").split(":")
+    if not 1 <= len(time_parts) <= 3 or not all(time_parts):
+        raise ValueError(f"无法解析时间 '{time_text}'")
+    total_seconds = 0.0
+    for time_part in time_parts:
+        total_seconds = total_seconds * 60 + float(time_part)
+    return int(round(total_seconds * 1000))
+
+
+def parse_time_ranges(time_ranges_text: str) -> list:
+    """
+    解析时间范围列表，例如 "10:00-12:30, 1:05:00-1:06:10" 或 "600-750"，范围之间以逗号、分号或换行分隔。
+    RETURNS:
+        按开始时间排序并合并了重叠部分的 [(start_ms, end_ms), ...]。
+    RAISES:
+        ValueError: 格式无效或结束时间不大于开始时间。
+    """
+    time_ranges = []
+    for range_text in time_ranges_text.replace(";", ",").replace("\n", ",").split(","):
+        if not range_text.strip():
+            continue
+        range_bounds = range_text.split("-")
+        if len(range_bounds) != 2:
+            raise ValueError(f"无法解析时间范围 '{range_text.strip()}'，格式应为 开始-结束")
+        start_ms, end_ms = parse_time_value(range_bounds[0]), parse_time_value(range_bounds[1])
+        if end_ms <= start_ms:
+            raise ValueError(f"时间范围 '{range_text.strip()}' 的结束时间必须大于开始时间")
+        time_ranges.append((start_ms, end_ms))
+    return merge_time_ranges(time_ranges)
+
+
+def merge_time_ranges(time_ranges: list) -> list:
+    merged_ranges = []
+    for start_ms, end_ms in sorted(time_ranges):
+        if merged_ranges and start_ms <= merged_ranges[-1][1]:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], end_ms))
+        else:
+            merged_ranges.append((start_ms, end_ms))
+    return merged_ranges
+
+
+def parse_srt_segments(srt_path: str) -> list:
+    """读取 SRT 文件，返回与 transcribe_audio_in_chunks 输出格式相同的分段列表 (时间单位为秒)。"""
+    with open(srt_path, "r", encoding="utf-8-sig") as srt_file:
+        srt_blocks = srt_file.read().replace("\r\n", "\n").split("\n\n")
+    segments = []
+    for srt_block in srt_blocks:
+        block_lines = srt_block.strip().split("\n")
+        timing_line_index = next(
+            (index for index, line in enumerate(block_lines) if "-->" in line), None
+        )
+        if timing_line_index is None:
+            continue
+        start_text, end_text = block_lines[timing_line_index].split("-->")
+        segments.append(
+            {
+                "start": parse_time_value(start_text) / 1000.0,
+                "end": parse_time_value(end_text) / 1000.0,
+                "segment": "\n".join(block_lines[timing_line_index + 1 :]),
+            }
+        )
+    return segments
+
+
+def expand_ranges_to_segment_boundaries(time_ranges: list, segments: list) -> list:
+    """把时间范围扩展到与其边界相交的已有分段的起止时间，替换时不会留下被截断一半的字幕。"""
+    expanded_ranges = []
+    for start_ms, end_ms in time_ranges:
+        for segment in segments:
+            segment_start_ms = int(round(segment["start"] * 1000))
+            segment_end_ms = int(round(segment["end"] * 1000))
+            if segment_start_ms < end_ms and segment_end_ms > start_ms:
+                start_ms = min(start_ms, segment_start_ms)
+                end_ms = max(end_ms, segment_end_ms)
+        expanded_ranges.append((start_ms, end_ms))
+    return merge_time_ranges(expanded_ranges)
+
+
+def splice_segments(existing_segments: list, new_segments: list, time_ranges: list) -> list:
+    """用新转录的分段替换已有分段中落在 time_ranges 内的部分，返回按开始时间排序的完整分段列表。"""
+
+    def in_replaced_range(segment):
+        segment_start_ms = int(round(segment["start"] * 1000))
+        segment_end_ms = int(round(segment["end"] * 1000))
+        return any(
+            segment_start_ms < end_ms and segment_end_ms > start_ms
+            for start_ms, end_ms in time_ranges
+        )
+
+    kept_segments = [segment for segment in existing_segments if not in_replaced_range(segment)]
+    return sorted(kept_segments + new_segments, key=lambda segment: (segment["start"], segment["end"]))
+
+
+def extract_audio_range(
+    input_media_path: str, start_ms: int, end_ms: int, cancel_event: threading.Event = None
+) -> str:
+    """
+    只提取 [start_ms, end_ms) 的音频为 16kHz 单声道 WAV 临时文件，失败时返回 None。
+    -ss/-t 放在 -i 之前使用输入端定位，ffmpeg 直接跳到范围起点，范围以外的内容不会被解码；
+    输入已是 16kHz 单声道 PCM WAV 时直接从内存映射中切出该范围。
+    cancel_event 被设置时终止 ffmpeg、删除临时文件并抛出 JobCancelledError。
+    """
+    temp_audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+    output_audio_path = temp_audio_file.name
+    temp_audio_file.close()
+    if is_model_ready_audio(probe_media(input_media_path)):
+        samples = open_pcm_wav_memmap(input_media_path)
+        samples_per_ms = TARGET_SAMPLE_RATE // 1000
+        write_chunk_wav(samples[start_ms * samples_per_ms : end_ms * samples_per_ms], output_audio_path)
+        del samples
+        return output_audio_path
+    if not check_ffmpeg():
+        os.remove(output_audio_path)
+        return None
+
+    ffmpeg_command = [
+        "ffmpeg",
+        "-ss",
+        f"{start_ms / 1000:.3f}",
+        "-t",
+        f"{(end_ms - start_ms) / 1000:.3f}",
+        "-i",
+        input_media_path,
+        "-vn",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        "16000",
+        "-ac",
+        "1",
+        "-y",
+        output_audio_path,
+    ]
+    try:
+        run_cancellable_command(ffmpeg_command, cancel_event)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"提取 {start_ms / 1000:.2f}s - {end_ms / 1000:.2f}s 的音频时发生错误: {e}")
+        os.remove(output_audio_path)
+        return None
+    except JobCancelledError:
+        os.remove(output_audio_path)
+        raise
+    if os.path.getsize(output_audio_path) == 0:
+        os.remove(output_audio_path)
+        return None
+    return output_audio_path
+
+
+def transcribe_time_ranges(
+    model,
+    input_media_path: str,
+    time_ranges: list,
+    chunk_length_ms: int,
+    batch_size: int = 1,
+    vad_enabled: bool = False,
+    vad_threshold_db: float = -40.0,
+    chunk_overlap_ms: int = 0,
+    model_identity: str = None,
+    metrics=None,
+    cancel_event: threading.Event = None,
+) -> list:
+    """
+    只转录 time_ranges ([(start_ms, end_ms), ...]) 内的音频，返回带原文件全局时间戳的分段列表。
+    每个范围单独提取并按与整段转录相同的方式分块，耗时与范围总长度成正比，与文件总长度无关。
+    RAISES:
+        RuntimeError: 某个范围的音频提取失败。
+    """
+    range_segments = []
+    for start_ms, end_ms in time_ranges:
+        raise_if_cancelled(cancel_event)
+        print(f"正在转录时间范围 {start_ms / 1000:.2f}s - {end_ms / 1000:.2f}s ...")
+        with measure_stage(metrics, "extract"):
+            range_audio_path = extract_audio_range(input_media_path, start_ms, end_ms, cancel_event)
+        if not range_audio_path:
+            raise RuntimeError(f"提取 {start_ms / 1000:.2f}s - {end_ms / 1000:.2f}s 的音频失败")
+        try:
+            for segment in transcribe_audio_in_chunks(
+                model,
+                range_audio_path,
+                chunk_length_ms,
+                batch_size,
+                vad_enabled=vad_enabled,
+                vad_threshold_db=vad_threshold_db,
+                chunk_overlap_ms=chunk_overlap_ms,
+                model_identity=model_identity,
+                metrics=metrics,
+                cancel_event=cancel_event,
+            ):
+                range_segments.append(
+                    {
+                        "start": segment["start"] + start_ms / 1000.0,
+                        "end": min(segment["end"] + start_ms / 1000.0, end_ms / 1000.0),
+                        "segment": segment["segment"],
+                    }
+                )
+        finally:
+            os.remove(range_audio_path)
+    if metrics is not None:
+        metrics.audio_duration_s = sum(end_ms - start_ms for start_ms, end_ms in time_ranges) / 1000.0
+    return range_segments
+
+
+def retranscribe_time_ranges(
+    model,
+    input_media_path: str,
+    time_ranges: list,
+    output_srt_path: str,
+    chunk_length_ms: int,
+    batch_size: int = 1,
+    vad_enabled: bool = False,
+    vad_threshold_db: float = -40.0,
+    chunk_overlap_ms: int = 0,
+    model_identity: str = None,
+    metrics=None,
+    cancel_event: threading.Event = None,
+) -> list:
+    """
+    重新转录 time_ranges 并把结果拼接进已有字幕，保持原有的全局时间戳，其余部分不重新推理。
+    已有字幕优先读取 output_srt_path，不存在时使用字幕检索库中同一源文件与模型的分段；都没有时只输出这些范围的字幕。
+    范围会先扩展到与其边界相交的已有字幕的起止时间。拼接结果写回 output_srt_path (先写临时文件再替换)。
+    RETURNS:
+        拼接后的完整分段列表。
+    """
+    existing_segments = None
+    if os.path.exists(output_srt_path):
+        existing_segments = parse_srt_segments(output_srt_path)
+        print(f"将拼接进已有字幕 {output_srt_path} ({len(existing_segments)} 条)。")
+    else:
+        store = get_transcript_store()
+        stored_file_id = store.find_file_id(input_media_path, model_identity) if store else None
+        if stored_file_id is not None:
+            existing_segments = store.get_segments(stored_file_id)
+            print(f"将拼接进字幕检索库中文件 ID {stored_file_id} 的分段 ({len(existing_segments)} 条)。")
+    if existing_segments is None:
+        print("未找到已有字幕，只输出指定时间范围的字幕。")
+        existing_segments = []
+
+    time_ranges = expand_ranges_to_segment_boundaries(time_ranges, existing_segments)
+    new_segments = transcribe_time_ranges(
+        model,
+        input_media_path,
+        time_ranges,
+        chunk_length_ms,
+        batch_size,
+        vad_enabled=vad_enabled,
+        vad_threshold_db=vad_threshold_db,
+        chunk_overlap_ms=chunk_overlap_ms,
+        model_identity=model_identity,
+        metrics=metrics,
+        cancel_event=cancel_event,
+    )
+    spliced_segments = splice_segments(existing_segments, new_segments, time_ranges)
+    srt_writer = IncrementalSrtWriter(output_srt_path, metrics=metrics)
+    srt_writer.add_segments(spliced_segments)
+    srt_writer.close(success=True)
+    return spliced_segments
+
+
+# --- 运行指标 ---
+METRICS_HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)  # 秒
+metrics_log_lock = threading.Lock()
+
+
+class PipelineMetrics:
+    """进程内累计的计数器和各阶段耗时直方图，由指标端点以 Prometheus 文本格式或 JSON 输出。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.stage_histograms = {}  # 阶段名 -> {"buckets": [...], "sum": 秒, "count": 次数}
+
+    def increment(self, counter_name: str, value: float = 1):
+        with self.lock:
+            self.counters[counter_name] += value
+
+    def observe_stage(self, stage_name: str, seconds: float):
+        with self.lock:
+            histogram = self.stage_histograms.setdefault(
+                stage_name,
+                {"buckets": [0] * len(METRICS_HISTOGRAM_BUCKETS), "sum": 0.0, "count": 0},
+            )
+            for bucket_index, upper_bound in enumerate(METRICS_HISTOGRAM_BUCKETS):
+                if seconds <= upper_bound:
+                    histogram["buckets"][bucket_index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {
+                    stage_name: {
+                        "buckets": dict(zip(METRICS_HISTOGRAM_BUCKETS, histogram["buckets"])),
+                        "sum": round(histogram["sum"], 6),
+                        "count": histogram["count"],
+                    }
+                    for stage_name, histogram in self.stage_histograms.items()
+                },
+            }
+
+    def render_prometheus(self, job_statuses: dict = None) -> str:
+        lines = []
+        with self.lock:
+            for counter_name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE srt_{counter_name} counter")
+                lines.append(f"srt_{counter_name} {value}")
+            lines.append("# TYPE srt_stage_duration_seconds histogram")
+            for stage_name, histogram in sorted(self.stage_histograms.items()):
+                for upper_bound, bucket_count in zip(
+                    METRICS_HISTOGRAM_BUCKETS, histogram["buckets"]
+                ):
+                    lines.append(
+                        f'srt_stage_duration_seconds_bucket{{stage="{stage_name}",le="{upper_bound}"}}'
+                        f" {bucket_count}"
+                    )
+                lines.append(
+                    f'srt_stage_duration_seconds_bucket{{stage="{stage_name}",le="+Inf"}}'
+                    f" {histogram['count']}"
+                )
+                lines.append(
+                    f'srt_stage_duration_seconds_sum{{stage="{stage_name}"}} {histogram["sum"]}'
+                )
+                lines.append(
+                    f'srt_stage_duration_seconds_count{{stage="{stage_name}"}} {histogram["count"]}'
+                )
+        if job_statuses is not None:
+            lines.append("# TYPE srt_jobs gauge")
+            for job_status, job_count in sorted(job_statuses.items()):
+                lines.append(f'srt_jobs{{status="{job_status}"}} {job_count}')
+        return "\n".join(lines) + "\n"
+
+
+pipeline_metrics = PipelineMetrics()
+
+
+def append_metrics_record(record: dict):
+    """把一条计时记录追加到 JSON-lines 指标日志 (metrics_log_enabled 为 False 时不写入)。"""
+    if not metrics_log_enabled:
+        return
+    record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **record}
+    try:
+        with metrics_log_lock:
+            os.makedirs(os.path.dirname(metrics_log_path), exist_ok=True)
+            with open(metrics_log_path, "a", encoding="utf-8") as metrics_log_file:
+                metrics_log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"写入指标日志 {metrics_log_path} 时出错: {e}")
+
+
+class FileMetrics:
+    """
+    单个文件的处理计时：各阶段累计耗时、逐块耗时，以及据此得出的实时率 (RTF) 与剩余时间估计。
+    转录在后台线程进行时，界面线程会并发读取进度，因此进度字段的读写都加锁。
+    on_progress: 可选，已知音频总时长时每推进一个音频块以已完成比例 (0-1) 调用一次。
+    """
+
+    def __init__(self, file_name: str, job_id: int = None, on_progress=None):
+        self.file_name = file_name
+        self.job_id = job_id
+        self.on_progress = on_progress
+        self.start_time = time.time()
+        self.audio_duration_s = None
+        self.cache_hit = False
+        self.stage_seconds = collections.defaultdict(float)
+        self.chunk_records = []
+        self.transcribed_until_s = 0.0
+        self.lock = threading.Lock()
+
+    def add_stage_time(self, stage_name: str, seconds: float):
+        with self.lock:
+            self.stage_seconds[stage_name] += seconds
+        pipeline_metrics.observe_stage(stage_name, seconds)
+
+    def record_chunk(self, start_ms: int, end_ms: int, seconds: float, succeeded: bool):
+        """记录一个新转录的音频块；seconds 为所在批次 (分块准备 + 推理) 耗时按块数均摊后的值。"""
+        with self.lock:
+            self.chunk_records.append(
+                {
+                    "start_s": start_ms / 1000.0,
+                    "end_s": end_ms / 1000.0,
+                    "seconds": round(seconds, 4),
+                    "ok": succeeded,
+                }
+            )
+        pipeline_metrics.increment("chunks_transcribed_total")
+        pipeline_metrics.increment("audio_seconds_transcribed_total", (end_ms - start_ms) / 1000.0)
+        if not succeeded:
+            pipeline_metrics.increment("chunks_failed_total")
+
+    def merge_shard(self, chunk_records: list, stage_seconds: dict):
+        """合并分片工作进程返回的逐块耗时和各阶段耗时 (各进程的阶段耗时累加，可能超过墙钟时间)。"""
+        for stage_name, seconds in stage_seconds.items():
+            self.add_stage_time(stage_name, seconds)
+        for chunk_record in chunk_records:
+            self.record_chunk(
+                int(round(chunk_record["start_s"] * 1000)),
+                int(round(chunk_record["end_s"] * 1000)),
+                chunk_record["seconds"],
+                chunk_record["ok"],
+            )
+
+    def mark_progress(self, end_ms: int):
+        with self.lock:
+            self.transcribed_until_s = max(self.transcribed_until_s, end_ms / 1000.0)
+            transcribed_s = self.transcribed_until_s
+            audio_duration_s = self.audio_duration_s
+        if self.on_progress is not None and audio_duration_s:
+            self.on_progress(min(transcribed_s / audio_duration_s, 1.0))
+
+    def elapsed_seconds(self) -> float:
+        return time.time() - self.start_time
+
+    def progress_text(self) -> str:
+        """状态栏使用的进度描述，例如 "已转录 120/600 秒，RTF 0.150，预计剩余 72 秒"。"""
+        with self.lock:
+            transcribed_s = self.transcribed_until_s
+            audio_duration_s = self.audio_duration_s
+        elapsed_s = self.elapsed_seconds()
+        if transcribed_s <= 0:
+            return f"已用时 {elapsed_s:.0f} 秒"
+        realtime_factor = elapsed_s / transcribed_s
+        if not audio_duration_s:
+            return f"已转录 {transcribed_s:.0f} 秒，RTF {realtime_factor:.3f}"
+        remaining_s = max(0.0, audio_duration_s - transcribed_s) * realtime_factor
+        return (
+            f"已转录 {transcribed_s:.0f}/{audio_duration_s:.0f} 秒，"
+            f"RTF {realtime_factor:.3f}，预计剩余 {remaining_s:.0f} 秒"
+        )
+
+    def finish(self, status: str, error: str = None) -> dict:
+        """结束计时，更新累计计数器并写入指标日志，返回该文件的计时记录。"""
+        processing_time_s = self.elapsed_seconds()
+        with self.lock:
+            record = {
+                "type": "file",
+                "job_id": self.job_id,
+                "file": self.file_name,
+                "status": status,
+                "error": error,
+                "cache_hit": self.cache_hit,
+                "audio_duration_s": round(self.audio_duration_s, 3)
+                if self.audio_duration_s
+                else None,
+                "processing_time_s": round(processing_time_s, 3),
+                "rtf": round(processing_time_s / self.audio_duration_s, 4)
+                if self.audio_duration_s
+                else None,
+                "stages": {
+                    stage_name: round(seconds, 4)
+                    for stage_name, seconds in self.stage_seconds.items()
+                },
+                "chunks": list(self.chunk_records),
+            }
+        pipeline_metrics.increment("files_ok_total" if status == "ok" else "files_failed_total")
+        pipeline_metrics.increment("processing_seconds_total", processing_time_s)
+        if self.audio_duration_s:
+            pipeline_metrics.increment("audio_seconds_total", self.audio_duration_s)
+        append_metrics_record(record)
+        return record
+
+
+def measure_stage(metrics, stage_name: str):
+    """返回计时上下文：metrics 为 None 时不计时。"""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics_stage_timer(metrics, stage_name)
+
+
+@contextlib.contextmanager
+def metrics_stage_timer(metrics, stage_name: str):
+    stage_start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_stage_time(stage_name, time.perf_counter() - stage_start_time)
+
+
+def start_metrics_server(port: int):
+    """
+    在本机 127.0.0.1:port 上启动指标端点 (后台线程)。
+    /metrics 返回 Prometheus 文本格式，/metrics.json 返回 JSON。
+    同时提供字幕检索接口：/search?q=<检索词>&limit=<数量> 返回匹配的分段 (时间单位为毫秒)，/transcripts 列出已索引的文件。
+    POST /jobs/<任务 ID>/cancel 取消排队中或运行中的任务 (例如无界面运行的监视文件夹任务)。
+    """
+    import http.server
+    import urllib.parse
+
+    class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            job_statuses = collections.Counter(job["status"] for job in job_scheduler.list_jobs())
+            request_url = urllib.parse.urlsplit(self.path)
+            if request_url.path in ("/search", "/transcripts"):
+                store = get_transcript_store()
+                if store is None:
+                    self.send_error(404, "transcript store disabled")
+                    return
+                query_params = urllib.parse.parse_qs(request_url.query)
+                try:
+                    result_limit = int(query_params.get("limit", ["50"])[0])
+                    if request_url.path == "/search":
+                        results = store.search(query_params.get("q", [""])[0], result_limit)
+                    else:
+                        results = store.list_files(result_limit)
+                except (ValueError, sqlite3.Error) as e:
+                    self.send_error(400, str(e))
+                    return
+                body = json.dumps(results, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json"
+            elif request_url.path == "/metrics":
+                body = pipeline_metrics.render_prometheus(job_statuses).encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif request_url.path == "/metrics.json":
+                body = json.dumps(
+                    {**pipeline_metrics.snapshot(), "jobs": dict(job_statuses)},
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            path_parts = urllib.parse.urlsplit(self.path).path.strip("/").split("/")
+            if len(path_parts) != 3 or path_parts[0] != "jobs" or path_parts[2] != "cancel":
+                self.send_error(404)
+                return
+            try:
+                job_id = int(path_parts[1])
+            except ValueError:
+                self.send_error(400, "invalid job id")
+                return
+            if not job_scheduler.cancel(job_id):
+                self.send_error(404, "job not found or already finished")
+                return
+            body = json.dumps(job_scheduler.get_job_status(job_id), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 不在终端打印每次抓取
+
+    try:
+        metrics_server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    except OSError as e:
+        print(f"无法在端口 {port} 上启动指标端点: {e}")
+        return None
+    threading.Thread(
+        target=metrics_server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    print(f"指标端点已启动: http://127.0.0.1:{port}/metrics")
+    return metrics_server
+
+
+# --- 字幕检索库 ---
+class TranscriptStore:
+    """
+    把每个文件的转录分段 (源文件、模型、起止时间、文本) 写入本地 SQLite，并用 FTS5 全文索引支持跨文件检索；
+    不重新推理即可从库中重新生成任意已索引文件的 SRT。SQLite 未编译 FTS5 时退回 LIKE 查询。
+    同一源文件用同一模型重新转录时覆盖旧记录。
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA foreign_keys=ON")
+            self.connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    source_path TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    srt_path TEXT,
+                    audio_duration_s REAL,
+                    indexed_at REAL NOT NULL,
+                    UNIQUE (source_path, model)
+                );
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY,
+                    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+                    start_ms INTEGER NOT NULL,
+                    end_ms INTEGER NOT NULL,
+                    text TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS segments_file_id ON segments (file_id, start_ms);
+                """
+            )
+        try:
+            with self.connection:
+                # 外部内容表：全文索引只存倒排索引，文本仍保存在 segments 中，由触发器保持同步
+                self.connection.executescript(
+                    """
+                    CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+                        text, content='segments', content_rowid='id'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS segments_after_insert AFTER INSERT ON segments BEGIN
+                        INSERT INTO segments_fts (rowid, text) VALUES (new.id, new.text);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS segments_after_delete AFTER DELETE ON segments BEGIN
+                        INSERT INTO segments_fts (segments_fts, rowid, text)
+                        VALUES ('delete', old.id, old.text);
+                    END;
+                    """
+                )
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"警告：当前 SQLite 不支持 FTS5 ({e})，字幕检索将使用较慢的 LIKE 查询。")
+            self.fts_enabled = False
+
+    def add_transcript(
+        self,
+        source_path: str,
+        model_identity: str,
+        segments: list,
+        srt_path: str = None,
+        audio_duration_s: float = None,
+    ) -> int:
+        """写入一个文件的分段列表 (transcribe_audio_in_chunks 的输出)，返回文件 ID。"""
+        with self.lock, self.connection:
+            # 删除旧记录时级联删除其分段，触发器同步更新全文索引
+            self.connection.execute(
+                "DELETE FROM files WHERE source_path = ? AND model = ?",
+                (source_path, model_identity or ""),
+            )
+            file_id = self.connection.execute(
+                "INSERT INTO files (source_path, file_name, model, srt_path, audio_duration_s, indexed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    source_path,
+                    os.path.basename(source_path),
+                    model_identity or "",
+                    srt_path,
+                    audio_duration_s,
+                    time.time(),
+                ),
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO segments (file_id, start_ms, end_ms, text) VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        file_id,
+                        int(round(segment["start"] * 1000)),
+                        int(round(segment["end"] * 1000)),
+                        segment["segment"],
+                    )
+                    for segment in segments
+                ),
+            )
+        return file_id
+
+    def search(self, query: str, limit: int = 50, raw_query: bool = False) -> list:
+        """
+        检索包含查询词的分段，按相关度排序。
+        ARGS:
+            query: 检索词。默认每个空格分隔的词作为短语并要求全部出现；raw_query=True 时按 FTS5 查询语法原样使用。
+            limit: 最多返回的分段数。
+        RETURNS:
+            [{'file_id', 'source_path', 'file_name', 'model', 'start_ms', 'end_ms', 'text'}, ...]
+        """
+        query = (query or "").strip()
+        if not query:
+            return []
+        columns = (
+            "files.id AS file_id, files.source_path, files.file_name, files.model,"
+            " segments.start_ms, segments.end_ms, segments.text"
+        )
+        with self.lock:
+            if self.fts_enabled:
+                fts_query = (
+                    query
+                    if raw_query
+                    else " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+                )
+                rows = self.connection.execute(
+                    f"SELECT {columns} FROM segments_fts"
+                    " JOIN segments ON segments.id = segments_fts.rowid"
+                    " JOIN files ON files.id = segments.file_id"
+                    " WHERE segments_fts MATCH ? ORDER BY segments_fts.rank LIMIT ?",
+                    (fts_query, int(limit)),
+                ).fetchall()
+            else:
+                like_conditions = " AND ".join("segments.text LIKE ?" for _ in query.split())
+                rows = self.connection.execute(
+                    f"SELECT {columns} FROM segments JOIN files ON files.id = segments.file_id"
+                    f" WHERE {like_conditions} ORDER BY files.id, segments.start_ms LIMIT ?",
+                    (*[f"%{term}%" for term in query.split()], int(limit)),
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_files(self, limit: int = 200) -> list:
+        """按索引时间从新到旧列出已索引的文件。"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT files.id AS file_id, source_path, file_name, model, srt_path, audio_duration_s,"
+                " indexed_at, (SELECT COUNT(*) FROM segments WHERE file_id = files.id) AS segments"
+                " FROM files ORDER BY indexed_at DESC LIMIT ?",
+                (int(limit),),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_file(self, file_id: int):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id AS file_id, source_path, file_name, model, srt_path FROM files WHERE id = ?",
+                (int(file_id),),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def find_file_id(self, source_path: str, model_identity: str):
+        """返回同一源文件与模型的文件 ID，没有记录时返回 None。"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id FROM files WHERE source_path = ? AND model = ?",
+                (source_path, model_identity or ""),
+            ).fetchone()
+        return row["id"] if row is not None else None
+
+    def get_segments(self, file_id: int) -> list:
+        """返回文件的分段列表，格式与 transcribe_audio_in_chunks 的输出相同 (时间单位为秒)。"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT start_ms, end_ms, text FROM segments WHERE file_id = ? ORDER BY start_ms, id",
+                (int(file_id),),
+            ).fetchall()
+        return [
+            {"start": row["start_ms"] / 1000.0, "end": row["end_ms"] / 1000.0, "segment": row["text"]}
+            for row in rows
+        ]
+
+    def regenerate_srt(self, file_id: int, output_srt_path: str = None) -> str:
+        """
+        不重新推理，从库中的分段重新生成 SRT。
+        RETURNS:
+            写入的 SRT 路径；默认写回索引时记录的路径，没有记录时写入 subtitles 文件夹。文件 ID 不存在时返回 None。
+        """
+        file_record = self.get_file(file_id)
+        if file_record is None:
+            return None
+        if not output_srt_path:
+            output_srt_path = file_record["srt_path"] or os.path.join(
+                subtitles_folder_path,
+                os.path.splitext(file_record["file_name"])[0] + ".srt",
+            )
+        os.makedirs(os.path.dirname(os.path.abspath(output_srt_path)), exist_ok=True)
+        with open(output_srt_path, "w", encoding="utf-8") as srt_file:
+            srt_file.write(generate_srt_content(self.get_segments(file_id)))
+        return output_srt_path
+
+
+transcript_store = None  # 由 get_transcript_store 在首次使用时打开
+transcript_store_lock = threading.Lock()
+
+
+def get_transcript_store():
+    """返回字幕检索库；通过 config.json 的 transcript_store_enabled 关闭时返回 None。"""
+    global transcript_store
+    if not transcript_store_enabled:
+        return None
+    with transcript_store_lock:
+        if transcript_store is None:
+            transcript_store = TranscriptStore(transcript_store_path)
+        return transcript_store
+
+
+def index_transcript(
+    source_path: str,
+    model_identity: str,
+    segments: list,
+    srt_path: str = None,
+    audio_duration_s: float = None,
+    metrics=None,
+):
+    """把一个文件的转录结果写入字幕检索库。写入失败只打印警告，不影响字幕生成。"""
+    try:
+        store = get_transcript_store()
+        if store is None or not segments:
+            return
+        with measure_stage(metrics, "index"):
+            store.add_transcript(source_path, model_identity, segments, srt_path, audio_duration_s)
+    except (sqlite3.Error, OSError) as e:
+        print(f"警告：写入字幕检索库失败: {e}")
+
+
+# --- 任务调度 ---
+class TranscriptionJob:
+    """调度器中的一个任务 (一次 "开始生成 SRT" 提交)，记录状态与进度。"""
+
+    def __init__(self, job_id: int, name: str, priority: int = 0, owner: str = None):
+        self.job_id = job_id
+        self.name = name
+        self.priority = priority
+        self.owner = owner  # 提交者标识 (界面会话)，用于 "取消" 按钮只取消本页面提交的任务
+        self.status = "queued"  # queued / running / done / failed / cancelled
+        self.progress = 0.0
+        self.message = ""
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()  # 由 JobScheduler.cancel 设置，处理流程在各检查点响应
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "priority": self.priority,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """
+    全局 asr_model 的任务调度器。
+    任务按优先级 (数值大者优先) 和提交顺序 (FIFO) 排队，同时运行的任务数不超过 max_concurrent_jobs。
+    模型重新加载通过 exclusive_model_access() 进行：等待正在运行的任务全部结束，期间不再启动新任务。
+    """
+
+    def __init__(self, max_concurrent_jobs: int = 1, history_size: int = 200):
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+        self.history_size = history_size
+        self.condition = threading.Condition()
+        self.waiting_heap = []  # (-priority, 提交序号, job)
+        self.running_jobs = set()
+        self.jobs = collections.OrderedDict()  # job_id -> job，保留最近的任务供状态查询
+        self.job_counter = itertools.count(1)
+        self.model_exclusive = False
+
+    def set_max_concurrent_jobs(self, max_concurrent_jobs: int):
+        with self.condition:
+            self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+            self.condition.notify_all()
+
+    def submit(self, name: str, priority: int = 0, owner: str = None) -> TranscriptionJob:
+        with self.condition:
+            job = TranscriptionJob(next(self.job_counter), name, priority, owner)
+            heapq.heappush(self.waiting_heap, (-priority, job.job_id, job))
+            self.jobs[job.job_id] = job
+            while len(self.jobs) > self.history_size:
+                oldest_id, oldest_job = next(iter(self.jobs.items()))
+                if oldest_job.status in ("queued", "running"):
+                    break
+                del self.jobs[oldest_id]
+            self.condition.notify_all()
+            return job
+
+    def can_start(self, job: TranscriptionJob) -> bool:
+        return (
+            not self.model_exclusive
+            and len(self.running_jobs) < self.max_concurrent_jobs
+            and bool(self.waiting_heap)
+            and self.waiting_heap[0][2] is job
+        )
+
+    def wait_for_turn(self, job: TranscriptionJob, timeout: float = None) -> bool:
+        """阻塞直到轮到该任务运行 (返回 True)，或超时 (返回 False，任务仍在队列中)。"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.can_start(job), timeout):
+                return False
+            heapq.heappop(self.waiting_heap)
+            self.running_jobs.add(job)
+            job.status = "running"
+            job.started_at = time.time()
+            self.condition.notify_all()
+            return True
+
+    def queue_position(self, job: TranscriptionJob) -> int:
+        """任务在等待队列中的位置 (1 表示下一个运行)；不在队列中时返回 0。"""
+        with self.condition:
+            ordered = sorted(self.waiting_heap)
+            for position, (_, _, waiting_job) in enumerate(ordered, 1):
+                if waiting_job is job:
+                    return position
+            return 0
+
+    def update_progress(self, job: TranscriptionJob, progress: float, message: str = None):
+        with self.condition:
+            job.progress = min(max(progress, 0.0), 1.0)
+            if message is not None:
+                job.message = message
+
+    def finish(self, job: TranscriptionJob, status: str = "done", message: str = None):
+        """结束任务 (无论是否已开始运行)，释放其占用的并发名额。"""
+        with self.condition:
+            if job in self.running_jobs:
+                self.running_jobs.discard(job)
+            else:
+                self.waiting_heap = [entry for entry in self.waiting_heap if entry[2] is not job]
+                heapq.heapify(self.waiting_heap)
+            job.status = status
+            if status == "done":
+                job.progress = 1.0
+            if message is not None:
+                job.message = message
+            job.finished_at = time.time()
+            self.condition.notify_all()
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        请求取消任务。排队中的任务立即移出队列；运行中的任务在下一个检查点停止，
+        由其处理流程终止 ffmpeg、删除临时文件后调用 finish 释放并发名额。任务不存在或已结束时返回 False。
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status not in ("queued", "running"):
+                return False
+            job.cancel_event.set()
+            if job.status == "queued":
+                self.waiting_heap = [entry for entry in self.waiting_heap if entry[2] is not job]
+                heapq.heapify(self.waiting_heap)
+                job.status = "cancelled"
+                job.finished_at = time.time()
+            job.message = "已请求取消"
+            self.condition.notify_all()
+            return True
+
+    def cancel_owned_jobs(self, owner: str) -> list:
+        """取消 owner 提交的所有排队中或运行中的任务，返回被取消的任务 ID 列表。"""
+        with self.condition:
+            job_ids = [
+                job.job_id
+                for job in self.jobs.values()
+                if job.owner == owner and job.status in ("queued", "running")
+            ]
+        return [job_id for job_id in job_ids if self.cancel(job_id)]
+
+    @contextlib.contextmanager
+    def exclusive_model_access(self):
+        """模型重新加载时使用：等待进行中的任务结束，并在加载期间阻止新任务启动。"""
+        with self.condition:
+            self.condition.wait_for(lambda: not self.model_exclusive)
+            self.model_exclusive = True
+            if self.running_jobs:
+                print(f"等待 {len(self.running_jobs)} 个进行中的任务结束后再加载模型...")
+            self.condition.wait_for(lambda: not self.running_jobs)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.model_exclusive = False
+                self.condition.notify_all()
+
+    def get_job_status(self, job_id: int) -> dict:
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list_jobs(self) -> list:
+        with self.condition:
+            return [job.to_dict() for job in self.jobs.values()]
+
+
+job_scheduler = JobScheduler()
+
+
+def remove_prefetched_audio(future, input_media_path: str):
+    try:
+        audio_path = future.result()
+    except Exception:
+        return
+    remove_extracted_audio(audio_path, input_media_path)
+
+
+class AudioExtractionPrefetcher:
+    """
+    多文件批处理时，在当前文件转录期间由线程池提前提取后续文件的音频 (ffmpeg 解码占用空闲的 CPU 核心)。
+    最多预取 prefetch_depth 个文件；prefetch_depth 为 0 时退化为按需同步提取。
+    cancel_event 被设置时，正在进行的提取 (包括预取) 立即终止 ffmpeg 并删除未完成的 WAV。
+    """
+
+    def __init__(
+        self, media_paths: list, prefetch_depth: int = 1, cancel_event: threading.Event = None
+    ):
+        self.media_paths = list(media_paths)
+        self.prefetch_depth = max(0, int(prefetch_depth))
+        self.cancel_event = cancel_event
+        self.executor = (
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.prefetch_depth, thread_name_prefix="audio-prefetch"
+            )
+            if self.prefetch_depth > 0
+            else None
+        )
+        self.futures = {}
+
+    def _schedule(self, index: int):
+        last_index = min(index + self.prefetch_depth, len(self.media_paths) - 1)
+        for file_index in range(index, last_index + 1):
+            if file_index not in self.futures:
+                self.futures[file_index] = self.executor.submit(
+                    extract_audio_from_video, self.media_paths[file_index], self.cancel_event
+                )
+
+    def is_ready(self, index: int) -> bool:
+        """第 index 个文件的音频是否已经提取完成。"""
+        future = self.futures.get(index)
+        return future is not None and future.done()
+
+    def wait(self, index: int, timeout: float = None) -> bool:
+        """
+        安排第 index 个文件 (及后续文件) 的提取并最多等待 timeout 秒，提取完成时返回 True。
+        同步提取 (prefetch_depth 为 0) 时没有可等待的任务，直接返回 True，由 get 执行提取。
+        """
+        if self.executor is None:
+            return True
+        self._schedule(index)
+        done, _ = concurrent.futures.wait([self.futures[index]], timeout=timeout)
+        return bool(done)
+
+    def get(self, index: int) -> str:
+        """返回第 index 个文件提取出的音频路径 (失败为 None)，并安排后续文件的预取。"""
+        if self.executor is None:
+            return extract_audio_from_video(self.media_paths[index], self.cancel_event)
+        self._schedule(index)
+        return self.futures.pop(index).result()
+
+    def close(self):
+        """取消尚未开始的预取；已开始或已完成但未被使用的预取结果在完成后删除。"""
+        for file_index, future in self.futures.items():
+            if not future.cancel():
+                future.add_done_callback(
+                    functools.partial(
+                        remove_prefetched_audio, input_media_path=self.media_paths[file_index]
+                    )
+                )
+        self.futures.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+# --- Gradio 处理函数 ---
+def process_media_for_srt(
+    media_file_objs: list,
+    chunk_length_s: int,
+    batch_size: int = 1,
+    streaming_mode: bool = False,
+    vad_enabled: bool = False,
+    vad_threshold_db: float = -40.0,
+    chunk_overlap_s: float = 0,
+    prefetch_depth: int = 1,
+    priority: int = 0,
+    model_source: str = None,
+    output_srt_paths: list = None,
+    time_ranges_text: str = None,
+    owner: str = None,
+):
+    """
+    model_source 为空时使用界面当前加载的模型；否则使用指定的模型 ("ngc:<名称>" 或本地 .nemo 路径)，
+    该模型已常驻内存时直接使用，否则在任务开始时加载并按内存预算常驻。
+    output_srt_paths 与 media_file_objs 一一对应，指定各文件的 SRT 输出路径；未提供时写入 subtitles 文件夹。
+    time_ranges_text 非空时 (例如 "10:00-12:30")，只重新转录这些时间范围并拼接进已有字幕。
+    owner 为提交者标识 (界面会话)，job_scheduler.cancel_owned_jobs(owner) 可取消该提交者的任务。
+    """
+    model_source = (model_source or "").strip()
+    time_ranges = None
+    if time_ranges_text and time_ranges_text.strip():
+        try:
+            time_ranges = parse_time_ranges(time_ranges_text)
+        except ValueError as e:
+            yield f"错误：{e}", None, ""
+            return
+    if not model_ready_event.is_set():
+        yield "状态：模型正在加载中，任务将在加载完成后自动开始...", None, ""
+        model_ready_event.wait()
+    if asr_model is None and not model_source:
+        yield "错误：ASR 模型未加载。请先加载模型。", None, ""
+        return
+    if media_file_objs is None:
+        yield "请上传至少一个视频文件。", None, ""
+        return
+
+    job_name = ", ".join(os.path.basename(path) for path in media_file_objs)
+    job = job_scheduler.submit(job_name, priority, owner)
+    job_status = "cancelled"  # 生成器被提前关闭 (例如页面断开) 时保持此状态
+    job_error_message = None
+    try:
+        last_queue_position = None
+        # 第一次只检查能否立即开始，之后每秒检查一次并在排队位置变化时更新状态
+        while not job_scheduler.wait_for_turn(
+            job, timeout=0 if last_queue_position is None else 1.0
+        ):
+            if job.cancel_event.is_set():
+                yield f"状态：任务 #{job.job_id} 已在排队时取消。", None, ""
+                return
+            queue_position = job_scheduler.queue_position(job)
+            if queue_position != last_queue_position:
+                last_queue_position = queue_position
+                yield f"状态：任务 #{job.job_id} 排队中，前面还有 {queue_position - 1} 个任务...", None, ""
+        # 任务运行期间模型不会被重新加载，在此取得本任务使用的模型
+        model, model_identity = asr_model, asr_model_identity
+        if model_source:
+            yield f"状态：任务 #{job.job_id} 正在准备模型 {model_source} ...", None, ""
+            try:
+                model, model_identity, _ = get_or_load_model(model_source)
+            except Exception as e:
+                job_status = "failed"
+                job_error_message = str(e)
+                yield f"错误：加载任务指定的模型 '{model_source}' 失败: {e}", None, ""
+                return
+        if model is None:
+            job_status = "failed"
+            yield "错误：ASR 模型未加载。请先加载模型。", None, ""
+            return
+        yield from generate_srt_files_for_media(
+            model,
+            model_identity,
+            job,
+            media_file_objs,
+            chunk_length_s,
+            batch_size,
+            streaming_mode,
+            vad_enabled,
+            vad_threshold_db,
+            chunk_overlap_s,
+            0 if time_ranges else prefetch_depth,  # 局部转录只提取指定范围，无需预取整个文件
+            output_srt_paths,
+            time_ranges,
+        )
+        job_status = "done"
+    except JobCancelledError:
+        job_status = "cancelled"
+        yield f"状态：任务 #{job.job_id} 已取消，临时文件和未完成的字幕已清理。", None, ""
+    except Exception as e:
+        job_status = "failed"
+        job_error_message = str(e)
+        raise
+    finally:
+        job_scheduler.finish(job, job_status, job_error_message)
+        pipeline_metrics.increment(f"jobs_{job_status}_total")
+        append_metrics_record({"type": "job", **job.to_dict()})
+
+
+def iter_status_while_running(
+    file_metrics, srt_writer, status_prefix: str, cancel_event, function, *args, **kwargs
+):
+    """
+    在后台线程中执行 function(*args, cancel_event=cancel_event, **kwargs)，执行期间每秒产出一次
+    带实时率与剩余时间估计的状态以及 srt_writer 中已写出字幕的预览，结束后返回 function 的返回值 (配合 yield from 使用)。
+    生成器被提前关闭 (页面断开) 时先设置 cancel_event，后台线程在下一个检查点停止，而不是运行到结束；
+    此时 function 抛出的 JobCancelledError 留在后台线程中，不会删除断点日志，重新提交同一文件即可续传。
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="transcribe"
+    ) as executor:
+        future = executor.submit(function, *args, cancel_event=cancel_event, **kwargs)
+        try:
+            while True:
+                try:
+                    return future.result(timeout=1.0)
+                except concurrent.futures.TimeoutError:
+                    yield (
+                        f"{status_prefix} ({file_metrics.progress_text()})",
+                        None,
+                        srt_writer.preview_text() if srt_writer is not None else "",
+                    )
+        except GeneratorExit:
+            cancel_event.set()
+            raise
+
+
+def generate_srt_files_for_media(
+    model,
+    model_identity: str,
+    job: TranscriptionJob,
+    media_file_objs: list,
+    chunk_length_s: int,
+    batch_size: int,
+    streaming_mode: bool,
+    vad_enabled: bool,
+    vad_threshold_db: float,
+    chunk_overlap_s: float,
+    prefetch_depth: int,
+    output_srt_paths: list = None,
+    time_ranges: list = None,
+):
+    """
+    逐个处理上传的文件并产出 (状态, SRT 文件列表, 预览内容)，由 process_media_for_srt 在取得调度名额后调用。
+    提供 time_ranges 时只重新转录这些时间范围并拼接进已有字幕 (见 retranscribe_time_ranges)。
+    """
+    output_srt_paths_for_downloads = []
+    total_files = len(media_file_objs)
+    start_time_total = time.time()
+
+    # 流式模式不生成中间 WAV，无需预取
+    prefetcher = AudioExtractionPrefetcher(
+        media_file_objs, 0 if streaming_mode else prefetch_depth, job.cancel_event
+    )
+    try:
+        for i, media_file_obj in enumerate(media_file_objs):
+            raise_if_cancelled(job.cancel_event)
+            input_media_path = media_file_obj  # Gradio Video 对象具有 .name 属性表示路径
+            file_name = os.path.basename(input_media_path)
+
+            print(f"开始处理视频/音频文件， 当前: {i+1}/{total_files}, 文件名: {file_name}")
+            job_scheduler.update_progress(job, i / total_files, f"正在处理 {file_name}")
+            yield f"状态：正在处理文件, 当前：{i+1}/{total_files}, 文件名：{file_name} ...", None, ""
+
+            extracted_audio_path = None
+            srt_file_name = os.path.basename(input_media_path).rsplit(".", 1)[0] + ".srt"
+            output_srt_path_for_download = (
+                output_srt_paths[i]
+                if output_srt_paths
+                else os.path.join(subtitles_folder_path, srt_file_name)
+            )  # 用于 Gradio File 组件
+            # 任务进度 = (已完成文件数 + 当前文件已转录比例) / 文件总数，随音频块推进而不只在文件之间跳变
+            file_metrics = FileMetrics(
+                file_name,
+                job.job_id,
+                on_progress=lambda fraction, file_index=i: job_scheduler.update_progress(
+                    job, (file_index + fraction) / total_files
+                ),
+            )
+            srt_writer = None
+            file_status, file_error = "failed", None
+
+            try:
+                chunk_length_ms = chunk_length_s * 1000
+                # 分段一确定就写入字幕文件，预览随之更新；局部转录由 retranscribe_time_ranges 拼接后整体写入
+                if not time_ranges:
+                    srt_writer = IncrementalSrtWriter(
+                        output_srt_path_for_download, metrics=file_metrics
+                    )
+                if time_ranges:
+                    yield f"状态：正在重新转录 {file_name} 的 {len(time_ranges)} 个时间范围...", None, ""
+                    segment_timestamps = yield from iter_status_while_running(
+                        file_metrics,
+                        None,
+                        f"状态：正在重新转录 {file_name} 的指定时间范围",
+                        job.cancel_event,
+                        retranscribe_time_ranges,
+                        model,
+                        input_media_path,
+                        time_ranges,
+                        output_srt_path_for_download,
+                        chunk_length_ms,
+                        batch_size,
+                        vad_enabled=vad_enabled,
+                        vad_threshold_db=vad_threshold_db,
+                        chunk_overlap_ms=int(chunk_overlap_s * 1000),
+                        model_identity=model_identity,
+                        metrics=file_metrics,
+                    )
+                elif streaming_mode:
+                    yield f"状态：正在流式解码并转录 {file_name} (分块大小: {chunk_length_s}秒, 批大小: {batch_size})...", None, ""
+                    segment_timestamps = yield from iter_status_while_running(
+                        file_metrics,
+                        srt_writer,
+                        f"状态：正在流式解码并转录 {file_name}",
+                        job.cancel_event,
+                        transcribe_media_streaming,
+                        model,
+                        input_media_path,
+                        chunk_length_ms,
+                        batch_size,
+                        vad_enabled=vad_enabled,
+                        vad_threshold_db=vad_threshold_db,
+                        chunk_overlap_ms=int(chunk_overlap_s * 1000),
+                        model_identity=model_identity,
+                        metrics=file_metrics,
+                        on_segments_ready=srt_writer.add_segments,
+                    )
+                else:
+                    if prefetcher.is_ready(i):
+                        yield f"状态：{file_name} 的音频已预先提取完成...", None, ""
+                    else:
+                        yield f"状态：正在提取 {file_name} 的音频...", None, ""
+                    with measure_stage(file_metrics, "extract"):
+                        # 等待期间继续产出状态，使界面的取消操作能及时生效
+                        while not prefetcher.wait(i, timeout=1.0):
+                            raise_if_cancelled(job.cancel_event)
+                            yield f"状态：正在提取 {file_name} 的音频...", None, ""
+                        extracted_audio_path = prefetcher.get(i)
+                    raise_if_cancelled(job.cancel_event)
+                    if not extracted_audio_path:
+                        file_error = "音频提取失败"
+                        yield "错误：音频提取失败。请检查视频文件或ffmpeg安装。", None, ""
+                        return
+
+                    yield f"状态：正在转录音频 (分块大小: {chunk_length_s}秒, 批大小: {batch_size})...", None, ""
+                    segment_timestamps = yield from iter_status_while_running(
+                        file_metrics,
+                        srt_writer,
+                        f"状态：正在转录 {file_name}",
+                        job.cancel_event,
+                        transcribe_audio_in_chunks,
+                        model,
+                        extracted_audio_path,
+                        chunk_length_ms,
+                        batch_size,
+                        vad_enabled=vad_enabled,
+                        vad_threshold_db=vad_threshold_db,
+                        chunk_overlap_ms=int(chunk_overlap_s * 1000),
+                        model_identity=model_identity,
+                        metrics=file_metrics,
+                        on_segments_ready=srt_writer.add_segments,
+                    )
+
+                if not segment_timestamps or (
+                    srt_writer is not None and not srt_writer.close(success=True)
+                ):
+                    file_error = "未生成有效的时间戳"
+                    yield f"警告：转录文件 {file_name} 未生成有效的时间戳。正在跳过此文件。", None, ""
+                    continue
+
+                index_transcript(
+                    input_media_path,
+                    model_identity,
+                    segment_timestamps,
+                    output_srt_path_for_download,
+                    None if time_ranges else file_metrics.audio_duration_s,
+                    file_metrics,
+                )
+                srt_content = (
+                    srt_writer.preview_text()
+                    if srt_writer is not None
+                    else generate_srt_content(segment_timestamps)
+                )
+                output_srt_paths_for_downloads.append(output_srt_path_for_download)
+                file_status = "ok"
+
+                print(f"SRT 文件位于: {output_srt_path_for_download}")
+
+            except JobCancelledError as e:
+                file_status, file_error = "cancelled", str(e)
+                print(f"任务 #{job.job_id} 已取消，停止处理文件 {file_name}。")
+                # 只有明确取消的任务会走到这里 (页面断开时异常留在后台线程中)，其断点日志不再需要
+                if e.checkpoint_key:
+                    remove_chunk_journal(e.checkpoint_key)
+                raise
+            except Exception as e:
+                file_error = str(e)
+                print(f"处理文件 {file_name} 时发生未知错误: {e}")
+                import traceback
+                traceback.print_exc()
+                yield f"错误：处理文件 {file_name} 时发生未知错误: {e}。正在跳过此文件。", None, ""
+                continue
+            finally:
+                remove_extracted_audio(extracted_audio_path, input_media_path)
+                if srt_writer is not None and file_status != "ok":
+                    srt_writer.close(success=False)
+                file_record = file_metrics.finish(file_status, file_error)
+
+            elapsed_time_total = time.time() - start_time_total
+            rtf_text = f" (本文件 RTF {file_record['rtf']})" if file_record["rtf"] else ""
+            status_message = f"处理完成。总耗时 {elapsed_time_total:.2f} 秒{rtf_text}。生成{len(output_srt_paths_for_downloads)} 个 SRT 文件。"
+            print(status_message)
+            yield status_message, output_srt_paths_for_downloads, srt_content
+            # Gradio 会处理 output_srt_path_for_download（它提供的临时文件）的删除
+    except GeneratorExit:
+        # 页面断开时生成器被关闭：让仍在运行的预取 ffmpeg 立即结束 (断点日志保留)
+        job.cancel_event.set()
+        raise
+    finally:
+        prefetcher.close()
+
+
+# --- 命令行批处理 ---
+MEDIA_FILE_EXTENSIONS = {
+    ".mp4",
+    ".mkv",
+    ".avi",
+    ".mov",
+    ".webm",
+    ".flv",
+    ".wmv",
+    ".m4v",
+    ".ts",
+    ".mp3",
+    ".wav",
+    ".m4a",
+    ".flac",
+    ".aac",
+    ".ogg",
+    ".opus",
+    ".wma",
+}
+
+
+def get_wav_duration_seconds(audio_path: str) -> float:
+    """返回 WAV 文件的时长（秒）；无法读取时返回 None。"""
+    try:
+        samples = open_pcm_wav_memmap(audio_path)
+        if samples is not None:
+            return len(samples) / TARGET_SAMPLE_RATE
+        with wave.open(audio_path, "rb") as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    except (OSError, wave.Error, struct.error) as e:
+        print(f"读取音频时长 '{audio_path}' 失败: {e}")
+        return None
+
+
+def collect_batch_inputs(input_specs: list) -> list:
+    """
+    将命令行输入展开为待处理文件列表。
+    ARGS:
+        input_specs: 每项可以是目录 (递归查找媒体文件，输出保持相对目录结构)、
+            glob 通配符、JSONL 清单 (每行 {"path": ..., "output": 可选的 SRT 相对路径}) 或单个文件。
+    RETURNS:
+        [(媒体文件路径, 输出 SRT 的相对路径), ...]，按输入顺序去重。
+    """
+    entries = []
+    seen_paths = set()
+
+    def add_entry(media_path, srt_relative_path=None):
+        media_path = os.path.abspath(media_path)
+        if media_path in seen_paths:
+            return
+        seen_paths.add(media_path)
+        if not srt_relative_path:
+            srt_relative_path = os.path.basename(media_path).rsplit(".", 1)[0] + ".srt"
+        entries.append((media_path, srt_relative_path))
+
+    for input_spec in input_specs:
+        if os.path.isdir(input_spec):
+            for root, _, file_names in os.walk(input_spec):
+                for file_name in sorted(file_names):
+                    if os.path.splitext(file_name)[1].lower() in MEDIA_FILE_EXTENSIONS:
+                        media_path = os.path.join(root, file_name)
+                        relative_path = os.path.relpath(media_path, input_spec)
+                        add_entry(media_path, relative_path.rsplit(".", 1)[0] + ".srt")
+        elif input_spec.lower().endswith(".jsonl") and os.path.isfile(input_spec):
+            manifest_dir = os.path.dirname(os.path.abspath(input_spec))
+            with open(input_spec, "r", encoding="utf-8") as manifest_file:
+                for line_number, line in enumerate(manifest_file, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        media_path = record["path"]
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        print(f"警告：清单 {input_spec} 第 {line_number} 行无效，已跳过。")
+                        continue
+                    if not os.path.isabs(media_path):
+                        media_path = os.path.join(manifest_dir, media_path)
+                    add_entry(media_path, record.get("output"))
+        elif os.path.isfile(input_spec):
+            add_entry(input_spec)
+        else:
+            matched_paths = sorted(glob.glob(input_spec, recursive=True))
+            if not matched_paths:
+                print(f"警告：输入 '{input_spec}' 未匹配到任何文件。")
+            for media_path in matched_paths:
+                if os.path.isfile(media_path):
+                    add_entry(media_path)
+    return entries
+
+
+def load_model_for_command_line(args, config: dict) -> str:
+    """按命令行的 --model / --ngc 加载模型，未指定时使用 config.json 中记录的选择。"""
+    if args.model:
+        return load_asr_model_globally(local_model_path_to_try=args.model)
+    if args.ngc:
+        return load_asr_model_globally(load_from_ngc_explicitly=True)
+    return load_saved_model_from_config(config)
+
+
+def run_batch_cli(args, config: dict) -> int:
+    """
+    无界面批处理：转录所有输入文件，将 SRT 写入输出目录，最后输出 JSON 汇总
+    (每个文件的处理耗时、音频时长和实时率 RTF = 处理耗时 / 音频时长)。
+    RETURNS:
+        进程退出码：全部成功为 0，有文件失败为 1，模型或输入不可用为 2。
+    """
+    model_status = load_model_for_command_line(args, config)
+    if asr_model is None:
+        print(f"错误：ASR 模型未加载，无法进行批处理。{model_status}")
+        return 2
+
+    media_entries = collect_batch_inputs(args.inputs)
+    if not media_entries:
+        print("错误：没有找到需要处理的媒体文件。")
+        return 2
+
+    chunk_length_s = args.chunk_length or config.get("chunk_length_s", 60)
+    batch_size = args.batch_size or config.get("batch_size", 1)
+    streaming_mode = args.streaming or config.get("streaming_mode", False)
+    vad_enabled = args.vad or config.get("vad_enabled", False)
+    vad_threshold_db = config.get("vad_threshold_db", -40.0)
+    chunk_overlap_s = (
+        args.overlap if args.overlap is not None else config.get("chunk_overlap_s", 0)
+    )
+    prefetch_depth = config.get("prefetch_depth", 1)
+    time_ranges = None
+    if args.ranges:
+        try:
+            time_ranges = parse_time_ranges(args.ranges)
+        except ValueError as e:
+            print(f"错误：{e}")
+            return 2
+        prefetch_depth = 0  # 局部转录只提取指定范围，无需预取整个文件
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    file_results = []
+    batch_start_time = time.time()
+    prefetcher = AudioExtractionPrefetcher(
+        [media_path for media_path, _ in media_entries],
+        0 if streaming_mode else prefetch_depth,
+    )
+    try:
+        for i, (media_path, srt_relative_path) in enumerate(media_entries):
+            print(f"[{i + 1}/{len(media_entries)}] 正在处理: {media_path}")
+            file_start_time = time.time()
+            file_result = {
+                "input": media_path,
+                "srt": None,
+                "status": "failed",
+                "error": None,
+                "audio_duration_s": None,
+                "processing_time_s": None,
+                "rtf": None,
+                "segments": 0,
+            }
+            extracted_audio_path = None
+            file_metrics = FileMetrics(media_path)
+            output_srt_path = os.path.join(output_dir, srt_relative_path)
+            srt_writer = None
+            try:
+                if not time_ranges:
+                    srt_writer = IncrementalSrtWriter(output_srt_path, metrics=file_metrics)
+                if time_ranges:
+                    # 拼接进输出目录中已有的字幕，没有时使用字幕检索库中的记录
+                    segment_timestamps = retranscribe_time_ranges(
+                        asr_model,
+                        media_path,
+                        time_ranges,
+                        output_srt_path,
+                        chunk_length_s * 1000,
+                        batch_size,
+                        vad_enabled=vad_enabled,
+                        vad_threshold_db=vad_threshold_db,
+                        chunk_overlap_ms=int(chunk_overlap_s * 1000),
+                        model_identity=asr_model_identity,
+                        metrics=file_metrics,
+                    )
+                    file_result["audio_duration_s"] = file_metrics.audio_duration_s
+                elif streaming_mode:
+                    segment_timestamps = transcribe_media_streaming(
+                        asr_model,
+                        media_path,
+                        chunk_length_s * 1000,
+                        batch_size,
+                        vad_enabled=vad_enabled,
+                        vad_threshold_db=vad_threshold_db,
+                        chunk_overlap_ms=int(chunk_overlap_s * 1000),
+                        model_identity=asr_model_identity,
+                        metrics=file_metrics,
+                        on_segments_ready=srt_writer.add_segments,
+                    )
+                    file_result["audio_duration_s"] = file_metrics.audio_duration_s
+                else:
+                    with measure_stage(file_metrics, "extract"):
+                        extracted_audio_path = prefetcher.get(i)
+                    if not extracted_audio_path:
+                        file_result["error"] = "音频提取失败"
+                        continue
+                    file_result["audio_duration_s"] = get_wav_duration_seconds(
+                        extracted_audio_path
+                    )
+                    segment_timestamps = transcribe_audio_in_chunks(
+                        asr_model,
+                        extracted_audio_path,
+                        chunk_length_s * 1000,
+                        batch_size,
+                        vad_enabled=vad_enabled,
+                        vad_threshold_db=vad_threshold_db,
+                        chunk_overlap_ms=int(chunk_overlap_s * 1000),
+                        model_identity=asr_model_identity,
+                        metrics=file_metrics,
+                        on_segments_ready=srt_writer.add_segments,
+                    )
+                if not segment_timestamps or (
+                    srt_writer is not None and not srt_writer.close(success=True)
+                ):
+                    file_result["error"] = "未生成有效的时间戳"
+                    continue
+
+                index_transcript(
+                    media_path,
+                    asr_model_identity,
+                    segment_timestamps,
+                    output_srt_path,
+                    None if time_ranges else file_result["audio_duration_s"],
+                    file_metrics,
+                )
+                file_result.update(
+                    {
+                        "srt": output_srt_path,
+                        "status": "ok",
+                        "segments": len(segment_timestamps),
+                    }
+                )
+                print(f"SRT 文件位于: {output_srt_path}")
+            except Exception as e:
+                print(f"处理文件 {media_path} 时发生未知错误: {e}")
+                import traceback
+
+                traceback.print_exc()
+                file_result["error"] = str(e)
+            finally:
+                remove_extracted_audio(extracted_audio_path, media_path)
+                if srt_writer is not None and file_result["status"] != "ok":
+                    srt_writer.close(success=False)
+                processing_time_s = time.time() - file_start_time
+                file_result["stages"] = file_metrics.finish(
+                    file_result["status"], file_result["error"]
+                )["stages"]
+                file_result["processing_time_s"] = round(processing_time_s, 3)
+                if file_result["audio_duration_s"]:
+                    file_result["audio_duration_s"] = round(file_result["audio_duration_s"], 3)
+                    file_result["rtf"] = round(
+                        processing_time_s / file_result["audio_duration_s"], 4
+                    )
+                file_results.append(file_result)
+    finally:
+        prefetcher.close()
+
+    total_audio_s = sum(r["audio_duration_s"] or 0 for r in file_results)
+    total_processing_s = time.time() - batch_start_time
+    summary = {
+        "model": asr_model_identity,
+        "files_total": len(file_results),
+        "files_ok": sum(1 for r in file_results if r["status"] == "ok"),
+        "files_failed": sum(1 for r in file_results if r["status"] != "ok"),
+        "total_processing_time_s": round(total_processing_s, 3),
+        "total_audio_duration_s": round(total_audio_s, 3),
+        "rtf": round(total_processing_s / total_audio_s, 4) if total_audio_s else None,
+        "settings": {
+            "time_ranges_ms": time_ranges,
+            "chunk_length_s": chunk_length_s,
+            "batch_size": batch_size,
+            "streaming_mode": streaming_mode,
+            "vad_enabled": vad_enabled,
+            "chunk_overlap_s": chunk_overlap_s,
+        },
+        "files": file_results,
+    }
+    summary_path = args.summary or os.path.join(output_dir, "summary.json")
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, ensure_ascii=False, indent=2)
+    print(f"批处理汇总已写入: {summary_path}")
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if summary["files_failed"] == 0 else 1
+
+
+# --- 监视文件夹 ---
+def compute_file_sha256(file_path: str, block_size: int = 4 * 1024 * 1024) -> str:
+    """按块读取计算文件内容的 SHA-256，大文件也只占用常量内存。"""
+    file_hasher = hashlib.sha256()
+    with open(file_path, "rb") as media_file:
+        for block in iter(lambda: media_file.read(block_size), b""):
+            file_hasher.update(block)
+    return file_hasher.hexdigest()
+
+
+class WatchFolderDaemon:
+    """
+    监视一个或多个输入文件夹，把新出现且写入完成的媒体文件送入与界面相同的转录流程
+    (process_media_for_srt，经 job_scheduler 调度)，SRT 按源文件的相对路径写入 subtitles/<文件夹名>/。
+    - 每次轮询只重新列出修改时间发生变化的目录 (新建、删除、改名文件会更新所在目录的修改时间)，
+      开销与目录数量而不是文件数量成正比；另每隔 full_rescan_interval_s 完整扫描一次，兜底修改时间不可靠的网络共享。
+    - 文件大小和修改时间在 stable_s 秒内保持不变才视为写入完成。
+    - 按内容 SHA-256 去重：与已处理文件内容相同时直接复制已有字幕，不再转录。
+    - 工作队列有上限，队列已满时已稳定的文件留在待处理列表中，下次轮询再放入。
+    处理记录追加到 watch_ledger.jsonl，重启后已处理且未变化的文件不会重复处理，失败的文件会重试。
+    """
+
+    def __init__(
+        self,
+        watch_folders: list,
+        config: dict,
+        poll_interval_s: float = 5,
+        stable_s: float = 10,
+        queue_size: int = 8,
+        job_priority: int = -1,
+        full_rescan_interval_s: float = 3600,
+    ):
+        self.watch_roots = [os.path.abspath(folder) for folder in watch_folders]
+        self.config = config
+        self.poll_interval_s = max(0.1, float(poll_interval_s))
+        self.stable_s = max(0.0, float(stable_s))
+        self.job_priority = int(job_priority)
+        self.full_rescan_interval_s = full_rescan_interval_s
+        self.work_queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        # 以下三项只由扫描线程访问
+        self.directory_mtimes = {}  # 目录 -> 上次列出时的修改时间
+        self.directory_subdirs = {}  # 目录 -> 上次列出时的子目录集合
+        self.pending_files = collections.OrderedDict()  # 文件路径 -> [大小, 修改时间, 开始保持不变的时间]
+        self.known_files = {}  # 文件路径 -> (大小, 修改时间)：已处理或已排队，未变化时不再处理
+        # 以下两项由处理线程在 self.lock 下访问
+        self.processed_hashes = {}  # 内容哈希 -> 已生成的 SRT 路径
+        self.active_hashes = {}  # 正在处理的内容哈希 -> 处理结束时触发的 Event
+        self.last_full_scan_time = time.time()  # 首次轮询时各监视文件夹尚未登记，本来就会完整列出
+        self.threads = []
+        self.load_ledger()
+
+    def load_ledger(self):
+        if not os.path.exists(watch_ledger_path):
+            return
+        with open(watch_ledger_path, "r", encoding="utf-8") as ledger_file:
+            for line in ledger_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 崩溃时写了一半的最后一行
+                if record.get("status") not in ("ok", "duplicate"):
+                    continue
+                self.known_files[record["path"]] = (record["size"], record["mtime_ns"])
+                if record.get("sha256"):
+                    self.processed_hashes[record["sha256"]] = record["srt"]
+        print(f"已从 {watch_ledger_path} 读取 {len(self.known_files)} 个已处理文件的记录。")
+
+    def append_ledger(self, record: dict):
+        with self.lock:
+            try:
+                with open(watch_ledger_path, "a", encoding="utf-8") as ledger_file:
+                    ledger_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"写入监视文件夹处理记录 '{watch_ledger_path}' 失败: {e}")
+
+    def get_output_srt_path(self, media_path: str) -> str:
+        """subtitles/<监视文件夹名>/<源文件相对路径>.srt"""
+        for root in self.watch_roots:
+            if os.path.commonpath([root, media_path]) == root:
+                relative_path = os.path.relpath(media_path, root)
+                return os.path.join(
+                    subtitles_folder_path,
+                    os.path.basename(root),
+                    os.path.splitext(relative_path)[0] + ".srt",
+                )
+        return os.path.join(
+            subtitles_folder_path, os.path.splitext(os.path.basename(media_path))[0] + ".srt"
+        )
+
+    # --- 扫描 (扫描线程) ---
+    def poll(self):
+        """检查各目录的修改时间，只重新列出有变化的目录，然后把已稳定的文件放入工作队列。"""
+        full_rescan = time.time() - self.last_full_scan_time >= self.full_rescan_interval_s
+        if full_rescan:
+            self.last_full_scan_time = time.time()
+        for root in self.watch_roots:
+            if root not in self.directory_mtimes:
+                self.scan_directory(root)
+        for directory in list(self.directory_mtimes):
+            if directory not in self.directory_mtimes:
+                continue  # 已随父目录一起被移除
+            try:
+                directory_mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self.forget_directory(directory)
+                continue
+            if full_rescan or directory_mtime != self.directory_mtimes[directory]:
+                self.scan_directory(directory)
+        self.dispatch_stable_files()
+
+    def scan_directory(self, directory: str):
+        """列出一个目录：登记子目录 (新出现的子目录递归列出)，新出现或有变化的媒体文件加入待处理列表。"""
+        try:
+            directory_mtime = os.stat(directory).st_mtime_ns
+            directory_entries = list(os.scandir(directory))
+        except OSError:
+            self.forget_directory(directory)
+            return
+        self.directory_mtimes[directory] = directory_mtime
+        subdirectories = set()
+        for entry in directory_entries:
+            if entry.name.startswith((".", "~")):
+                continue  # 隐藏文件和编辑器/下载工具的临时文件
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.add(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in MEDIA_FILE_EXTENSIONS:
+                    entry_stat = entry.stat()
+                    self.consider_file(entry.path, entry_stat.st_size, entry_stat.st_mtime_ns)
+            except OSError:
+                continue
+        for removed_directory in self.directory_subdirs.get(directory, set()) - subdirectories:
+            self.forget_directory(removed_directory)
+        self.directory_subdirs[directory] = subdirectories
+        for subdirectory in subdirectories:
+            if subdirectory not in self.directory_mtimes:
+                self.scan_directory(subdirectory)
+
+    def forget_directory(self, directory: str):
+        self.directory_mtimes.pop(directory, None)
+        for subdirectory in self.directory_subdirs.pop(directory, set()):
+            self.forget_directory(subdirectory)
+
+    def consider_file(self, media_path: str, size: int, mtime_ns: int):
+        if self.known_files.get(media_path) == (size, mtime_ns):
+            return
+        pending_state = self.pending_files.get(media_path)
+        if pending_state is None or (pending_state[0], pending_state[1]) != (size, mtime_ns):
+            self.pending_files[media_path] = [size, mtime_ns, time.time()]
+
+    def dispatch_stable_files(self):
+        """按发现顺序把大小已稳定的文件放入工作队列；队列满时停止，剩余文件留到下次轮询。"""
+        if self.work_queue.full():
+            return
+        now = time.time()
+        for media_path in list(self.pending_files):
+            size, mtime_ns, unchanged_since = self.pending_files[media_path]
+            try:
+                media_stat = os.stat(media_path)
+            except OSError:
+                del self.pending_files[media_path]  # 文件已被删除或移走
+                continue
+            file_state = (media_stat.st_size, media_stat.st_mtime_ns)
+            if file_state != (size, mtime_ns) or media_stat.st_size == 0:
+                self.pending_files[media_path] = [*file_state, now]
+                continue
+            if now - unchanged_since < self.stable_s:
+                continue
+            try:
+                self.work_queue.put_nowait((media_path, file_state))
+            except queue.Full:
+                break
+            del self.pending_files[media_path]
+            self.known_files[media_path] = file_state
+
+    def watch_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"扫描监视文件夹时出错: {e}")
+            self.stop_event.wait(self.poll_interval_s)
+
+    # --- 处理 (处理线程) ---
+    def process_queued_files(self):
+        while not self.stop_event.is_set():
+            try:
+                media_path, file_state = self.work_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self.process_file(media_path, file_state)
+            except Exception as e:
+                print(f"监视文件夹处理文件 {media_path} 时发生错误: {e}")
+            finally:
+                self.work_queue.task_done()
+
+    def process_file(self, media_path: str, file_state: tuple):
+        output_srt_path = self.get_output_srt_path(media_path)
+        ledger_record = {
+            "path": media_path,
+            "size": file_state[0],
+            "mtime_ns": file_state[1],
+            "sha256": None,
+            "srt": output_srt_path,
+            "status": "failed",
+            "error": None,
+        }
+        try:
+            ledger_record["sha256"] = content_hash = compute_file_sha256(media_path)
+        except OSError as e:
+            ledger_record["error"] = str(e)
+            self.append_ledger({**ledger_record, "finished_at": time.time()})
+            return
+
+        # 相同内容的文件正在由另一个处理线程转录时，等它结束后直接使用其结果
+        while True:
+            with self.lock:
+                existing_srt_path = self.processed_hashes.get(content_hash)
+                if existing_srt_path is not None and not os.path.exists(existing_srt_path):
+                    existing_srt_path = None  # 之前生成的字幕已被删除，重新转录
+                active_event = self.active_hashes.get(content_hash)
+                if existing_srt_path is None and active_event is None:
+                    active_event = self.active_hashes[content_hash] = threading.Event()
+                    break
+            if existing_srt_path is not None:
+                if os.path.abspath(existing_srt_path) != os.path.abspath(output_srt_path):
+                    os.makedirs(os.path.dirname(output_srt_path), exist_ok=True)
+                    shutil.copyfile(existing_srt_path, output_srt_path)
+                print(f"'{media_path}' 与已处理的文件内容相同，直接使用已有字幕: {existing_srt_path}")
+                ledger_record["status"] = "duplicate"
+                self.append_ledger({**ledger_record, "finished_at": time.time()})
+                return
+            active_event.wait()
+
+        try:
+            while asr_model is None and not self.stop_event.is_set():
+                model_ready_event.wait()
+                if asr_model is None:
+                    print("监视文件夹：模型未加载，等待加载模型后再处理...")
+                    self.stop_event.wait(self.poll_interval_s * 6)
+            status_message, srt_file_paths = "", None
+            for status_message, srt_file_paths, _ in process_media_for_srt(
+                [media_path],
+                self.config.get("chunk_length_s", 60),
+                self.config.get("batch_size", 1),
+                streaming_mode=self.config.get("streaming_mode", False),
+                vad_enabled=self.config.get("vad_enabled", False),
+                vad_threshold_db=self.config.get("vad_threshold_db", -40.0),
+                chunk_overlap_s=self.config.get("chunk_overlap_s", 0),
+                prefetch_depth=0,
+                priority=self.job_priority,
+                output_srt_paths=[output_srt_path],
+            ):
+                pass
+            if srt_file_paths:
+                ledger_record["status"] = "ok"
+                with self.lock:
+                    self.processed_hashes[content_hash] = output_srt_path
+            else:
+                ledger_record["error"] = status_message
+        finally:
+            with self.lock:
+                self.active_hashes.pop(content_hash, None)
+            active_event.set()
+            self.append_ledger({**ledger_record, "finished_at": time.time()})
+
+    def start(self):
+        for root in self.watch_roots:
+            print(f"正在监视文件夹: {root}")
+        self.threads = [threading.Thread(target=self.watch_loop, name="watch-folder-scanner", daemon=True)]
+        # 处理线程数与可同时运行的任务数一致，队列中的文件不会同时全部进入调度器
+        for worker_index in range(job_scheduler.max_concurrent_jobs):
+            self.threads.append(
+                threading.Thread(
+                    target=self.process_queued_files,
+                    name=f"watch-folder-worker-{worker_index}",
+                    daemon=True,
+                )
+            )
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """停止扫描；正在处理的文件会处理完毕，队列中尚未开始的文件下次启动时重新发现。"""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+    def status(self) -> dict:
+        with self.lock:
+            processed_count = len(self.processed_hashes)
+            active_count = len(self.active_hashes)
+        return {
+            "watch_folders": self.watch_roots,
+            "pending_files": len(self.pending_files),
+            "queued_files": self.work_queue.qsize(),
+            "processing_files": active_count,
+            "processed_contents": processed_count,
+        }
+
+
+def create_watch_folder_daemon(watch_folders: list, config: dict) -> WatchFolderDaemon:
+    return WatchFolderDaemon(
+        watch_folders,
+        config,
+        poll_interval_s=config.get("watch_poll_interval_s", 5),
+        stable_s=config.get("watch_stable_s", 10),
+        queue_size=config.get("watch_queue_size", 8),
+        job_priority=config.get("watch_job_priority", -1),
+    )
+
+
+def run_watch_daemon(args, config: dict) -> int:
+    """无界面的监视文件夹模式：持续运行直到按 Ctrl+C。"""
+    model_status = load_model_for_command_line(args, config)
+    if asr_model is None:
+        print(f"错误：ASR 模型未加载，无法启动监视文件夹模式。{model_status}")
+        return 2
+    missing_folders = [folder for folder in args.watch if not os.path.isdir(folder)]
+    if missing_folders:
+        print(f"错误：监视文件夹不存在: {', '.join(missing_folders)}")
+        return 2
+    if args.chunk_length:
+        config["chunk_length_s"] = args.chunk_length
+    if args.batch_size:
+        config["batch_size"] = args.batch_size
+    if args.overlap is not None:
+        config["chunk_overlap_s"] = args.overlap
+    if args.vad:
+        config["vad_enabled"] = True
+    if args.streaming:
+        config["streaming_mode"] = True
+
+    watch_daemon = create_watch_folder_daemon(args.watch, config)
+    watch_daemon.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(f"监视文件夹状态: {json.dumps(watch_daemon.status(), ensure_ascii=False)}")
+    except KeyboardInterrupt:
+        print("正在停止监视文件夹，等待正在处理的文件完成...")
+        watch_daemon.stop()
+    return 0
+
+
+def parse_command_line_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="视频/音频自动生成 SRT 字幕工具。不带参数运行时启动 Gradio 界面。"
+    )
+    parser.add_argument(
+        "--batch",
+        dest="inputs",
+        nargs="+",
+        metavar="INPUT",
+        help="无界面批处理：目录、glob 通配符、JSONL 清单或媒体文件 (可多个)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=subtitles_folder_path,
+        help="批处理 SRT 输出目录 (默认: 脚本目录下的 subtitles)",
+    )
+    parser.add_argument("--summary", help="JSON 汇总文件路径 (默认: 输出目录/summary.json)")
+    model_group = parser.add_mutually_exclusive_group()
+    model_group.add_argument("--model", help="本地 .nemo 模型路径 (默认使用 config.json 中的选择)")
+    model_group.add_argument("--ngc", action="store_true", help="从云端 NGC 加载模型")
+    parser.add_argument("--chunk-length", type=int, help="音频分块长度 (秒)")
+    parser.add_argument("--batch-size", type=int, help="每次推理合并处理的音频块数量")
+    parser.add_argument("--overlap", type=float, help="相邻音频块的重叠长度 (秒)")
+    parser.add_argument("--vad", action="store_true", help="启用静音检测分块")
+    parser.add_argument("--streaming", action="store_true", help="启用流式解码")
+    parser.add_argument(
+        "--cpu-profile", choices=CPU_PROFILES, help="CPU 推理配置 (仅在无 GPU 时生效)"
+    )
+    parser.add_argument(
+        "--compare-cpu-profiles",
+        metavar="SAMPLE",
+        help="用样本文件依次测试各 CPU 推理配置的耗时与准确率，输出 JSON 后退出",
+    )
+    parser.add_argument(
+        "--auto-tune",
+        nargs="?",
+        const="",
+        metavar="SAMPLE",
+        help="测试不同分块长度与批处理块数，把内存预算内最快的组合保存到 config.json 后退出 (不指定样本时使用合成音频)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="在 127.0.0.1 的该端口上提供指标端点 (/metrics 与 /metrics.json)，0 表示关闭",
+    )
+    parser.add_argument(
+        "--watch",
+        nargs="+",
+        metavar="DIR",
+        help="监视文件夹模式：持续监视这些文件夹，新文件写入完成后自动生成字幕 (按 Ctrl+C 停止)",
+    )
+    parser.add_argument(
+        "--ranges",
+        metavar="RANGES",
+        help="只重新转录这些时间范围并拼接进输出目录中已有的字幕，例如 \"10:00-12:30,1:05:00-1:06:10\"",
+    )
+    parser.add_argument(
+        "--search",
+        metavar="QUERY",
+        help="在字幕检索库中检索，输出匹配分段 (JSON，时间单位为毫秒) 后退出",
+    )
+    parser.add_argument(
+        "--regenerate-srt",
+        type=int,
+        metavar="FILE_ID",
+        help="从字幕检索库重新生成指定文件 ID 的 SRT (不重新推理) 后退出",
+    )
+    parser.add_argument(
+        "--shard-workers",
+        type=int,
+        help="在 CPU 上把单个文件的音频块分给多个进程并行转录，模型权重经共享内存共用 (0 或 1 表示关闭)",
+    )
+    parser.add_argument(
+        "--memory-budget-mb", type=float, help="自动调优的峰值内存上限 (默认: 物理内存的 80%%)"
+    )
+    return parser.parse_args(argv)
+
+
+# --- Gradio 界面设置 ---
+if __name__ == "__main__":
+    command_line_args = parse_command_line_args()
+    if not check_ffmpeg():
+        print("重要提示: FFMPEG 未找到。视频和音频处理功能将受限或无法工作。")
+
+    config = load_config()
+    transcription_cache_max_bytes = int(config.get("cache_max_mb", 500) * 1024 * 1024)
+    checkpoint_enabled = bool(config.get("checkpoint_enabled", True))
+    job_scheduler.set_max_concurrent_jobs(config.get("max_concurrent_jobs", 1))
+    model_registry.set_memory_budget_mb(config.get("model_memory_budget_mb", 0))
+    transcript_store_enabled = bool(config.get("transcript_store_enabled", True))
+    shard_workers = int(
+        command_line_args.shard_workers
+        if command_line_args.shard_workers is not None
+        else config.get("shard_workers", 0)
+    )
+    metrics_log_enabled = bool(config.get("metrics_log_enabled", True))
+    metrics_port = (
+        command_line_args.metrics_port
+        if command_line_args.metrics_port is not None
+        else config.get("metrics_port", 0)
+    )
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+    if command_line_args.cpu_profile:
+        config["cpu_profile"] = command_line_args.cpu_profile
+    cpu_profile = config.get("cpu_profile", "default")
+    if command_line_args.search is not None or command_line_args.regenerate_srt is not None:
+        if get_transcript_store() is None:
+            print("错误：字幕检索库已在 config.json 中关闭 (transcript_store_enabled)。")
+            sys.exit(2)
+        if command_line_args.search is not None:
+            print(json.dumps(transcript_store.search(command_line_args.search), ensure_ascii=False, indent=2))
+            sys.exit(0)
+        regenerated_srt_path = transcript_store.regenerate_srt(command_line_args.regenerate_srt)
+        if regenerated_srt_path is None:
+            print(f"错误：字幕检索库中没有 ID 为 {command_line_args.regenerate_srt} 的文件。")
+            sys.exit(1)
+        print(f"SRT 已重新生成: {regenerated_srt_path}")
+        sys.exit(0)
+    if command_line_args.compare_cpu_profiles:
+        comparison_results = compare_cpu_profiles(command_line_args.compare_cpu_profiles, config)
+        print(json.dumps(comparison_results, ensure_ascii=False, indent=2))
+        sys.exit(0)
+    if command_line_args.auto_tune is not None:
+        tune_model_status = load_model_for_command_line(command_line_args, config)
+        if asr_model is None:
+            print(f"错误：ASR 模型未加载，无法进行自动调优。{tune_model_status}")
+            sys.exit(2)
+        if command_line_args.model:
+            config["local_model_path"] = command_line_args.model
+        elif command_line_args.ngc:
+            config["local_model_path"] = ""
+        tuning_results = auto_tune_chunk_settings(
+            config,
+            sample_media_path=command_line_args.auto_tune or None,
+            memory_budget_mb=command_line_args.memory_budget_mb,
+        )
+        print(json.dumps(tuning_results, ensure_ascii=False, indent=2))
+        sys.exit(0 if tuning_results["best"] else 1)
+    if command_line_args.watch:
+        sys.exit(run_watch_daemon(command_line_args, config))
+    if command_line_args.inputs:
+        # 命令行批处理不需要 Gradio，不导入也不启动界面
+        sys.exit(run_batch_cli(command_line_args, config))
+
+    import gradio as gr
+
+    # --- 启动时模型加载逻辑 ---
+    # saved_model_path 可以是：文件路径 (str)，"" (表示NGC)，或 None (之前未选择)
+    saved_model_path = config.get("local_model_path")
+    initial_chunk_length = config.get("chunk_length_s", 60)
+    initial_batch_size = config.get("batch_size", 1)
+    initial_streaming_mode = config.get("streaming_mode", False)
+    initial_vad_enabled = config.get("vad_enabled", False)
+    vad_threshold_db = config.get("vad_threshold_db", -40.0)
+    initial_chunk_overlap = config.get("chunk_overlap_s", 0)
+    prefetch_depth = config.get("prefetch_depth", 1)
+    # 在后台线程中加载上次选择的模型，界面无需等待即可开始服务
+    if saved_model_path is not None:
+        start_background_model_load(config)
+        initial_model_status = "模型正在后台加载，加载完成前提交的任务会自动等待..."
+    else:
+        initial_model_status = load_saved_model_from_config(config)
+    # config.json 中配置了监视文件夹时随界面一起在后台运行，其任务显示在 "任务队列" 面板中
+    if config.get("watch_folders"):
+        create_watch_folder_daemon(config["watch_folders"], config).start()
+
+    # --- Gradio UI 定义 ---
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
         gr.Markdown("# 视频/音频自动生成 SRT 字幕工具 (NeMo Parakeet)")
         gr.Markdown(
@@ -545,7 +5038,29 @@ if __name__ == "__main__":
             value=initial_chunk_length,
             step=5,
             label="音频分块长度 (秒)",
-            info="推荐60-180秒。更改后，下次点击任一“加载模型”按钮时，此设置会与模型选择一同保存。",
+            info="推荐60-180秒，也可运行 python main.py --auto-tune 按本机内存与核心数自动选择。更改后，下次点击任一“加载模型”按钮时，此设置会与模型选择一同保存。",
+        )
+        batch_size_slider = gr.Slider(
+            minimum=1,
+            maximum=16,
+            value=initial_batch_size,
+            step=1,
+            label="批处理块数",
+            info="每次推理合并处理的音频块数量。显存/内存充足时调大可缩短长音频的总耗时，设置随模型选择一同保存。",
+        )
+        chunk_overlap_slider = gr.Slider(
+            minimum=0,
+            maximum=10,
+            value=initial_chunk_overlap,
+            step=0.5,
+            label="音频块重叠长度 (秒)",
+            info="相邻音频块在边界处重叠的长度，重叠区域内的重复字幕会被自动合并。使用较短的分块 (如 60 秒) 配合 2 秒重叠，可在降低峰值内存的同时保持边界处的准确率。",
+        )
+        cpu_profile_dropdown = gr.Dropdown(
+            choices=list(CPU_PROFILES),
+            value=cpu_profile,
+            label="CPU 推理配置",
+            info="仅在无 GPU 时生效。tuned: 线程数设为物理核心数；int8: 再做动态 int8 量化；bf16: 支持的 CPU 上以 bf16 推理。下次加载模型时生效并保存。",
         )
         gr.Markdown("---")
 
@@ -554,9 +5069,63 @@ if __name__ == "__main__":
                 label="上传视频文件 (例如 MP4, MKV),或者上传音频文件 (例如 MP3, WAV, M4A)，支持音频视频混合上传",
                 file_count="multiple",
             )
-            media_submit_button = gr.Button(
-                "开始从视频/音频生成 SRT", variant="primary"
+            streaming_mode_checkbox = gr.Checkbox(
+                label="流式解码 (边解码边转录)",
+                value=initial_streaming_mode,
+                info="ffmpeg 解码与模型推理并行进行，不生成完整的中间 WAV 文件，适合体积很大的视频。",
+            )
+            vad_checkbox = gr.Checkbox(
+                label="静音检测分块 (VAD)",
+                value=initial_vad_enabled,
+                info="在停顿处切分音频块，避免把一个词切成两半，并跳过较长的静音片段以节省推理时间。分块长度作为单块的最大长度。",
+            )
+            priority_input = gr.Number(
+                label="任务优先级",
+                value=0,
+                precision=0,
+                info="多人同时使用时，数值大的任务优先执行；相同优先级按提交顺序执行。",
+            )
+            time_ranges_input = gr.Textbox(
+                label="仅重新转录时间范围 (可选)",
+                placeholder="例如 10:00-12:30, 1:05:00-1:06:10；留空则转录整个文件",
+                info="只解码并转录这些时间范围，结果按原时间戳拼接进 subtitles 文件夹中同名的已有字幕，其余部分不重新推理。",
+            )
+            job_model_input = gr.Textbox(
+                label="本任务使用的模型 (可选)",
+                placeholder="留空使用上方已加载的模型；例如 /path/to/other_model.nemo 或 ngc:nvidia/parakeet-tdt-0.6b-v2",
+                info="指定的模型首次使用时加载，之后在 config.json 的 model_memory_budget_mb 预算内常驻内存，按最近最少使用逐出。",
+            )
+            with gr.Row():
+                media_submit_button = gr.Button(
+                    "开始从视频/音频生成 SRT", variant="primary", scale=4
+                )
+                media_cancel_button = gr.Button("取消", variant="stop", scale=1, min_width=100)
+
+        with gr.Tab("字幕检索"):
+            with gr.Row():
+                with gr.Column(scale=4):
+                    search_query_input = gr.Textbox(
+                        label="检索词",
+                        placeholder="在所有已转录文件的字幕中检索，多个词以空格分隔 (需全部出现)",
+                    )
+                with gr.Column(scale=1, min_width=150):
+                    search_button = gr.Button("检索", variant="primary")
+            search_results_output = gr.Dataframe(
+                headers=["文件 ID", "文件", "开始 (ms)", "结束 (ms)", "文本"],
+                label="匹配的字幕 (按相关度排序)",
+                interactive=False,
             )
+            with gr.Row():
+                with gr.Column(scale=4):
+                    regenerate_file_id_input = gr.Number(
+                        label="文件 ID", precision=0, info="从检索结果或已索引文件列表中获取"
+                    )
+                with gr.Column(scale=1, min_width=150):
+                    regenerate_srt_button = gr.Button("重新生成 SRT", variant="secondary")
+            regenerated_srt_output = gr.File(label="重新生成的 SRT 文件", interactive=False)
+            with gr.Accordion("已索引的文件", open=False):
+                indexed_files_output = gr.JSON(label="最近索引的文件")
+                refresh_indexed_files_button = gr.Button("刷新列表", variant="secondary")
 
         status_output = gr.Textbox(label="处理状态", lines=1, interactive=False)
         with gr.Accordion("SRT字幕结果", open=True):
@@ -566,9 +5135,25 @@ if __name__ == "__main__":
             srt_preview_output = gr.Textbox(
                 label="SRT 内容预览", lines=10, max_lines=20, interactive=False
             )
+        with gr.Accordion("任务队列", open=False):
+            job_list_output = gr.JSON(label="最近的任务 (状态与进度)")
+            resident_models_output = gr.JSON(label="常驻内存的模型 (从最久未使用到最近使用)")
+            with gr.Row():
+                cancel_job_id_input = gr.Number(
+                    label="任务 ID",
+                    precision=0,
+                    info="取消排队中或运行中的任务 (包括其他页面和监视文件夹提交的任务)",
+                )
+                cancel_job_button = gr.Button("取消该任务", variant="stop")
+            refresh_jobs_button = gr.Button("刷新任务列表", variant="secondary")
 
         # --- 按钮点击处理程序 ---
-        def handle_load_local_click(path_from_input_box, chunk_val_from_slider):
+        def handle_load_local_click(
+            path_from_input_box,
+            chunk_val_from_slider,
+            batch_val_from_slider,
+            cpu_profile_val,
+        ):
             if not path_from_input_box or not path_from_input_box.strip():
                 return "错误：请输入有效的本地模型路径后点击“加载本地模型”。若要加载云端模型，请使用对应按钮。"
             return load_asr_model_globally(
@@ -576,46 +5161,170 @@ if __name__ == "__main__":
                 load_from_ngc_explicitly=False,
                 save_choice_on_success=True,
                 current_chunk_value=chunk_val_from_slider,
+                current_batch_size=batch_val_from_slider,
+                current_cpu_profile=cpu_profile_val,
             )
 
-        def handle_load_cloud_click(chunk_val_from_slider):
+        def handle_load_cloud_click(
+            chunk_val_from_slider, batch_val_from_slider, cpu_profile_val
+        ):
             return load_asr_model_globally(
                 local_model_path_to_try=None,
                 load_from_ngc_explicitly=True,
                 save_choice_on_success=True,
                 current_chunk_value=chunk_val_from_slider,
+                current_batch_size=batch_val_from_slider,
+                current_cpu_profile=cpu_profile_val,
             )
 
         load_local_model_button.click(
             fn=handle_load_local_click,
-            inputs=[local_model_path_input, chunk_slider],
+            inputs=[
+                local_model_path_input,
+                chunk_slider,
+                batch_size_slider,
+                cpu_profile_dropdown,
+            ],
             outputs=[model_status_output],
         )
         load_cloud_model_button.click(
             fn=handle_load_cloud_click,
-            inputs=[chunk_slider],  # 仅需要 chunk_slider 来保存配置
+            inputs=[chunk_slider, batch_size_slider, cpu_profile_dropdown],  # 仅需要滑块和下拉框的值来保存配置
             outputs=[model_status_output],
         )
 
+        def handle_media_submit(
+            media_files,
+            chunk_val,
+            batch_val,
+            overlap_val,
+            streaming_val,
+            vad_val,
+            priority_val,
+            job_model_val,
+            time_ranges_val,
+            request: gr.Request,
+        ):
+            yield from process_media_for_srt(
+                media_files,
+                chunk_val,
+                batch_val,
+                streaming_mode=streaming_val,
+                vad_enabled=vad_val,
+                vad_threshold_db=vad_threshold_db,
+                chunk_overlap_s=overlap_val,
+                prefetch_depth=prefetch_depth,
+                priority=int(priority_val or 0),
+                model_source=job_model_val,
+                time_ranges_text=time_ranges_val,
+                owner=request.session_hash,
+            )
+
         media_submit_button.click(
-            fn=process_media_for_srt,
-            inputs=[video_input, chunk_slider],
+            fn=handle_media_submit,
+            inputs=[
+                video_input,
+                chunk_slider,
+                batch_size_slider,
+                chunk_overlap_slider,
+                streaming_mode_checkbox,
+                vad_checkbox,
+                priority_input,
+                job_model_input,
+                time_ranges_input,
+            ],
             outputs=[status_output, srt_file_output, srt_preview_output],
+            concurrency_limit=None,  # 并发由 job_scheduler 控制
+        )
+        def handle_media_cancel(request: gr.Request):
+            # 通过调度器取消本页面提交的任务：ffmpeg 被终止、临时文件、未完成的字幕和断点日志被删除，
+            # 处理生成器随后自行结束并在状态栏显示已取消
+            cancelled_job_ids = job_scheduler.cancel_owned_jobs(request.session_hash)
+            if not cancelled_job_ids:
+                gr.Info("本页面没有排队中或运行中的任务。")
+                return
+            gr.Info(f"已请求取消任务 {', '.join(f'#{job_id}' for job_id in cancelled_job_ids)}。")
+
+        media_cancel_button.click(fn=handle_media_cancel)
+        refresh_jobs_button.click(
+            fn=lambda: (job_scheduler.list_jobs(), model_registry.list_models()),
+            outputs=[job_list_output, resident_models_output],
         )
+
+        def handle_cancel_job(job_id):
+            if job_id is None:
+                raise gr.Error("请输入任务 ID。")
+            if not job_scheduler.cancel(int(job_id)):
+                raise gr.Error(f"任务 #{int(job_id)} 不存在或已结束。")
+            gr.Info(f"已请求取消任务 #{int(job_id)}，将在当前音频块批次完成后停止。")
+            return job_scheduler.list_jobs()
+
+        cancel_job_button.click(
+            fn=handle_cancel_job,
+            inputs=[cancel_job_id_input],
+            outputs=[job_list_output],
+        )
+
+        def handle_transcript_search(query_text):
+            store = get_transcript_store()
+            if store is None:
+                raise gr.Error("字幕检索库已在 config.json 中关闭 (transcript_store_enabled)。")
+            try:
+                search_results = store.search(query_text)
+            except sqlite3.Error as e:
+                raise gr.Error(f"检索失败: {e}")
+            return [
+                [r["file_id"], r["file_name"], r["start_ms"], r["end_ms"], r["text"]]
+                for r in search_results
+            ]
+
+        def handle_regenerate_srt(file_id):
+            store = get_transcript_store()
+            if store is None:
+                raise gr.Error("字幕检索库已在 config.json 中关闭 (transcript_store_enabled)。")
+            if file_id is None:
+                raise gr.Error("请输入文件 ID。")
+            regenerated_srt_path = store.regenerate_srt(int(file_id))
+            if regenerated_srt_path is None:
+                raise gr.Error(f"字幕检索库中没有 ID 为 {int(file_id)} 的文件。")
+            return regenerated_srt_path
+
+        def handle_list_indexed_files():
+            store = get_transcript_store()
+            return store.list_files() if store is not None else []
+
+        search_button.click(
+            fn=handle_transcript_search, inputs=[search_query_input], outputs=[search_results_output]
+        )
+        search_query_input.submit(
+            fn=handle_transcript_search, inputs=[search_query_input], outputs=[search_results_output]
+        )
+        regenerate_srt_button.click(
+            fn=handle_regenerate_srt, inputs=[regenerate_file_id_input], outputs=[regenerated_srt_output]
+        )
+        refresh_indexed_files_button.click(fn=handle_list_indexed_files, outputs=[indexed_files_output])
+
+        def refresh_model_status_when_ready():
+            # 页面打开时若模型仍在后台加载，先显示加载中，加载结束后更新为最终状态
+            if not model_ready_event.is_set():
+                yield "模型正在后台加载，加载完成前提交的任务会自动等待..."
+                model_ready_event.wait()
+            yield model_load_status
+
+        demo.load(fn=refresh_model_status_when_ready, outputs=[model_status_output])
         gr.Markdown("---")
         gr.Markdown("本地 SRT 文件保存在脚本目录下的 `subtitles` 文件夹中。")
         gr.Markdown("---")
         gr.Markdown("注意: 处理速度取决于您的硬件 (GPU/CPU) 和文件大小。")
-        if device and device.type == "cpu":  # 检查设备是否已初始化
-            gr.Markdown(
-                "️️️⚠️ **警告：当前正在使用CPU运行，速度会非常慢。建议使用CUDA GPU以获得更好性能。**"
-            )
-        elif not device and torch.cuda.is_available():  # 模型尚未加载，但 GPU 可用
-            gr.Markdown("️️️ℹ️ **提示：检测到CUDA GPU。选择模型后将尝试在GPU上运行。**")
-        elif not device:  # 模型未加载，且无 GPU
-            gr.Markdown(
-                "️️️⚠️ **警告：未检测到CUDA GPU。选择模型后将在CPU上运行，速度可能较慢。**"
-            )
+        device_hint_output = gr.Markdown()
+
+        def get_device_hint_markdown():
+            # 页面打开时才检测设备：torch 在此 (或后台加载模型时) 导入，不拖慢界面启动
+            if get_inference_device().type == "cpu":
+                return "️️️⚠️ **警告：当前正在使用CPU运行，速度会非常慢。建议使用CUDA GPU以获得更好性能。**"
+            return "️️️ℹ️ **提示：检测到CUDA GPU，模型将在GPU上运行。**"
+
+        demo.load(fn=get_device_hint_markdown, outputs=[device_hint_output])
 
     print("Gradio 界面即将启动...")
     demo.launch()
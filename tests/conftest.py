@@ -0,0 +1,92 @@
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class StubHypothesis:
+    def __init__(self, text, segments):
+        self.text = text
+        self.timestamp = {"segment": segments}
+
+
+class StubModel:
+    """替身模型：每 4 秒音频产出一个分段，文本为 "w<块内起始秒数>"，不需要 torch/NeMo。"""
+
+    def __init__(self, segment_s: float = 4.0):
+        self.segment_s = segment_s
+        self.transcribe_calls = []
+
+    def transcribe(self, audio, batch_size=1, timestamps=True, **kwargs):
+        self.transcribe_calls.append(len(audio))
+        hypotheses = []
+        for item in audio:
+            if isinstance(item, str):
+                with wave.open(item) as wav_file:
+                    samples = np.frombuffer(
+                        wav_file.readframes(wav_file.getnframes()), dtype=np.int16
+                    )
+            else:
+                samples = np.asarray(item)
+            duration_s = len(samples) / main.TARGET_SAMPLE_RATE
+            segments = []
+            start_s = 0.0
+            while start_s < duration_s - 0.5:
+                end_s = min(start_s + self.segment_s, duration_s)
+                segments.append({"start": start_s, "end": end_s, "segment": f"w{start_s:.0f}"})
+                start_s += self.segment_s
+            hypotheses.append(
+                StubHypothesis(" ".join(s["segment"] for s in segments), segments)
+            )
+        return hypotheses
+
+
+def write_pcm_wav(path, duration_s: float):
+    """写入 16kHz 单声道 16-bit PCM 正弦波 WAV (模型可直接使用的格式，无需 ffmpeg)。"""
+    t = np.arange(int(duration_s * main.TARGET_SAMPLE_RATE)) / main.TARGET_SAMPLE_RATE
+    samples = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16)
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(main.TARGET_SAMPLE_RATE)
+        wav_file.writeframes(samples.tobytes())
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def isolated_paths(tmp_path, monkeypatch):
+    """把缓存、断点日志、字幕、检索库等输出全部重定向到临时目录。"""
+    monkeypatch.setattr(main, "subtitles_folder_path", str(tmp_path / "subtitles"))
+    monkeypatch.setattr(main, "transcription_cache_folder_path", str(tmp_path / "cache"))
+    monkeypatch.setattr(main, "checkpoint_folder_path", str(tmp_path / "checkpoints"))
+    monkeypatch.setattr(main, "transcript_store_path", str(tmp_path / "transcripts.sqlite3"))
+    monkeypatch.setattr(main, "transcript_store", None)
+    monkeypatch.setattr(main, "metrics_log_enabled", False)
+    monkeypatch.setattr(main, "transcription_cache_max_bytes", 0)
+    monkeypatch.setattr(main, "shard_workers", 0)
+    yield
+    main.shutdown_shard_worker_pool()
+    if main.transcript_store is not None:
+        main.transcript_store.connection.close()
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    model = StubModel()
+    monkeypatch.setattr(main, "asr_model", model)
+    monkeypatch.setattr(main, "asr_model_identity", "stub-model")
+    return model
+
+
+@pytest.fixture
+def make_wav(tmp_path):
+    def make(name: str, duration_s: float):
+        return write_pcm_wav(tmp_path / name, duration_s)
+
+    return make
@@ -0,0 +1,58 @@
+import json
+import os
+
+import main
+from conftest import StubModel
+
+
+def run_cli(argv, monkeypatch, model):
+    def load_stub_model(args, config):
+        monkeypatch.setattr(main, "asr_model", model)
+        monkeypatch.setattr(main, "asr_model_identity", "stub-model")
+        return "ok"
+
+    monkeypatch.setattr(main, "load_model_for_command_line", load_stub_model)
+    args = main.parse_command_line_args(argv)
+    return main.run_batch_cli(args, {"chunk_length_s": 10, "prefetch_depth": 1})
+
+
+def test_batch_run_writes_srt_and_summary(tmp_path, monkeypatch, make_wav):
+    input_dir = tmp_path / "inputs"
+    input_dir.mkdir()
+    make_wav("inputs/a.wav", 25)
+    make_wav("inputs/b.wav", 12)
+    output_dir = tmp_path / "out"
+
+    exit_code = run_cli(
+        ["--batch", str(input_dir), "--output-dir", str(output_dir)], monkeypatch, StubModel()
+    )
+
+    assert exit_code == 0
+    for name in ("a", "b"):
+        segments = main.parse_srt_segments(str(output_dir / f"{name}.srt"))
+        assert segments and segments[0]["segment"] == "w0"
+    with open(output_dir / "summary.json", encoding="utf-8") as summary_file:
+        summary = json.load(summary_file)
+    assert [item["status"] for item in summary["files"]] == ["ok", "ok"]
+
+
+def test_batch_ranges_splice_into_existing_srt(tmp_path, monkeypatch, make_wav):
+    media_path = make_wav("c.wav", 40)
+    output_dir = tmp_path / "out"
+    exit_code = run_cli(["--batch", media_path, "--output-dir", str(output_dir)], monkeypatch, StubModel())
+    assert exit_code == 0
+    srt_path = str(output_dir / "c.srt")
+    before = main.parse_srt_segments(srt_path)
+
+    model = StubModel()
+    exit_code = run_cli(
+        ["--batch", media_path, "--output-dir", str(output_dir), "--ranges", "20-28"],
+        monkeypatch,
+        model,
+    )
+
+    assert exit_code == 0
+    after = main.parse_srt_segments(srt_path)
+    assert [s["start"] for s in after] == [s["start"] for s in before]
+    assert sum(model.transcribe_calls) == 1  # 只转录了一个范围
+    assert os.path.exists(srt_path) and not os.path.exists(srt_path + ".part")
@@ -0,0 +1,91 @@
+import glob
+import os
+import time
+
+import main
+from conftest import StubModel
+
+
+class CancellingModel(StubModel):
+    """在第 cancel_on_call 次推理时调用 on_cancel，模拟用户在转录中途取消任务。"""
+
+    def __init__(self, cancel_on_call: int, on_cancel=None, delay_s: float = 0.0):
+        super().__init__()
+        self.cancel_on_call = cancel_on_call
+        self.on_cancel = on_cancel
+        self.delay_s = delay_s
+
+    def transcribe(self, audio, **kwargs):
+        time.sleep(self.delay_s)
+        if len(self.transcribe_calls) + 1 == self.cancel_on_call and self.on_cancel:
+            self.on_cancel()
+        return super().transcribe(audio, **kwargs)
+
+
+def journal_files():
+    return glob.glob(os.path.join(main.checkpoint_folder_path, "*.jsonl"))
+
+
+def latest_job():
+    return main.job_scheduler.list_jobs()[-1]
+
+
+def test_explicit_cancel_stops_job_and_removes_partial_outputs(monkeypatch, make_wav):
+    media_path = make_wav("long.wav", 120)
+    model = CancellingModel(
+        3, on_cancel=lambda: main.job_scheduler.cancel(latest_job()["job_id"])
+    )
+    monkeypatch.setattr(main, "asr_model", model)
+    monkeypatch.setattr(main, "asr_model_identity", "stub-model")
+
+    outputs = list(main.process_media_for_srt([media_path], 10))
+
+    assert "已取消" in outputs[-1][0]
+    assert latest_job()["status"] == "cancelled"
+    assert len(model.transcribe_calls) == 3  # 取消后不再推理后续音频块
+    srt_path = os.path.join(main.subtitles_folder_path, "long.srt")
+    assert not os.path.exists(srt_path) and not os.path.exists(srt_path + ".part")
+    assert journal_files() == []
+
+
+def test_page_disconnect_keeps_checkpoint_for_resume(monkeypatch, make_wav):
+    media_path = make_wav("long.wav", 120)
+    model = CancellingModel(0, delay_s=0.3)
+    monkeypatch.setattr(main, "asr_model", model)
+    monkeypatch.setattr(main, "asr_model_identity", "stub-model")
+
+    job_generator = main.process_media_for_srt([media_path], 10)
+    for _ in job_generator:
+        if len(model.transcribe_calls) >= 3:
+            break
+    job_generator.close()  # Gradio 在页面断开时关闭处理生成器
+
+    assert latest_job()["status"] == "cancelled"
+    assert len(model.transcribe_calls) < 12
+    assert len(journal_files()) == 1
+
+    # 重新提交同一文件时从断点继续，已完成的音频块不再推理
+    resumed_model = StubModel()
+    monkeypatch.setattr(main, "asr_model", resumed_model)
+    list(main.process_media_for_srt([media_path], 10))
+    assert len(resumed_model.transcribe_calls) == 12 - len(model.transcribe_calls)
+    assert journal_files() == []
+
+
+def test_cancel_queued_job_by_owner(stub_model, make_wav):
+    media_path = make_wav("short.wav", 10)
+    main.job_scheduler.set_max_concurrent_jobs(1)
+    blocker = main.job_scheduler.submit("blocker")
+    assert main.job_scheduler.wait_for_turn(blocker, timeout=1)
+    try:
+        job_generator = main.process_media_for_srt([media_path], 10, owner="session-a")
+        status, _, _ = next(job_generator)
+        assert "排队中" in status
+        assert main.job_scheduler.cancel_owned_jobs("session-b") == []
+        assert len(main.job_scheduler.cancel_owned_jobs("session-a")) == 1
+        remaining = list(job_generator)
+        assert "取消" in remaining[-1][0]
+        assert latest_job()["status"] == "cancelled"
+        assert stub_model.transcribe_calls == []
+    finally:
+        main.job_scheduler.finish(blocker)
@@ -0,0 +1,72 @@
+import glob
+import os
+
+import pytest
+
+import main
+from conftest import StubModel
+
+
+class FlakyModel(StubModel):
+    """第 fail_on_call 次推理抛出异常，模拟中途出错的音频块 (配合 in_memory=False，避免回退路径重试)。"""
+
+    def __init__(self, fail_on_call: int):
+        super().__init__()
+        self.fail_on_call = fail_on_call
+
+    def transcribe(self, audio, **kwargs):
+        if len(self.transcribe_calls) + 1 == self.fail_on_call:
+            self.transcribe_calls.append(len(audio))
+            raise RuntimeError("模拟推理失败")
+        return super().transcribe(audio, **kwargs)
+
+
+def journal_files():
+    return glob.glob(os.path.join(main.checkpoint_folder_path, "*.jsonl"))
+
+
+@pytest.fixture(autouse=True)
+def checkpoints_on(monkeypatch):
+    monkeypatch.setattr(main, "checkpoint_enabled", True)
+
+
+def test_failed_chunk_is_retried_from_journal(make_wav):
+    audio_path = make_wav("long.wav", 60)
+    expected = main.transcribe_audio_in_chunks(
+        StubModel(), audio_path, 10000, model_identity="stub-model"
+    )
+    assert journal_files() == []
+
+    main.transcribe_audio_in_chunks(
+        FlakyModel(fail_on_call=4), audio_path, 10000, in_memory=False, model_identity="stub-model"
+    )
+    assert len(journal_files()) == 1  # 有音频块失败时保留断点日志
+
+    resumed_model = StubModel()
+    resumed = main.transcribe_audio_in_chunks(
+        resumed_model, audio_path, 10000, model_identity="stub-model"
+    )
+    assert resumed_model.transcribe_calls == [1]  # 只重新推理失败的那一块
+    assert resumed == expected
+    assert journal_files() == []
+
+
+def test_journal_is_keyed_by_chunk_settings(make_wav):
+    audio_path = make_wav("long.wav", 40)
+    main.transcribe_audio_in_chunks(
+        FlakyModel(fail_on_call=2), audio_path, 10000, in_memory=False, model_identity="stub-model"
+    )
+    assert len(journal_files()) == 1
+
+    # 分块长度不同时旧日志不适用，全部重新推理
+    other_model = StubModel()
+    main.transcribe_audio_in_chunks(other_model, audio_path, 20000, model_identity="stub-model")
+    assert len(other_model.transcribe_calls) == 2
+
+
+def test_media_identity_changes_within_the_same_second(make_wav):
+    media_path = make_wav("clip.wav", 1)
+    os.utime(media_path, ns=(1_700_000_000_100_000_000, 1_700_000_000_100_000_000))
+    first_identity = main.get_media_file_identity(media_path)
+    os.utime(media_path, ns=(1_700_000_000_900_000_000, 1_700_000_000_900_000_000))
+    assert main.get_media_file_identity(media_path) != first_identity
@@ -0,0 +1,22 @@
+import json
+
+import main
+
+
+def test_missing_keys_take_defaults(tmp_path, monkeypatch):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"chunk_length_s": 30, "extra_key": 1}), encoding="utf-8")
+    monkeypatch.setattr(main, "get_config_file_path", lambda: str(config_path))
+
+    config = main.load_config()
+
+    assert config["chunk_length_s"] == 30
+    assert config["extra_key"] == 1
+    assert config["batch_size"] == 1
+    assert config["transcript_store_enabled"] is True
+
+
+def test_missing_file_returns_defaults(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "get_config_file_path", lambda: str(tmp_path / "missing.json"))
+    config = main.load_config()
+    assert config["chunk_length_s"] == 60 and config["watch_folders"] == []
@@ -0,0 +1,62 @@
+import sys
+import types
+
+import pytest
+
+import main
+from conftest import StubModel
+
+
+@pytest.fixture
+def fake_torch(monkeypatch):
+    """只提供线程设置接口的 torch 替身，记录当前线程数。"""
+    torch_module = types.SimpleNamespace(threads=[3, 2])
+    torch_module.get_num_threads = lambda: torch_module.threads[0]
+    torch_module.get_num_interop_threads = lambda: torch_module.threads[1]
+
+    def set_num_threads(thread_count):
+        torch_module.threads[0] = thread_count
+
+    def set_num_interop_threads(thread_count):
+        torch_module.threads[1] = thread_count
+
+    torch_module.set_num_threads = set_num_threads
+    torch_module.set_num_interop_threads = set_num_interop_threads
+    monkeypatch.setitem(sys.modules, "torch", torch_module)
+    return torch_module
+
+
+class ThreadRecordingModel(StubModel):
+    def __init__(self, torch_module):
+        super().__init__()
+        self.torch_module = torch_module
+        self.observed_threads = []
+
+    def transcribe(self, audio, **kwargs):
+        self.observed_threads.append(tuple(self.torch_module.threads))
+        return super().transcribe(audio, **kwargs)
+
+
+@pytest.mark.parametrize("profiles", [("tuned", "default"), ("default", "tuned")])
+def test_profile_comparison_restores_thread_settings(monkeypatch, make_wav, fake_torch, profiles):
+    media_path = make_wav("sample.wav", 10)
+    model = ThreadRecordingModel(fake_torch)
+    monkeypatch.setattr(main, "preprocess_direct_audio", lambda path: path)
+    monkeypatch.setattr(main, "get_physical_cpu_count", lambda: 16)
+
+    def fake_load(current_cpu_profile=None, **kwargs):
+        main.asr_model = model
+        if current_cpu_profile != "default":
+            main.set_torch_thread_counts(16)
+        return "ok"
+
+    monkeypatch.setattr(main, "load_asr_model_globally", fake_load)
+    monkeypatch.setattr(main, "asr_model", None)
+
+    results = main.compare_cpu_profiles(media_path, {"chunk_length_s": 10}, profiles)
+
+    observed = dict(zip(profiles, model.observed_threads))
+    assert observed["default"] == (3, 2)
+    assert observed["tuned"] == (16, 4)
+    assert [result["profile"] for result in results] == list(profiles)
+    assert tuple(fake_torch.threads) == (3, 2)
@@ -0,0 +1,31 @@
+import main
+from conftest import StubModel
+
+
+class ProgressRecordingModel(StubModel):
+    """每次推理前记录当前任务的进度。"""
+
+    def __init__(self):
+        super().__init__()
+        self.observed_progress = []
+
+    def transcribe(self, audio, **kwargs):
+        self.observed_progress.append(main.job_scheduler.list_jobs()[-1]["progress"])
+        return super().transcribe(audio, **kwargs)
+
+
+def test_job_progress_advances_per_chunk(monkeypatch, make_wav):
+    media_paths = [make_wav("a.wav", 60), make_wav("b.wav", 60)]
+    model = ProgressRecordingModel()
+    monkeypatch.setattr(main, "asr_model", model)
+    monkeypatch.setattr(main, "asr_model_identity", "stub-model")
+
+    list(main.process_media_for_srt(media_paths, 10))
+
+    progress = model.observed_progress
+    assert len(progress) == 12
+    assert progress == sorted(progress)
+    # 第一个文件转录期间进度已在 0 与 0.5 之间推进，而不是停在 0 直到文件结束
+    assert 0.0 < progress[3] < 0.5
+    assert 0.5 < progress[9] < 1.0
+    assert main.job_scheduler.list_jobs()[-1]["progress"] == 1.0
@@ -0,0 +1,54 @@
+import main
+
+
+def segment(start, end, text):
+    return {"start": start, "end": end, "segment": text}
+
+
+def merge(*chunks):
+    merger = main.ChunkSegmentMerger()
+    merged = []
+    for chunk_start, chunk_end, segments in chunks:
+        merged.extend(merger.add_chunk(chunk_start, chunk_end, segments))
+    merged.extend(merger.flush())
+    return merged
+
+
+def texts(segments):
+    return [item["segment"] for item in segments]
+
+
+def test_duplicate_across_boundary_keeps_longer_text():
+    merged = merge(
+        (0.0, 12.0, [segment(0.0, 4.0, "hello world"), segment(8.0, 11.5, "good morning everyone")]),
+        (10.0, 22.0, [segment(10.1, 11.9, "morning everyone"), segment(12.0, 16.0, "next")]),
+    )
+    assert texts(merged) == ["hello world", "good morning everyone", "next"]
+
+
+def test_duplicate_beyond_the_boundary_pair_is_removed():
+    merged = merge(
+        (0.0, 14.0, [segment(10.0, 11.5, "see you tomorrow"), segment(11.5, 11.9, "ok")]),
+        (10.0, 24.0, [segment(11.0, 13.2, "see you tomorrow"), segment(13.2, 14.0, "bye")]),
+    )
+    assert texts(merged).count("see you tomorrow") == 1
+    assert "ok" in texts(merged) and "bye" in texts(merged)
+
+
+def test_tail_is_kept_when_next_chunk_failed():
+    tail = segment(10.5, 12.0, "last words")
+    merged = merge(
+        (0.0, 12.0, [segment(0.0, 4.0, "first"), tail]),
+        (10.0, 22.0, None),
+        (20.0, 30.0, [segment(22.0, 25.0, "later")]),
+    )
+    assert texts(merged) == ["first", "last words", "later"]
+
+
+def test_dissimilar_overlap_is_trimmed_to_stay_monotonic():
+    merged = merge(
+        (0.0, 12.0, [segment(9.0, 11.8, "alpha beta")]),
+        (10.0, 22.0, [segment(11.0, 13.0, "gamma delta")]),
+    )
+    assert texts(merged) == ["alpha beta", "gamma delta"]
+    assert merged[0]["end"] <= merged[1]["start"]
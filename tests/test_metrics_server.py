@@ -0,0 +1,31 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def metrics_url():
+    metrics_server = main.start_metrics_server(0)
+    host, port = metrics_server.server_address
+    yield f"http://{host}:{port}"
+    metrics_server.shutdown()
+    metrics_server.server_close()
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/metrics?format=prometheus", "/metrics.json?x=1"])
+def test_metrics_routes_ignore_query_strings(metrics_url, path):
+    with urllib.request.urlopen(metrics_url + path) as response:
+        assert response.status == 200
+        body = response.read().decode("utf-8")
+    if ".json" in path:
+        assert "jobs" in json.loads(body)
+
+
+def test_unknown_route_is_404(metrics_url):
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(metrics_url + "/metricsx")
+    assert excinfo.value.code == 404
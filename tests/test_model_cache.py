@@ -0,0 +1,54 @@
+import concurrent.futures
+import os
+import tarfile
+
+import main
+
+
+def make_nemo_archive(path):
+    config_path = path.parent / "model_config.yaml"
+    config_path.write_text("name: stub\n", encoding="utf-8")
+    with tarfile.open(path, "w") as nemo_archive:
+        nemo_archive.add(config_path, arcname="model_config.yaml")
+    return str(path)
+
+
+def test_concurrent_extraction_shares_one_directory(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "model_cache"
+    monkeypatch.setattr(main, "model_cache_folder_path", str(cache_dir))
+    nemo_path = make_nemo_archive(tmp_path / "model.nemo")
+    path_hash = os.path.basename(main.extract_nemo_archive(nemo_path)).split("-")[0]
+    for leftover in os.listdir(cache_dir):
+        if not leftover.endswith(".lock"):
+            main.shutil.rmtree(cache_dir / leftover)
+    stale_dir = cache_dir / f"{path_hash}-1-1"
+    in_progress_dir = cache_dir / f"{path_hash}-abc.partial"
+    stale_dir.mkdir()
+    in_progress_dir.mkdir()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+        extracted_dirs = list(executor.map(lambda _: main.extract_nemo_archive(nemo_path), range(6)))
+
+    assert len(set(extracted_dirs)) == 1
+    assert os.path.isfile(os.path.join(extracted_dirs[0], "model_config.yaml"))
+    assert not stale_dir.exists()
+    assert in_progress_dir.exists()  # 其它进程正在写入的临时目录不会被清理
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".partial") and name != in_progress_dir.name]
+
+
+def test_existing_target_after_lost_race_is_success(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "model_cache"
+    monkeypatch.setattr(main, "model_cache_folder_path", str(cache_dir))
+    nemo_path = make_nemo_archive(tmp_path / "model.nemo")
+    original_replace = os.replace
+
+    def replace_after_sibling_finished(source, target):
+        # 模拟另一个 (不持有本锁的) 进程恰好先完成了解压
+        os.makedirs(target)
+        open(os.path.join(target, "model_config.yaml"), "w").close()
+        return original_replace(source, target)
+
+    monkeypatch.setattr(main.os, "replace", replace_after_sibling_finished)
+    extracted_dir = main.extract_nemo_archive(nemo_path)
+    assert os.path.isfile(os.path.join(extracted_dir, "model_config.yaml"))
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".partial")]
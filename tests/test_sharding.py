@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+import pytest
+
+import main
+from conftest import StubModel
+
+
+class LoggingModel(StubModel):
+    """每次推理把 "<进程号>" 追加到 log_path，可在工作进程中使用 (按引用 pickle)。"""
+
+    def __init__(self, log_path: str, delay_s: float = 0.0):
+        super().__init__()
+        self.log_path = log_path
+        self.delay_s = delay_s
+
+    def transcribe(self, audio, **kwargs):
+        with open(self.log_path, "a", encoding="utf-8") as log_file:
+            log_file.write(f"{os.getpid()}\n")
+        time.sleep(self.delay_s)
+        return super().transcribe(audio, **kwargs)
+
+
+def read_log(log_path):
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, encoding="utf-8") as log_file:
+        return log_file.read().split()
+
+
+@pytest.fixture
+def sharding_on(monkeypatch):
+    monkeypatch.setattr(main, "shard_workers", 2)
+    monkeypatch.setattr(main, "get_physical_cpu_count", lambda: 2)
+
+
+def test_shard_workers_are_not_forked():
+    assert main.get_shard_start_method() in ("forkserver", "spawn")
+
+
+def test_sharded_results_match_single_process(make_wav, tmp_path, monkeypatch, sharding_on):
+    audio_path = make_wav("long.wav", 60)
+    log_path = str(tmp_path / "calls.log")
+    model = LoggingModel(log_path, delay_s=0.05)
+    monkeypatch.setattr(main, "shard_workers", 0)
+    expected = main.transcribe_audio_in_chunks(StubModel(), audio_path, 10000)
+    monkeypatch.setattr(main, "shard_workers", 2)
+
+    yielded_spans = []
+    original_iter = main.iter_sharded_chunk_transcriptions
+
+    def recording_iter(*args, **kwargs):
+        for start_ms, end_ms, segments in original_iter(*args, **kwargs):
+            yielded_spans.append((start_ms, end_ms))
+            yield start_ms, end_ms, segments
+
+    monkeypatch.setattr(main, "iter_sharded_chunk_transcriptions", recording_iter)
+    sharded = main.transcribe_audio_in_chunks(model, audio_path, 10000)
+
+    assert yielded_spans == [(start, start + 10000) for start in range(0, 60000, 10000)]
+    assert sharded == expected
+    worker_pids = set(read_log(log_path))
+    assert len(read_log(log_path)) == 6
+    assert str(os.getpid()) not in worker_pids  # 推理全部发生在工作进程中
+    assert model.transcribe_calls == []
+
+
+def test_pool_is_reused_across_files_and_srt_matches(make_wav, tmp_path, monkeypatch, sharding_on):
+    media_paths = [make_wav("a.wav", 40), make_wav("b.wav", 40)]
+    model = LoggingModel(str(tmp_path / "calls.log"))
+    monkeypatch.setattr(main, "asr_model", model)
+    monkeypatch.setattr(main, "asr_model_identity", "stub-model")
+
+    list(main.process_media_for_srt(media_paths[:1], 10))
+    first_pool = main.shard_worker_pool
+    list(main.process_media_for_srt(media_paths[1:], 10))
+    assert main.shard_worker_pool is first_pool  # 第二个文件复用同一个工作进程池
+
+    sharded_srt = {}
+    for name in ("a.srt", "b.srt"):
+        with open(os.path.join(main.subtitles_folder_path, name), encoding="utf-8") as srt_file:
+            sharded_srt[name] = srt_file.read()
+    monkeypatch.setattr(main, "shard_workers", 0)
+    list(main.process_media_for_srt(media_paths, 10))
+    for name, content in sharded_srt.items():
+        with open(os.path.join(main.subtitles_folder_path, name), encoding="utf-8") as srt_file:
+            assert srt_file.read() == content
+
+
+def test_cancel_stops_after_in_flight_shards(make_wav, tmp_path, sharding_on):
+    audio_path = make_wav("long.wav", 120)
+    log_path = str(tmp_path / "calls.log")
+    model = LoggingModel(log_path, delay_s=0.4)
+    cancel_event = threading.Event()
+
+    with pytest.raises(main.JobCancelledError):
+        main.transcribe_audio_in_chunks(
+            model,
+            audio_path,
+            10000,
+            on_segments_ready=lambda segments: cancel_event.set(),
+            cancel_event=cancel_event,
+        )
+
+    calls_at_return = len(read_log(log_path))
+    assert calls_at_return < 12
+    assert len(set(read_log(log_path))) == 2  # 两个工作进程并行推理
+    time.sleep(1.0)
+    assert len(read_log(log_path)) == calls_at_return  # 返回前正在推理的分片已完成，其余分片已撤销
+
+    # 取消后池仍可用于下一个文件
+    assert len(main.transcribe_audio_in_chunks(model, audio_path, 10000)) == 36
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import main
+
+
+def segment(start, end, text):
+    return {"start": start, "end": end, "segment": text}
+
+
+def test_parse_time_ranges_merges_and_sorts():
+    assert main.parse_time_ranges("1:05:00-1:06:10; 10:00-12:30, 11:00-13:00\n600-601") == [
+        (600_000, 780_000),
+        (3_900_000, 3_970_000),
+    ]
+    assert main.parse_time_ranges("1.5-2.25") == [(1500, 2250)]
+
+
+@pytest.mark.parametrize("text", ["10", "10-5", "1-2-3", "a-b", "1:2:3:4-5"])
+def test_parse_time_ranges_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        main.parse_time_ranges(text)
+
+
+def test_ranges_expand_to_cut_segments():
+    segments = [segment(0.0, 4.0, "a"), segment(4.0, 8.0, "b"), segment(8.0, 12.0, "c")]
+    assert main.expand_ranges_to_segment_boundaries([(5000, 9000)], segments) == [(4000, 12000)]
+
+
+def test_splice_replaces_only_the_ranges():
+    existing = [segment(0.0, 4.0, "a"), segment(4.0, 8.0, "b"), segment(8.0, 12.0, "c")]
+    spliced = main.splice_segments(existing, [segment(4.2, 7.5, "B")], [(4000, 8000)])
+    assert [item["segment"] for item in spliced] == ["a", "B", "c"]
+
+
+def test_retranscribe_splices_into_existing_srt(stub_model, make_wav, tmp_path):
+    media_path = make_wav("talk.wav", 40)
+    output_srt_path = str(tmp_path / "talk.srt")
+    full_segments = main.transcribe_audio_in_chunks(stub_model, media_path, 10000)
+    with open(output_srt_path, "w", encoding="utf-8") as srt_file:
+        srt_file.write(main.generate_srt_content([{**item, "segment": "old"} for item in full_segments]))
+    stub_model.transcribe_calls.clear()
+
+    spliced = main.retranscribe_time_ranges(
+        stub_model, media_path, [(21_000, 23_000)], output_srt_path, 10000
+    )
+
+    assert len(stub_model.transcribe_calls) == 1
+    replaced = [item for item in spliced if item["segment"] != "old"]
+    assert [(item["start"], item["end"]) for item in replaced] == [(20.0, 24.0)]
+    assert len(spliced) == len(full_segments)
+    assert main.parse_srt_segments(output_srt_path) == spliced
+    assert not os.path.exists(output_srt_path + ".part")
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import main
+
+
+def segment(start, end, text):
+    return {"start": start, "end": end, "segment": text}
+
+
+@pytest.fixture
+def store(tmp_path):
+    transcript_store = main.TranscriptStore(str(tmp_path / "store.sqlite3"))
+    yield transcript_store
+    transcript_store.connection.close()
+
+
+@pytest.mark.parametrize("fts_enabled", [True, False])
+def test_search_finds_segments_across_files(store, fts_enabled):
+    if fts_enabled and not store.fts_enabled:
+        pytest.skip("SQLite 未编译 FTS5")
+    store.fts_enabled = fts_enabled
+    store.add_transcript("/media/a.mp4", "m", [segment(0.0, 2.0, "hello world"), segment(2.0, 4.0, "bye")])
+    store.add_transcript("/media/b.mp4", "m", [segment(5.0, 6.5, "World peace, hello")])
+
+    results = store.search("hello world")
+
+    assert sorted((item["file_name"], item["start_ms"]) for item in results) == [
+        ("a.mp4", 0),
+        ("b.mp4", 5000),
+    ]
+    assert store.search("missing") == [] and store.search("  ") == []
+
+
+def test_reindexing_replaces_previous_segments(store):
+    store.add_transcript("/media/a.mp4", "m", [segment(0.0, 2.0, "first take")])
+    file_id = store.add_transcript("/media/a.mp4", "m", [segment(0.0, 2.0, "second take")])
+
+    assert store.search("first") == []
+    assert store.find_file_id("/media/a.mp4", "m") == file_id
+    assert [item["segments"] for item in store.list_files()] == [1]
+
+
+def test_regenerate_srt_matches_transcription(stub_model, make_wav, monkeypatch):
+    monkeypatch.setattr(main, "transcript_store_enabled", True)
+    media_path = make_wav("talk.wav", 30)
+    list(main.process_media_for_srt([media_path], 10))
+    srt_path = os.path.join(main.subtitles_folder_path, "talk.srt")
+    with open(srt_path, encoding="utf-8") as srt_file:
+        original_srt = srt_file.read()
+
+    store = main.get_transcript_store()
+    file_id = store.list_files()[0]["file_id"]
+    os.remove(srt_path)
+
+    assert store.regenerate_srt(file_id) == srt_path
+    with open(srt_path, encoding="utf-8") as srt_file:
+        assert srt_file.read() == original_srt
+    assert store.regenerate_srt(file_id + 100) is None